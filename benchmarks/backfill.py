@@ -0,0 +1,103 @@
+'''
+description:    Benchmark of the backfill of the FRBCat database
+license:        APACHE 2.0
+author:         Ronald van Haren, NLeSC (r.vanharen@esciencecenter.nl)
+
+Compare the database time of the sequential batch ingest
+(batch_VOEvent) with the COPY staging backfill (backfill_VOEvent) for
+the same number of new events, four events per FRB. The test VOEvent
+is parsed once and copied with unique event ivorns and FRB names, so
+only the database work is measured. The events are added to the
+database DBNAME, use a scratch database (e.g. one created with
+db/create_db.sh). The connection settings are taken from the libpq
+environment variables (PGHOST, PGUSER, ...):
+
+    python benchmarks/backfill.py DBNAME [events] [batch_size]
+'''
+import os
+import sys
+import time
+import uuid
+
+# import pyfrbcatdb from this checkout
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from pyfrbcatdb import dbase  # noqa: E402
+from pyfrbcatdb.backfill_VOEvent import backfill_VOEvent  # noqa: E402
+from pyfrbcatdb.batch_VOEvent import batch_VOEvent  # noqa: E402
+from pyfrbcatdb.logger import logger  # noqa: E402
+from pyfrbcatdb.parallel_VOEvent import parse_record  # noqa: E402
+
+
+def replace(items, column, value):
+    '''
+    Copy of the mapping items of a table with a new value of column.
+    '''
+    items = [dict(item) for item in items]
+    for item in items:
+        if item.get('column') == column:
+            item['value'] = value
+    return items
+
+
+def records(mapping, events):
+    '''
+    Copies of a parsed VOEvent with unique event ivorns and FRB names.
+    '''
+    tag = uuid.uuid4().hex[:8]
+    batch = []
+    for idx in range(events):
+        event = dict(mapping)
+        event['frbs'] = replace(mapping['frbs'], 'name',
+                                'FRBBENCH{}_{}'.format(tag, idx // 4))
+        event['radio_measured_params'] = replace(
+            mapping['radio_measured_params'], 'voevent_ivorn',
+            'ivo://frbcatdb.bench/{}#{}'.format(tag, idx))
+        batch.append(('bench{}'.format(idx), event, ('new', None)))
+    return batch
+
+
+def writer(cls, dbName, batch_size):
+    '''
+    Ingest class connected to dbName, without VOEvents to process.
+    '''
+    ingest = cls.__new__(cls)
+    logger.__init__(ingest, os.devnull)
+    ingest.connection, ingest.cursor = dbase.connectToDB(dbName)
+    ingest.batch_size = batch_size
+    ingest.cte = False
+    ingest.columns = None
+    ingest.batch_stats = []
+    return ingest
+
+
+def measure(cls, dbName, mapping, events, batch_size):
+    '''
+    Return the seconds to write events with cls and the batch stats.
+    '''
+    ingest = writer(cls, dbName, batch_size)
+    batch = records(mapping, events)
+    start = time.time()
+    for idx in range(0, events, batch_size):
+        ingest.write_batch(batch[idx:idx + batch_size])
+    seconds = time.time() - start
+    dbase.closeDBConnection(ingest.connection, ingest.cursor)
+    return seconds, ingest.batch_stats
+
+
+def main(dbName, events=10000, batch_size=10000):
+    events, batch_size = int(events), int(batch_size)
+    name, mapping, event_type, error = parse_record(
+        os.path.join(ROOT, 'test_data', 'Detection_unitTest1.xml'))
+    print("{:<10} {:>8} {:>10} {:>12}".format('ingest', 'events', 'seconds',
+                                              'events/s'))
+    for label, cls in [('batch', batch_VOEvent),
+                       ('backfill', backfill_VOEvent)]:
+        seconds, stats = measure(cls, dbName, mapping, events, batch_size)
+        added = sum(s['added'] for s in stats)
+        print("{:<10} {:>8d} {:>10.2f} {:>12.1f}".format(
+            label, added, seconds, added / seconds))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,146 @@
+'''
+description:    Benchmark of the compressed CSV export of the FRBCat database
+license:        APACHE 2.0
+author:         Ronald van Haren, NLeSC (r.vanharen@esciencecenter.nl)
+
+Compare the time and the bytes on disk of the CSV export (writeCSV)
+without compression, with gzip or zstd compression while the rows
+stream out of COPY, and with the uncompressed export compressed with
+gzip afterwards, of the typed Parquet export (writeColumnar,
+needs pyarrow) and of the CSV, JSON and VOTable export in a single
+pass (exportCatalogue), with the seconds per file. A synthetic
+catalogue of ROWS public events (one observation per FRB) is added to the database DBNAME once, use a
+scratch database (e.g. one created with db/create_db.sh). The
+connection settings are taken from the libpq environment variables
+(PGHOST, PGUSER, ...):
+
+    python benchmarks/export.py DBNAME [rows]
+'''
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# import pyfrbcatdb from this checkout
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from pyfrbcatdb import dbase  # noqa: E402
+from pyfrbcatdb import exportCatalogue  # noqa: E402
+from pyfrbcatdb import writeColumnar  # noqa: E402
+from pyfrbcatdb import writeCSV  # noqa: E402
+
+SYNTHETIC = [
+    "INSERT INTO authors (ivorn) VALUES ('ivo://frbcatdb.synthetic/author') "
+    "ON CONFLICT DO NOTHING",
+    "INSERT INTO frbs (author_id, name, utc) "
+    "SELECT a.id, 'FRBSYNTH' || g, "
+    "timestamp '2010-01-01' + g * interval '1 minute' "
+    "FROM authors a, generate_series(1, %s) g "
+    "WHERE a.ivorn = 'ivo://frbcatdb.synthetic/author'",
+    "INSERT INTO observations (frb_id, author_id, telescope, utc, "
+    "detected, verified) SELECT f.id, f.author_id, "
+    "(ARRAY['Parkes', 'ASKAP', 'CHIME', 'WSRT'])[1 + f.id %% 4], f.utc, "
+    "TRUE, TRUE FROM frbs f WHERE f.name LIKE 'FRBSYNTH%%'",
+    "INSERT INTO radio_observations_params (obs_id, author_id, settings_id, "
+    "raj, decj, gl, gb, receiver, backend, beam, sampling_time, bandwidth, "
+    "centre_frequency, npol, bits_per_sample, gain, tsys) "
+    "SELECT o.id, o.author_id, o.telescope || ';' || o.utc, "
+    "to_char(random() * 23, 'FM00') || ':' || "
+    "to_char(random() * 59, 'FM00') || ':' || "
+    "to_char(random() * 59, 'FM00.0'), "
+    "to_char(random() * 178 - 89, 'FM00') || ':' || "
+    "to_char(random() * 59, 'FM00') || ':' || "
+    "to_char(random() * 59, 'FM00.0'), "
+    "random() * 360, random() * 180 - 90, 'multibeam', 'BPSR', "
+    "1 + o.id %% 13, 0.064, 338.281, 1382, 2, 2, 0.735, 28 "
+    "FROM observations o JOIN frbs f ON o.frb_id = f.id "
+    "WHERE f.name LIKE 'FRBSYNTH%%'",
+    "INSERT INTO radio_measured_params (rop_id, author_id, voevent_ivorn, "
+    "dm, dm_error, snr, width, rank) SELECT rop.id, rop.author_id, "
+    "'ivo://frbcatdb.synthetic/' || rop.id, round((100 + random() * 2000)::"
+    "numeric, 1), round((random() * 2)::numeric, 2), "
+    "round((8 + random() * 50)::numeric, 1), "
+    "round((random() * 10)::numeric, 2), 1 "
+    "FROM radio_observations_params rop JOIN observations o ON "
+    "rop.obs_id = o.id JOIN frbs f ON o.frb_id = f.id "
+    "WHERE f.name LIKE 'FRBSYNTH%%'"]
+
+
+def synthetic(dbName, rows):
+    '''
+    Add the synthetic catalogue to dbName if it is not there yet.
+    '''
+    connection, cursor = dbase.connectToDB(dbName)
+    cursor.execute("SELECT count(*) FROM frbs WHERE name LIKE 'FRBSYNTH%%'")
+    if not cursor.fetchone()[0]:
+        for sql in SYNTHETIC:
+            cursor.execute(sql, (rows,))
+        connection.commit()
+        cursor.execute("ANALYZE")
+    dbase.closeDBConnection(connection, cursor)
+
+
+def export(dbName, CSV):
+    '''
+    Return the seconds to export the catalogue to CSV.
+    '''
+    start = time.time()
+    if CSV.endswith('.parquet'):
+        writeColumnar.writeColumnar(CSV, dbName, None, None, None, None,
+                                    os.devnull, force=True)
+    else:
+        writeCSV.writeCSV(CSV, dbName, None, None, None, None, os.devnull,
+                          force=True)
+    return time.time() - start
+
+
+def main(dbName, rows=1000000):
+    synthetic(dbName, int(rows))
+    directory = tempfile.mkdtemp()
+    CSV = os.path.join(directory, 'frbcat.csv')
+    print("{:<22} {:>10} {:>14}".format('export', 'seconds', 'bytes'))
+    try:
+        for label, filename in [('csv', CSV),
+                                ('csv, gzip stream', CSV + '.gz'),
+                                ('csv, zstd stream', CSV + '.zst'),
+                                ('parquet, zstd', os.path.join(
+                                    directory, 'frbcat.parquet'))]:
+            if filename.endswith('.zst') and writeCSV.zstandard is None:
+                print("{:<22} {:>10}".format(label, 'no zstandard'))
+                continue
+            if filename.endswith('.parquet') and writeColumnar.pyarrow is None:
+                print("{:<22} {:>10}".format(label, 'no pyarrow'))
+                continue
+            seconds = export(dbName, filename)
+            print("{:<22} {:>10.2f} {:>14d}".format(
+                label, seconds, os.path.getsize(filename)))
+        # the uncompressed export compressed afterwards
+        start = time.time()
+        export(dbName, CSV)
+        with open(CSV, 'rb') as f, gzip.open(CSV + '.2.gz', 'wb',
+                                               compresslevel=6) as out:
+            shutil.copyfileobj(f, out)
+        print("{:<22} {:>10.2f} {:>14d}".format(
+            'csv, then gzip', time.time() - start,
+            os.path.getsize(CSV + '.2.gz')))
+        # CSV, JSON and VOTable from a single COPY
+        filenames = [os.path.join(directory, 'frbcat' + extension)
+                     for extension in ['.csv', '.json', '.vot']]
+        start = time.time()
+        timings = exportCatalogue.exportCatalogue(
+            filenames, dbName, None, None, None, None, os.devnull,
+            force=True).timings
+        print("{:<22} {:>10.2f} {:>14d}".format(
+            'csv, json, votable', time.time() - start,
+            sum(os.path.getsize(filename) for filename in filenames)))
+        for name, seconds in timings.items():
+            print("  {:<20} {:>10.2f}".format(os.path.basename(name),
+                                              seconds))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
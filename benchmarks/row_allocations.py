@@ -0,0 +1,135 @@
+'''
+description:    Microbenchmark of the row handling of FRBCat_add
+license:        APACHE 2.0
+author:         Ronald van Haren, NLeSC (r.vanharen@esciencecenter.nl)
+
+Compare the numpy based column handling FRBCat_add used before
+(boolean masks over object arrays in insert_into_database,
+update_database and define_sql_params) with pyfrbcatdb.table_row. Only
+the preparation of the sql parameters is measured, no database is
+needed and pyfrbcatdb does not need to be installed:
+
+    python benchmarks/row_allocations.py [VOEvent.xml] [repeat]
+'''
+import logging
+import os
+import sys
+import timeit
+import tracemalloc
+import warnings
+import lxml
+import numpy
+
+# import pyfrbcatdb from this checkout
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from pyfrbcatdb.decode_VOEvent import decode_VOEvent  # noqa: E402
+from pyfrbcatdb.table_row import table_row  # noqa: E402
+
+TABLES = ['authors', 'frbs', 'observations', 'radio_observations_params',
+          'radio_measured_params']
+# ids appended per table by FRBCat_add
+IDS = {'authors': (),
+       'frbs': ('author_id',),
+       'observations': ('frb_id', 'author_id'),
+       'radio_observations_params': ('obs_id', 'author_id', 'settings_id'),
+       'radio_measured_params': ('rop_id', 'author_id', 'rank')}
+
+
+class parser(decode_VOEvent):
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+
+
+class counter:
+    '''
+    Count the numpy arrays created by the numpy based row handling.
+    '''
+    arrays = 0
+
+    @classmethod
+    def array(cls, *args, **kwargs):
+        cls.arrays += 1
+        return numpy.array(*args, **kwargs)
+
+    @classmethod
+    def append(cls, *args, **kwargs):
+        cls.arrays += 1
+        return numpy.append(*args, **kwargs)
+
+
+def numpy_rows(rows):
+    '''
+    Row handling of FRBCat_add with numpy arrays (insert and update).
+    '''
+    params = []
+    for table, (cols, values) in rows.items():
+        cols = counter.append(cols, IDS[table])
+        values = counter.append(values, [1] * len(IDS[table]))
+        for _ in range(2):  # insert_into_database and update_database
+            c = counter.array([i for i, j in zip(cols, values) if j])
+            v = counter.array([j for j in values if j]).flatten()
+            col_sql = ', '.join(map(str, c))
+            parameters = '(' + ','.join(['%s' for i in v]) + ')'
+            v = [x.text if isinstance(
+                 x, lxml.objectify.StringElement) else x for x in v]
+            v = counter.array(v)
+            params.append((col_sql, parameters, tuple(v)))
+    return params
+
+
+def typed_rows(rows):
+    '''
+    Row handling of FRBCat_add with pyfrbcatdb.table_row.
+    '''
+    params = []
+    for table, (cols, values) in rows.items():
+        row = table_row(table, cols, values)
+        row.extend(IDS[table], [1] * len(IDS[table]))
+        for _ in range(2):  # insert_into_database and update_database
+            params.append(row.sql_params())
+    return params
+
+
+def measure(func, rows, repeat):
+    '''
+    Return time (us) and peak traced memory (bytes) per event.
+    '''
+    seconds = min(timeit.repeat(lambda: func(rows), number=repeat,
+                                repeat=3)) / repeat
+    tracemalloc.start()
+    func(rows)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds * 1e6, peak
+
+
+def main(voevent=os.path.join(ROOT, 'test_data', 'Detection_unitTest1.xml'),
+         repeat=2000):
+    # the numpy row handling creates ragged object arrays
+    try:
+        deprecation = numpy.exceptions.VisibleDeprecationWarning
+    except AttributeError:  # numpy < 1.25
+        deprecation = numpy.VisibleDeprecationWarning
+    warnings.simplefilter('ignore', deprecation)
+    mapping, event_type = parser().parse_VOEvent(voevent)
+    rows = {}
+    for table in TABLES:
+        items = [item for item in mapping.get(table)
+                 if item.get('value') is not None]
+        rows[table] = ([item.get('column') for item in items],
+                       [item.get('value') for item in items])
+    counter.arrays = 0
+    numpy_rows(rows)
+    arrays = counter.arrays
+    print("{:<10} {:>12} {:>16} {:>14}".format(
+        'rows', 'us/event', 'peak bytes/event', 'arrays/event'))
+    for name, func, count in [('numpy', numpy_rows, arrays),
+                              ('table_row', typed_rows, 0)]:
+        usec, peak = measure(func, rows, int(repeat))
+        print("{:<10} {:>12.1f} {:>16d} {:>14d}".format(name, usec, peak,
+                                                         count))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
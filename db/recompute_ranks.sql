@@ -0,0 +1,33 @@
+-- Recompute the rank of all events in a single set-based pass.
+-- Events of an FRB are numbered 1, 2, ... in the order of their current
+-- rank, events with the same or no rank are ordered by insertion. The
+-- frb_ranks counters are reset to the last rank of each FRB.
+-- Run in a single transaction, e.g. psql --single-transaction.
+
+CREATE TABLE IF NOT EXISTS frb_ranks (
+  frb_id INTEGER PRIMARY KEY REFERENCES frbs (id),
+  last_rank INTEGER NOT NULL);
+
+-- block rank allocation of running ingestors until the end of the transaction
+LOCK TABLE frb_ranks IN EXCLUSIVE MODE;
+
+WITH ranked AS (
+  SELECT rmp.id, o.frb_id,
+         row_number() OVER (PARTITION BY o.frb_id
+                            ORDER BY rmp.rank NULLS LAST, rmp.id) AS rank
+  FROM radio_measured_params rmp
+  JOIN radio_observations_params rop ON rmp.rop_id = rop.id
+  JOIN observations o ON rop.obs_id = o.id)
+UPDATE radio_measured_params rmp
+SET rank = ranked.rank
+FROM ranked
+WHERE rmp.id = ranked.id AND rmp.rank IS DISTINCT FROM ranked.rank;
+
+DELETE FROM frb_ranks;
+
+INSERT INTO frb_ranks (frb_id, last_rank)
+SELECT o.frb_id, max(rmp.rank)
+FROM radio_measured_params rmp
+JOIN radio_observations_params rop ON rmp.rop_id = rop.id
+JOIN observations o ON rop.obs_id = o.id
+GROUP BY o.frb_id;
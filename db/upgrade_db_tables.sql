@@ -0,0 +1,397 @@
+-- Upgrade an existing FRBCat database to the tables of create_db_tables.sql.
+-- All statements can be run more than once.
+
+-- -----------------------------------------------------
+-- Table frb_ranks
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS frb_ranks (
+  frb_id INTEGER PRIMARY KEY REFERENCES frbs (id),
+  last_rank INTEGER NOT NULL);
+
+-- the locks and lookups of an event on the CTE path of the ingest (see
+-- pyfrbcatdb.FRBCat.FRBCat_add_cte) in one round trip: lock the FRB,
+-- look up the author and the event, and lock the author if it is new.
+-- The lookups run after the FRB lock with a fresh snapshot, they see the
+-- rows of the writers before us. The locks are the ones of
+-- pyfrbcatdb.dbase.advisory_lock, the FRB is locked before the author.
+CREATE OR REPLACE FUNCTION lock_existing_ids(frb_name TEXT, author_ivorn TEXT, event_ivorn TEXT, OUT author_id INTEGER, OUT event_id INTEGER) AS $$
+BEGIN
+  IF frb_name IS NOT NULL THEN
+    PERFORM pg_advisory_xact_lock(hashtext('frbs'), hashtext(frb_name));
+  END IF;
+  SELECT id INTO author_id FROM authors WHERE ivorn = author_ivorn;
+  SELECT id INTO event_id FROM radio_measured_params WHERE voevent_ivorn = event_ivorn;
+  IF author_id IS NULL AND author_ivorn IS NOT NULL THEN
+    PERFORM pg_advisory_xact_lock(hashtext('authors'), hashtext(author_ivorn));
+  END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- -----------------------------------------------------
+-- Table ingest_jobs
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS ingest_jobs (
+  id  BIGSERIAL PRIMARY KEY,
+  name VARCHAR(255) NOT NULL,
+  ivorn VARCHAR(255),
+  payload BYTEA NOT NULL,
+  status VARCHAR(16) NOT NULL DEFAULT 'pending'
+    CHECK (status IN ('pending', 'running', 'done', 'failed')),
+  attempts INTEGER NOT NULL DEFAULT 0,
+  visible_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  claimed_by VARCHAR(255),
+  error TEXT,
+  created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  finished_at TIMESTAMP WITH TIME ZONE);
+CREATE INDEX IF NOT EXISTS ingest_jobs_claim ON ingest_jobs (id) WHERE status IN ('pending', 'running');
+COMMENT ON TABLE ingest_jobs IS 'VOEvents waiting to be ingested by the frbcatdb workers';
+
+-- -----------------------------------------------------
+-- Table catalogue_version
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS catalogue_version (
+  id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+  version BIGINT NOT NULL DEFAULT 0,
+  modified TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now());
+INSERT INTO catalogue_version (id) VALUES (TRUE) ON CONFLICT DO NOTHING;
+COMMENT ON TABLE catalogue_version IS 'Number of committed transactions that changed public_catalogue';
+-- oldest version the changes in catalogue_changes are logged since,
+-- set to the current version at the end of the upgrade
+ALTER TABLE catalogue_version ADD COLUMN IF NOT EXISTS changes_from BIGINT;
+
+-- the catalogue version of the transaction, bumped by its first call
+-- in the transaction, which locks the version row until the commit. It
+-- is called by log_public_catalogue_changes, when the deferred refresh
+-- of public_catalogue changes rows: only the commits of transactions
+-- that change the public catalogue wait for each other on the row.
+CREATE OR REPLACE FUNCTION catalogue_change_version() RETURNS BIGINT AS $$
+DECLARE
+  changed BIGINT;
+BEGIN
+  IF current_setting('frbcat.catalogue_changed', true) = 'on' THEN
+    SELECT version INTO changed FROM catalogue_version;
+    RETURN changed;
+  END IF;
+  PERFORM set_config('frbcat.catalogue_changed', 'on', true);
+  UPDATE catalogue_version SET version = version + 1, modified = now()
+    RETURNING version INTO changed;
+  RETURN changed;
+END;
+$$ LANGUAGE plpgsql;
+
+-- the version is no longer bumped by triggers on the tables
+DROP TRIGGER IF EXISTS frbs_catalogue_version ON frbs;
+DROP TRIGGER IF EXISTS observations_catalogue_version ON observations;
+DROP TRIGGER IF EXISTS radio_observations_params_catalogue_version ON radio_observations_params;
+DROP TRIGGER IF EXISTS radio_measured_params_catalogue_version ON radio_measured_params;
+DROP FUNCTION IF EXISTS bump_catalogue_version();
+
+-- -----------------------------------------------------
+-- Table radio_measured_params
+-- -----------------------------------------------------
+ALTER TABLE radio_measured_params ADD COLUMN IF NOT EXISTS validation VARCHAR(16);
+
+-- -----------------------------------------------------
+-- Table public_catalogue
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS public_catalogue (
+  rmp_id INTEGER PRIMARY KEY,
+  frb_id INTEGER NOT NULL,
+  obs_id INTEGER NOT NULL,
+  rop_id INTEGER NOT NULL,
+  frb VARCHAR(255) NOT NULL,
+  telescope VARCHAR(128) NOT NULL,
+  utc TIMESTAMP NOT NULL,
+  raj VARCHAR(16) NOT NULL,
+  decj VARCHAR(16) NOT NULL,
+  gl DOUBLE PRECISION,
+  gb DOUBLE PRECISION,
+  receiver VARCHAR(255),
+  backend VARCHAR(255),
+  beam_semi_major_axis DOUBLE PRECISION,
+  beam_semi_minor_axis DOUBLE PRECISION,
+  beam_rotation_angle DOUBLE PRECISION,
+  beam VARCHAR(8),
+  sampling_time DOUBLE PRECISION,
+  bandwidth DOUBLE PRECISION,
+  centre_frequency DOUBLE PRECISION,
+  npol INTEGER,
+  bits_per_sample SMALLINT,
+  gain DOUBLE PRECISION,
+  tsys DOUBLE PRECISION,
+  mw_dm_limit DOUBLE PRECISION,
+  galactic_electron_model VARCHAR(255),
+  voevent_ivorn VARCHAR(255) NOT NULL,
+  dm DOUBLE PRECISION NOT NULL,
+  dm_error DOUBLE PRECISION,
+  dm_index DOUBLE PRECISION,
+  snr DOUBLE PRECISION NOT NULL,
+  width DOUBLE PRECISION NOT NULL,
+  rank INTEGER,
+  width_error_upper DOUBLE PRECISION,
+  width_error_lower DOUBLE PRECISION,
+  flux DOUBLE PRECISION,
+  flux_error_upper DOUBLE PRECISION,
+  flux_error_lower DOUBLE PRECISION,
+  rm DOUBLE PRECISION,
+  rm_error DOUBLE PRECISION,
+  redshift_host DOUBLE PRECISION,
+  dispersion_smearing DOUBLE PRECISION,
+  scattering_model VARCHAR(255),
+  scattering_timescale DOUBLE PRECISION,
+  scattering DOUBLE PRECISION,
+  scattering_error DOUBLE PRECISION,
+  scattering_index DOUBLE PRECISION,
+  scattering_index_error DOUBLE PRECISION,
+  linear_poln_frac DOUBLE PRECISION,
+  linear_poln_frac_error DOUBLE PRECISION,
+  circular_poln_frac DOUBLE PRECISION,
+  circular_poln_frac_error DOUBLE PRECISION,
+  spectral_index DOUBLE PRECISION,
+  spectral_index_error DOUBLE PRECISION);
+CREATE INDEX IF NOT EXISTS public_catalogue_frb_id ON public_catalogue (frb_id);
+CREATE INDEX IF NOT EXISTS public_catalogue_frb_utc ON public_catalogue (frb, utc);
+COMMENT ON TABLE public_catalogue IS 'Verified detections of public FRBs, kept up to date with the tables by triggers';
+
+-- the rows of public_catalogue joined from the tables
+CREATE OR REPLACE VIEW public_catalogue_live AS
+SELECT rmp.id AS rmp_id, f.id AS frb_id, o.id AS obs_id, rop.id AS rop_id,
+  f.name AS frb, o.telescope, o.utc, rop.raj, rop.decj, rop.gl, rop.gb,
+  rop.receiver, rop.backend, rop.beam_semi_major_axis,
+  rop.beam_semi_minor_axis, rop.beam_rotation_angle, rop.beam,
+  rop.sampling_time, rop.bandwidth, rop.centre_frequency, rop.npol,
+  rop.bits_per_sample, rop.gain, rop.tsys, rop.mw_dm_limit,
+  rop.galactic_electron_model, rmp.voevent_ivorn, rmp.dm, rmp.dm_error,
+  rmp.dm_index, rmp.snr, rmp.width, rmp.rank, rmp.width_error_upper,
+  rmp.width_error_lower, rmp.flux, rmp.flux_error_upper,
+  rmp.flux_error_lower, rmp.rm, rmp.rm_error, rmp.redshift_host,
+  rmp.dispersion_smearing, rmp.scattering_model, rmp.scattering_timescale,
+  rmp.scattering, rmp.scattering_error, rmp.scattering_index,
+  rmp.scattering_index_error, rmp.linear_poln_frac,
+  rmp.linear_poln_frac_error, rmp.circular_poln_frac,
+  rmp.circular_poln_frac_error, rmp.spectral_index, rmp.spectral_index_error
+FROM frbs f JOIN observations o ON (f.id = o.frb_id)
+  JOIN radio_observations_params rop ON (o.id = rop.obs_id)
+  JOIN radio_measured_params rmp ON (rop.id = rmp.rop_id)
+  JOIN authors armp ON (rmp.author_id = armp.id)
+WHERE (f.private = FALSE AND o.verified = TRUE AND o.detected = TRUE);
+
+-- replace the public_catalogue rows of the FRBs frb_ids, or of all FRBs
+CREATE OR REPLACE FUNCTION refresh_public_catalogue(frb_ids INTEGER[] DEFAULT NULL) RETURNS void AS $$
+BEGIN
+  IF frb_ids IS NULL THEN
+    -- block the refreshes of running ingestors until the end of the transaction
+    LOCK TABLE public_catalogue IN EXCLUSIVE MODE;
+    PERFORM log_public_catalogue_changes(NULL);
+    DELETE FROM public_catalogue;
+    INSERT INTO public_catalogue SELECT * FROM public_catalogue_live;
+    RETURN;
+  END IF;
+  PERFORM log_public_catalogue_changes(frb_ids);
+  DELETE FROM public_catalogue WHERE frb_id = ANY(frb_ids);
+  -- rows of a concurrent refresh of the same FRB are replaced
+  INSERT INTO public_catalogue SELECT * FROM public_catalogue_live
+    WHERE frb_id = ANY(frb_ids)
+  ON CONFLICT (rmp_id) DO UPDATE SET (frb_id, obs_id, rop_id, frb, telescope,
+    utc, raj, decj, gl, gb, receiver, backend, beam_semi_major_axis,
+    beam_semi_minor_axis, beam_rotation_angle, beam, sampling_time, bandwidth,
+    centre_frequency, npol, bits_per_sample, gain, tsys, mw_dm_limit,
+    galactic_electron_model, voevent_ivorn, dm, dm_error, dm_index, snr, width,
+    rank, width_error_upper, width_error_lower, flux, flux_error_upper,
+    flux_error_lower, rm, rm_error, redshift_host, dispersion_smearing,
+    scattering_model, scattering_timescale, scattering, scattering_error,
+    scattering_index, scattering_index_error, linear_poln_frac,
+    linear_poln_frac_error, circular_poln_frac, circular_poln_frac_error,
+    spectral_index, spectral_index_error) =
+    (EXCLUDED.frb_id, EXCLUDED.obs_id, EXCLUDED.rop_id, EXCLUDED.frb,
+    EXCLUDED.telescope, EXCLUDED.utc, EXCLUDED.raj, EXCLUDED.decj, EXCLUDED.gl,
+    EXCLUDED.gb, EXCLUDED.receiver, EXCLUDED.backend,
+    EXCLUDED.beam_semi_major_axis, EXCLUDED.beam_semi_minor_axis,
+    EXCLUDED.beam_rotation_angle, EXCLUDED.beam, EXCLUDED.sampling_time,
+    EXCLUDED.bandwidth, EXCLUDED.centre_frequency, EXCLUDED.npol,
+    EXCLUDED.bits_per_sample, EXCLUDED.gain, EXCLUDED.tsys,
+    EXCLUDED.mw_dm_limit, EXCLUDED.galactic_electron_model,
+    EXCLUDED.voevent_ivorn, EXCLUDED.dm, EXCLUDED.dm_error, EXCLUDED.dm_index,
+    EXCLUDED.snr, EXCLUDED.width, EXCLUDED.rank, EXCLUDED.width_error_upper,
+    EXCLUDED.width_error_lower, EXCLUDED.flux, EXCLUDED.flux_error_upper,
+    EXCLUDED.flux_error_lower, EXCLUDED.rm, EXCLUDED.rm_error,
+    EXCLUDED.redshift_host, EXCLUDED.dispersion_smearing,
+    EXCLUDED.scattering_model, EXCLUDED.scattering_timescale,
+    EXCLUDED.scattering, EXCLUDED.scattering_error, EXCLUDED.scattering_index,
+    EXCLUDED.scattering_index_error, EXCLUDED.linear_poln_frac,
+    EXCLUDED.linear_poln_frac_error, EXCLUDED.circular_poln_frac,
+    EXCLUDED.circular_poln_frac_error, EXCLUDED.spectral_index,
+    EXCLUDED.spectral_index_error);
+END;
+$$ LANGUAGE plpgsql;
+
+-- collect the FRBs of the rows changed by a statement in the transaction.
+-- New frbs, observations and radio_observations_params rows have no
+-- radio_measured_params rows yet, only their updates and deletes change
+-- the catalogue.
+CREATE OR REPLACE FUNCTION public_catalogue_changed() RETURNS trigger AS $$
+DECLARE
+  changed INTEGER[] := '{}';
+BEGIN
+  IF TG_TABLE_NAME = 'frbs' THEN
+    changed := ARRAY(SELECT id FROM old_rows);
+  ELSIF TG_TABLE_NAME = 'observations' THEN
+    changed := ARRAY(SELECT frb_id FROM old_rows);
+    IF TG_OP = 'UPDATE' THEN
+      changed := changed || ARRAY(SELECT frb_id FROM new_rows);
+    END IF;
+  ELSIF TG_TABLE_NAME = 'radio_observations_params' THEN
+    changed := ARRAY(SELECT o.frb_id FROM old_rows x
+      JOIN observations o ON o.id = x.obs_id);
+    IF TG_OP = 'UPDATE' THEN
+      changed := changed || ARRAY(SELECT o.frb_id FROM new_rows x
+        JOIN observations o ON o.id = x.obs_id);
+    END IF;
+  ELSE
+    IF TG_OP <> 'INSERT' THEN
+      changed := ARRAY(SELECT o.frb_id FROM old_rows x
+        JOIN radio_observations_params rop ON rop.id = x.rop_id
+        JOIN observations o ON o.id = rop.obs_id);
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+      changed := changed || ARRAY(SELECT o.frb_id FROM new_rows x
+        JOIN radio_observations_params rop ON rop.id = x.rop_id
+        JOIN observations o ON o.id = rop.obs_id);
+    END IF;
+  END IF;
+  IF cardinality(changed) > 0 THEN
+    PERFORM set_config('frbcat.catalogue_frbs', concat_ws(',',
+      nullif(current_setting('frbcat.catalogue_frbs', true), ''),
+      array_to_string(changed, ',')), true);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- refresh the collected FRBs once per transaction, the triggers are
+-- deferred so every change of the transaction has been collected
+CREATE OR REPLACE FUNCTION refresh_changed_public_catalogue() RETURNS trigger AS $$
+DECLARE
+  frb_ids TEXT := current_setting('frbcat.catalogue_frbs', true);
+BEGIN
+  IF coalesce(frb_ids, '') = '' THEN
+    RETURN NULL;
+  END IF;
+  PERFORM set_config('frbcat.catalogue_frbs', '', true);
+  PERFORM refresh_public_catalogue(ARRAY(
+    SELECT DISTINCT unnest(string_to_array(frb_ids, ',')::INTEGER[])));
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS frbs_public_catalogue_update ON frbs;
+CREATE TRIGGER frbs_public_catalogue_update AFTER UPDATE ON frbs
+  REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT
+  EXECUTE PROCEDURE public_catalogue_changed();
+DROP TRIGGER IF EXISTS frbs_public_catalogue_delete ON frbs;
+CREATE TRIGGER frbs_public_catalogue_delete AFTER DELETE ON frbs
+  REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT
+  EXECUTE PROCEDURE public_catalogue_changed();
+DROP TRIGGER IF EXISTS observations_public_catalogue_update ON observations;
+CREATE TRIGGER observations_public_catalogue_update AFTER UPDATE ON observations
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT
+  EXECUTE PROCEDURE public_catalogue_changed();
+DROP TRIGGER IF EXISTS observations_public_catalogue_delete ON observations;
+CREATE TRIGGER observations_public_catalogue_delete AFTER DELETE ON observations
+  REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT
+  EXECUTE PROCEDURE public_catalogue_changed();
+DROP TRIGGER IF EXISTS radio_observations_params_public_catalogue_update ON radio_observations_params;
+CREATE TRIGGER radio_observations_params_public_catalogue_update AFTER UPDATE ON radio_observations_params
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT
+  EXECUTE PROCEDURE public_catalogue_changed();
+DROP TRIGGER IF EXISTS radio_observations_params_public_catalogue_delete ON radio_observations_params;
+CREATE TRIGGER radio_observations_params_public_catalogue_delete AFTER DELETE ON radio_observations_params
+  REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT
+  EXECUTE PROCEDURE public_catalogue_changed();
+DROP TRIGGER IF EXISTS radio_measured_params_public_catalogue_insert ON radio_measured_params;
+CREATE TRIGGER radio_measured_params_public_catalogue_insert AFTER INSERT ON radio_measured_params
+  REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT
+  EXECUTE PROCEDURE public_catalogue_changed();
+DROP TRIGGER IF EXISTS radio_measured_params_public_catalogue_update ON radio_measured_params;
+CREATE TRIGGER radio_measured_params_public_catalogue_update AFTER UPDATE ON radio_measured_params
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT
+  EXECUTE PROCEDURE public_catalogue_changed();
+DROP TRIGGER IF EXISTS radio_measured_params_public_catalogue_delete ON radio_measured_params;
+CREATE TRIGGER radio_measured_params_public_catalogue_delete AFTER DELETE ON radio_measured_params
+  REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT
+  EXECUTE PROCEDURE public_catalogue_changed();
+DROP TRIGGER IF EXISTS frbs_public_catalogue_refresh ON frbs;
+CREATE CONSTRAINT TRIGGER frbs_public_catalogue_refresh AFTER UPDATE OR DELETE ON frbs
+  DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE PROCEDURE refresh_changed_public_catalogue();
+DROP TRIGGER IF EXISTS observations_public_catalogue_refresh ON observations;
+CREATE CONSTRAINT TRIGGER observations_public_catalogue_refresh AFTER UPDATE OR DELETE ON observations
+  DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE PROCEDURE refresh_changed_public_catalogue();
+DROP TRIGGER IF EXISTS radio_observations_params_public_catalogue_refresh ON radio_observations_params;
+CREATE CONSTRAINT TRIGGER radio_observations_params_public_catalogue_refresh AFTER UPDATE OR DELETE ON radio_observations_params
+  DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE PROCEDURE refresh_changed_public_catalogue();
+DROP TRIGGER IF EXISTS radio_measured_params_public_catalogue_refresh ON radio_measured_params;
+CREATE CONSTRAINT TRIGGER radio_measured_params_public_catalogue_refresh AFTER INSERT OR UPDATE OR DELETE ON radio_measured_params
+  DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE PROCEDURE refresh_changed_public_catalogue();
+
+-- -----------------------------------------------------
+-- Table catalogue_changes
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS catalogue_changes (
+  id  BIGSERIAL PRIMARY KEY,
+  version BIGINT NOT NULL,
+  rmp_id INTEGER NOT NULL,
+  voevent_ivorn VARCHAR(255) NOT NULL,
+  operation VARCHAR(6) NOT NULL
+    CHECK (operation IN ('insert', 'update', 'delete')));
+CREATE INDEX IF NOT EXISTS catalogue_changes_version ON catalogue_changes (version);
+COMMENT ON TABLE catalogue_changes IS 'Rows inserted into, updated in and deleted from public_catalogue by catalogue version';
+
+-- log the public_catalogue rows of the FRBs frb_ids, or of all FRBs,
+-- that differ from the rows joined from the tables, before a refresh
+-- replaces them, with the version of the transaction
+CREATE OR REPLACE FUNCTION log_public_catalogue_changes(frb_ids INTEGER[]) RETURNS void AS $$
+BEGIN
+  IF frb_ids IS NULL THEN
+    INSERT INTO catalogue_changes (version, rmp_id, voevent_ivorn, operation)
+    SELECT (SELECT catalogue_change_version()), d.* FROM (
+      SELECT coalesce(l.rmp_id, c.rmp_id) AS rmp_id,
+        coalesce(l.voevent_ivorn, c.voevent_ivorn) AS voevent_ivorn,
+        CASE WHEN c.rmp_id IS NULL THEN 'insert'
+          WHEN l.rmp_id IS NULL THEN 'delete' ELSE 'update' END AS operation
+      FROM public_catalogue_live l
+      FULL JOIN public_catalogue c ON l.rmp_id = c.rmp_id
+      WHERE l IS DISTINCT FROM c) d;
+    RETURN;
+  END IF;
+  INSERT INTO catalogue_changes (version, rmp_id, voevent_ivorn, operation)
+  SELECT (SELECT catalogue_change_version()), d.* FROM (
+    SELECT coalesce(l.rmp_id, c.rmp_id) AS rmp_id,
+      coalesce(l.voevent_ivorn, c.voevent_ivorn) AS voevent_ivorn,
+      CASE WHEN c.rmp_id IS NULL THEN 'insert'
+        WHEN l.rmp_id IS NULL THEN 'delete' ELSE 'update' END AS operation
+    FROM (SELECT * FROM public_catalogue_live
+      WHERE frb_id = ANY(frb_ids)) l
+    FULL JOIN (SELECT * FROM public_catalogue
+      WHERE frb_id = ANY(frb_ids)) c ON l.rmp_id = c.rmp_id
+    WHERE l IS DISTINCT FROM c) d;
+END;
+$$ LANGUAGE plpgsql;
+
+-- remove the changes up to version, the changes since older versions
+-- can no longer be exported
+CREATE OR REPLACE FUNCTION prune_catalogue_changes(up_to BIGINT) RETURNS void AS $$
+BEGIN
+  UPDATE catalogue_version SET changes_from = greatest(changes_from, up_to);
+  DELETE FROM catalogue_changes WHERE version <= up_to;
+END;
+$$ LANGUAGE plpgsql;
+
+-- fill the table from the existing rows
+SELECT refresh_public_catalogue();
+
+-- the changes are logged since the current version, not the rows of the
+-- first fill
+UPDATE catalogue_version SET changes_from = version WHERE changes_from IS NULL;
+DELETE FROM catalogue_changes
+  WHERE version <= (SELECT changes_from FROM catalogue_version);
+ALTER TABLE catalogue_version ALTER COLUMN changes_from SET DEFAULT 0,
+  ALTER COLUMN changes_from SET NOT NULL;
@@ -4,10 +4,10 @@ license:        APACHE 2.0
 author:         Ronald van Haren, NLeSC (r.vanharen@esciencecenter.nl)
 '''
 from pyfrbcatdb import dbase as dbase
+from pyfrbcatdb.table_row import table_row
+from pyfrbcatdb.table_row import plain_value
 import os
 import sys
-from numpy import append as npappend
-from numpy import array as nparray
 import voeventparse as vp
 import datetime
 import pytz
@@ -16,10 +16,129 @@ import psycopg2
 import lxml
 from xml.dom.minidom import parseString
 import yaml
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import chain
+from types import MappingProxyType
 from astropy import units as u
 from astropy.coordinates import SkyCoord
 
 
+# columns with a not null constraint (besides foreign keys) per table
+REQUIRED_COLUMNS = {
+    'radio_measured_params': frozenset(['voevent_ivorn', 'dm', 'snr',
+                                        'width']),
+    'radio_observations_params': frozenset(['raj', 'decj']),
+    'observations': frozenset(['telescope', 'verified']),
+    'frbs': frozenset(['name', 'utc']),
+    'authors': frozenset(['ivorn'])}
+
+
+class identity_cache:
+    '''
+    Bounded LRU cache of natural key to id lookups (author ivorn, FRB
+    name and frb_id/telescope/utc of observations), shared by all
+    FRBCat_add instances in a process. Ids found or inserted in the open
+    transaction are pending until commit and are dropped on rollback.
+
+    :param maxsize: maximum number of committed entries
+    :type maxsize: int
+    '''
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.pending = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        '''
+        Get the id for a natural key.
+
+        :param key: natural key, e.g. ('frbs', name)
+        :type key: tuple
+        :returns: id or None if the key is not cached
+        :rtype: int, NoneType
+        '''
+        if key in self.pending:
+            self.hits += 1
+            return self.pending[key]
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        '''
+        Add the id for a natural key to the open transaction.
+
+        :param key: natural key, e.g. ('frbs', name)
+        :param value: id in the database table
+        :type key: tuple
+        :type value: int
+        '''
+        self.pending[key] = value
+        self.pending.move_to_end(key)
+
+    def savepoint(self):
+        '''
+        Mark the pending entries, entries added after the mark are
+        dropped by rollback(mark).
+
+        :returns: mark
+        :rtype: int
+        '''
+        return len(self.pending)
+
+    def rollback(self, savepoint=0):
+        '''
+        Drop the entries added to the open transaction after savepoint.
+
+        :param savepoint: mark returned by savepoint()
+        :type savepoint: int
+        '''
+        while len(self.pending) > savepoint:
+            self.pending.popitem(last=True)
+
+    def commit(self):
+        '''
+        Move the entries of the committed transaction to the cache.
+        '''
+        for key, value in self.pending.items():
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+        self.pending.clear()
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        '''
+        Remove all entries and reset the hit/miss counters.
+        '''
+        self.entries.clear()
+        self.pending.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        '''
+        Return the hit/miss counters and size of the cache.
+
+        :returns: dictionary with hits, misses and size
+        :rtype: dict
+        '''
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.entries) + len(self.pending)}
+
+
+# identity cache shared by all FRBCat_add instances in this process
+IDENTITY_CACHE = identity_cache()
+
+
 class FRBCat_add:
     '''
     Class module that adds a decoded VOEvent file to the FRBCat
@@ -29,16 +148,28 @@ class FRBCat_add:
     :param cursor: database cursor object
     :param mapping: mapping between database entry and VOEvent value.
     :param event_type: type of VOEvent
+    :param batch: caller owns the transaction (no commit, rollback or
+        closing of the database connection by this class)
     :type connection: psycopg2.extensions.connection
     :type cursor: psycopg2.extras.DictCursor
     :type mapping: dict
     :type event_type: str
+    :type batch: bool
     '''
-    def __init__(self, connection, cursor, mapping, event_type):
+    # insert the distinct notes in an array that are not in the table yet
+    notes_sql = ("INSERT INTO {table} ({ref}, last_modified, author, note) "
+                 "SELECT {parent}, %s::timestamp, %s, n.note "
+                 "FROM unnest(%s::text[]) WITH ORDINALITY AS n(note, idx) "
+                 "WHERE NOT EXISTS (SELECT 1 FROM {table} x WHERE "
+                 "x.{ref} = {parent} AND x.note = n.note) "
+                 "GROUP BY n.note ORDER BY min(n.idx)")
+
+    def __init__(self, connection, cursor, mapping, event_type, batch=False):
         self.connection = connection
         self.cursor = cursor
         self.mapping = mapping
         self.event_type = event_type
+        self.batch = batch
 
     def check_author_exists(self, ivorn):
         '''
@@ -51,13 +182,18 @@ class FRBCat_add:
         :returns: boolean if author is found or not
         :rtype: bool
         '''
+        cached = IDENTITY_CACHE.get(('authors', str(ivorn)))
+        if cached is not None:
+            self.author_id = cached
+            return True
         # check if the author ivorn is already in the database
-        author_id = dbase.extract_from_db_sql(self.cursor, 'authors', 'id',
-                                              'ivorn', ivorn)
+        dbase.execute(self.cursor, 'author_id', (ivorn,))
+        author_id = self.cursor.fetchone()
         if not author_id:  # did not find the author ivorn
             return False
         else:  # set self.author_id to the one in the database
             self.author_id = author_id['id']
+            IDENTITY_CACHE.set(('authors', str(ivorn)), self.author_id)
             return True
 
     def check_event_exists(self, ivorn):
@@ -72,8 +208,8 @@ class FRBCat_add:
         :rtype: bool
         '''
         # check if the event ivorn is already in the database
-        event_id = dbase.extract_from_db_sql(
-            self.cursor, 'radio_measured_params', 'id', 'voevent_ivorn', ivorn)
+        dbase.execute(self.cursor, 'event_id', (ivorn,))
+        event_id = self.cursor.fetchone()
         if not event_id:  # did not find the event ivorn
             return False
         else:  # set self.event_id to the id of the ivorn in the database
@@ -84,23 +220,22 @@ class FRBCat_add:
         '''
         Return the rank for the event to be inserted.
         First event of an FRB is rank=1, each next event increments it by 1.
+        The last rank of each FRB is kept in the frb_ranks table. The row
+        lock taken by the increment makes concurrent ingestors of the
+        same FRB wait until the transaction ends.
 
         :returns: next_rank, rank of the event to be inserted
         :rtype: int
         '''
-        sql = ("select rmp.rank from radio_measured_params rmp join " +
-               "radio_observations_params rop ON rmp.rop_id=rop.id join " +
-               "observations o on rop.obs_id=o.id join frbs on " +
-               "o.frb_id=frbs.id where frbs.id={}").format(self.frb_id)
-        self.cursor.execute(sql)
-        ranks = self.cursor.fetchall()
-        try:
-            max_rank = max([x[0] for x in ranks])
-            next_rank = max_rank + 1
-        except ValueError:
-            # first entry of this FRB
-            next_rank = 1
-        return next_rank
+        dbase.execute(self.cursor, 'next_rank', (self.frb_id,))
+        next_rank = self.cursor.fetchone()
+        if next_rank is None:
+            # no rank allocated yet for this FRB, continue from the ranks
+            # of the events already in the database
+            dbase.execute(self.cursor, 'first_rank',
+                          (self.frb_id, self.frb_id))
+            next_rank = self.cursor.fetchone()
+        return next_rank[0]
 
     def add_authors(self, table, cols, value):
         '''
@@ -113,12 +248,18 @@ class FRBCat_add:
         :type cols: list
         :type value: list
         '''
+        row = table_row(table, cols, value)
         # check if author already exists in database
-        ivorn = value[cols == 'ivorn']
+        ivorn = row.get('ivorn')
         author_exists = self.check_author_exists(ivorn)
+        if not author_exists:
+            # serialize inserts of the same author, another writer may
+            # have added it while waiting for the lock
+            dbase.advisory_lock(self.cursor, 'authors', [ivorn])
+            author_exists = self.check_author_exists(ivorn)
         # add author to database if author does not yet exist in db
         if not author_exists:
-            self.author_id = self.insert_into_database(table, cols, value)
+            self.author_id = self.insert_into_database(row)
 
     def add_frbs(self, table, cols, value):
         '''
@@ -131,12 +272,12 @@ class FRBCat_add:
         :type cols: list
         :type value: list
         '''
-        cols = npappend(cols, 'author_id')
-        value = npappend(value, self.author_id)
+        row = table_row(table, cols, value)
+        row.append('author_id', self.author_id)
         # try to insert into database / return frb id
-        self.frb_id = self.insert_into_database(table, cols, value)
+        self.frb_id = self.insert_into_database(row)
         # update database if type is supersedes
-        self.update_database(table, cols, value)
+        self.update_database(row)
 
     def add_observations(self, table, cols, value):
         '''
@@ -149,12 +290,15 @@ class FRBCat_add:
         :type cols: list
         :type value: list
         '''
-        cols = npappend(cols, ('frb_id', 'author_id'))
-        value = npappend(value, (self.frb_id, self.author_id))
+        row = table_row(table, cols, value)
+        row.extend(('frb_id', 'author_id'), (self.frb_id, self.author_id))
+        # create first part of settings_id
+        self.settings_id1 = str(row.get('telescope')) + ';' + str(
+            row.get('utc'))
         # try to insert into database / return observation id
-        self.obs_id = self.insert_into_database(table, cols, value)
+        self.obs_id = self.insert_into_database(row)
         # update database if type is supersedes
-        self.update_database(table, cols, value)
+        self.update_database(row)
 
     def add_radio_observations_params(self, table, cols, value):
         '''
@@ -167,17 +311,15 @@ class FRBCat_add:
         :type cols: list
         :type value: list
         '''
+        row = table_row(table, cols, value)
         # create settigns_id if we don't have one yet
-        if 'settings_id' not in cols:
-            settings_id2 = str(nparray(value)[nparray(cols) == 'raj'][0]
-                               ) + ';' + str(
-                                 nparray(value)[nparray(cols) == 'decj'][0])
-            settings_id = self.settings_id1 + ';' + settings_id2
-        cols = npappend(cols, ('obs_id', 'author_id', 'settings_id'))
-        value = npappend(value, (self.obs_id, self.author_id, settings_id))
-        self.rop_id = self.insert_into_database(table, cols, value)
+        if 'settings_id' not in row:
+            settings_id2 = str(row.get('raj')) + ';' + str(row.get('decj'))
+            row.append('settings_id', self.settings_id1 + ';' + settings_id2)
+        row.extend(('obs_id', 'author_id'), (self.obs_id, self.author_id))
+        self.rop_id = self.insert_into_database(row)
         # update database if type is supersedes
-        self.update_database(table, cols, value)
+        self.update_database(row)
 
     def add_radio_observations_params_notes(self, table, cols, notes):
         '''
@@ -190,12 +332,7 @@ class FRBCat_add:
         :type cols: list
         :type notes: list
         '''
-
-        for idx, note in enumerate(notes):  # loop over all notes
-            cols_i = npappend(cols[idx], ('rop_id', 'last_modified', 'author'))
-            value_i = npappend(note, (self.rop_id, self.authortime,
-                                      self.authorname))
-            self.insert_into_database(table, cols_i, value_i)
+        self.add_notes(table, 'rop_id', self.rop_id, notes)
 
     def add_radio_measured_params(self, table, cols, value):
         '''
@@ -209,14 +346,15 @@ class FRBCat_add:
         :type value: list
         '''
         rank = self.set_rank()
-        cols = npappend(cols, ('rop_id', 'author_id', 'rank'))
-        value = npappend(value, (self.rop_id, self.author_id, rank))
-        ivorn = value[cols == 'voevent_ivorn'][0]
+        row = table_row(table, cols, value)
+        row.extend(('rop_id', 'author_id', 'rank'),
+                   (self.rop_id, self.author_id, rank))
+        ivorn = row.get('voevent_ivorn')
         self.event_exists = self.check_event_exists(ivorn)
         # add event to the database if it does not exist yet
-        self.rmp_id = self.insert_into_database(table, cols, value)
+        self.rmp_id = self.insert_into_database(row)
         # update database if type is supersedes
-        self.update_database(table, cols, value)
+        self.update_database(row)
 
     def add_radio_measured_params_notes(self, table, cols, notes):
         '''
@@ -229,70 +367,121 @@ class FRBCat_add:
         :type cols: list
         :type notes: list
         '''
-        for idx, note in enumerate(notes):  # loop over all notes
-            cols_i = npappend(cols[idx], ('rmp_id', 'last_modified', 'author'))
-            value_i = npappend(note, (self.rmp_id, self.authortime,
-                                      self.authorname))
-            self.insert_into_database(table, cols_i, value_i)
+        self.add_notes(table, 'rmp_id', self.rmp_id, notes)
 
-    def insert_into_database(self, table, cols, value):
+    def add_notes(self, table, ref, ref_id, notes):
+        '''
+        Add all notes of the event to a notes table in a single multi-row
+        insert. Notes that are repeated in the event or that are already
+        in the table for the same entry are skipped.
+
+        :param table: name of database table
+        :param ref: col referencing the entry the notes belong to
+        :param ref_id: id of the entry the notes belong to
+        :param notes: list of notes (each note is a string)
+        :type table: str
+        :type ref: str
+        :type ref_id: int
+        :type notes: list
+        '''
+        notes = [str(note) for note in notes if note]
+        if not notes:
+            return
+        sql = self.notes_sql.format(table=table, ref=ref, parent='%s')
+        self.cursor.execute(sql, (ref_id, self.authortime, self.authorname,
+                                  notes, ref_id))
+
+    def insert_into_database(self, row):
         '''
         Insert event into the database. This method runs sql command.
         If not all required parameters are specified, assume this is an
         update event and return the id for the entry in the table,
         else return the id of the insert.
 
-        :param table: name of database table
-        :param cols: cols in database table that need to be added
-        :param value: values to be set for the cols
-        :type table: str
-        :type cols: list
-        :type value: list
+        :param row: table, cols and values to be added
+        :type row: pyfrbcatdb.table_row.table_row
         :returns: id of insert or id of existing entry in table
         :rtype: int
         '''
+        table = row.table
         try:
-            # remove cols with empty values
-            cols = nparray([i for i, j in zip(cols, value) if j])
-            value = nparray([j for j in value if j]).flatten()
             # define sql params
-            col_sql, parameters, value = self.define_sql_params(cols, value)
+            col_sql, parameters, value = row.sql_params()
+            # use the id from the identity cache if we know the row
+            key = self.identity_key(row)
+            if key:
+                cached = IDENTITY_CACHE.get(key)
+                if cached is not None:
+                    return cached
             # check if VOEVent passes the not null constraints of database
-            if (((table == 'radio_measured_params') and
-                 (set(['voevent_ivorn',
-                       'dm', 'snr', 'width']) < set(cols))) or
-                ((table == 'radio_observations_params') and
-                 (set(['raj', 'decj']) < set(cols))) or
-                ((table == 'observations') and
-                 (set(['telescope', 'verified']) < set(cols))) or
-                ((table == 'frbs') and
-                 (set(['name', 'utc']) < set(cols))) or
-                ((table == 'authors') and
-                 (set(['ivorn']) < set(cols))) or
-                (table == 'radio_measured_params_notes') or (
-                  table == 'radio_observations_params_notes')):
+            if self.insertable(table, row.cols):
                 # define sql statement
                 sql = """INSERT INTO {} ({}) VALUES {}  ON CONFLICT DO NOTHING
                          RETURNING id""".format(table, col_sql, parameters)
                 # execute sql statement, try to insert into database
-                self.cursor.execute(sql, tuple(value))
+                self.cursor.execute(sql, value)
                 try:
                     # return id from insert
-                    return self.cursor.fetchone()[0]  # return last insert id
+                    return_id = self.cursor.fetchone()[0]  # last insert id
                 except TypeError:
                     # insert did not happen due to already existing entry
                     # in database, return id of the existing entry
-                    return self.get_id_existing(table, cols, value)
+                    return_id = self.get_id_existing(row)
             else:
                 # not all required parameters are in voevent xml file
                 # return id if it is already in the database
-                return self.get_id_existing(table, cols, value)
+                return_id = self.get_id_existing(row)
+            if key:
+                IDENTITY_CACHE.set(key, return_id)
+            return return_id
         except psycopg2.IntegrityError:
-            # rollback changes
-            self.connection.rollback()
+            # rollback changes, in batch mode the caller rolls back
+            if not self.batch:
+                self.connection.rollback()
+                IDENTITY_CACHE.rollback()
             # re-raise exception
             raise
 
+    @staticmethod
+    def identity_key(row):
+        '''
+        Natural key of a row in the identity cache.
+
+        :param row: table, cols and values of the row
+        :type row: pyfrbcatdb.table_row.table_row
+        :returns: natural key or None if the table is not cached
+        :rtype: tuple, NoneType
+        '''
+        keys = {'authors': ('ivorn',),
+                'frbs': ('name',),
+                'observations': ('frb_id', 'telescope', 'utc')}
+        if row.table not in keys or not all(
+                col in row for col in keys[row.table]):
+            return None
+        return (row.table,) + tuple(str(row.get(col))
+                                    for col in keys[row.table])
+
+    @staticmethod
+    def insertable(table, cols):
+        '''
+        Check if the cols pass the not null constraints of the database
+        table, i.e. if a new row can be inserted.
+
+        :param table: name of database table
+        :param cols: cols in database table that have a value
+        :type table: str
+        :type cols: list
+        :returns: True if a row can be inserted
+        :rtype: bool
+        '''
+        if table in ['radio_measured_params_notes',
+                     'radio_observations_params_notes']:
+            return True
+        try:
+            return REQUIRED_COLUMNS[table] < set(cols)
+        except KeyError:
+            return False
+
     def get_authortime(self):
         '''
         Get time voevent file was authored from mapping dictionary.
@@ -301,110 +490,79 @@ class FRBCat_add:
         :rtype: str
         '''
         try:
-            return [item.get('value') for item in
-                    self.mapping.get('radio_observations_params_notes')
-                    if item.get('type') == 'authortime'][0]
+            return plain_value([item.get('value') for item in
+                                self.mapping.get(
+                                    'radio_observations_params_notes')
+                                if item.get('type') == 'authortime'][0])
         except IndexError:
             try:
-                return[item.get('value') for item in
-                       self.mapping.get('radio_measured_params_notes')
-                       if item.get('type') == 'authortime'][0]
+                return plain_value([item.get('value') for item in
+                                    self.mapping.get(
+                                        'radio_measured_params_notes')
+                                    if item.get('type') == 'authortime'][0])
             except IndexError:
                 # fall back to insert datetime
                 return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-    def get_id_existing(self, table, cols, value):
+    def get_id_existing(self, row):
         '''
         Get id of an existing entry in database table.
 
-        :param table: name of database table
-        :param cols: cols in database table that need to be added
-        :param value: values to be set for the cols
-        :type table: str
-        :type cols: list
-        :type value: list
+        :param row: table, cols and values to be added
+        :type row: pyfrbcatdb.table_row.table_row
         :returns: id of existing entry in table
         :rtype: int
         '''
-        if table == 'authors':
-            # authors table should have unique ivorn
-            sql = "select id from {} WHERE ivorn = '{}'".format(
-                table, value[cols == 'ivorn'][0])
-        elif table == 'frbs':
-            # frbs table should have unique name
-            sql = "select id from {} WHERE name = '{}'".format(
-                table, value[cols == 'name'][0])
-        elif table == 'observations':
-            # observation table should have an unique combination of
-            # frb_id, telescope, utc
-            sql = """select id from {} WHERE frb_id = '{}' AND
-                    telescope = '{}' AND utc = '{}'""".format(
-                      table, value[cols == 'frb_id'][0],
-                      value[cols == 'telescope'][0],
-                      value[cols == 'utc'][0])
-        elif table == 'radio_observations_params':
-            # rop table should have an unique combination of
-            # obs_id, settings_id
-            sql = """select id from {} WHERE obs_id = '{}' AND settings_id =
-                    '{}'""".format(table,
-                                   value[cols == 'obs_id'][0],
-                                   value[cols == 'settings_id'][0])
-        elif table == 'radio_measured_params':
-            # voevent_ivorn mus tbe unique
-            sql = "select id from {} WHERE voevent_ivorn = '{}'".format(
-                table, value[cols == 'voevent_ivorn'][0])
-        else:
+        table = row.table
+        # natural key of each table, the values must be unique
+        keys = {'authors': ('author_id', ['ivorn']),
+                'frbs': ('frb_id', ['name']),
+                'observations': ('observation_id',
+                                 ['frb_id', 'telescope', 'utc']),
+                'radio_observations_params': ('rop_id',
+                                              ['obs_id', 'settings_id']),
+                'radio_measured_params': ('event_id', ['voevent_ivorn'])}
+        try:
+            name, cols = keys[table]
+        except KeyError:
             # raise IntegrityError
             raise psycopg2.IntegrityError(
               "Unable database table: {}".format(table))
         # get the id
-        self.cursor.execute(sql)
+        params = tuple(row.get(col) for col in cols)
+        dbase.execute(self.cursor, name, params)
         return_id = self.cursor.fetchone()
         if not return_id:
             # Could not get the id from the database
             # re-raise IntegrityError
             raise psycopg2.IntegrityError(
-              "Unable to get id from database: {}".format(sql))
+              "Unable to get id from database: {} {}".format(name, params))
         else:
             return return_id['id']
 
-    def update_database(self, table, cols, value):
+    def update_database(self, row):
         '''
         If type supersedes we need to update existing table values,
         else do nothing. This method executes the sql statement.
 
-        :param table: name of database table
-        :param cols: cols in database table that need to be added
-        :param value: values to be set for the cols
-        :type table: str
-        :type cols: list
-        :type value: list
-
+        :param row: table, cols and values to be updated
+        :type row: pyfrbcatdb.table_row.table_row
         '''
-        # remove cols with empty values
-        cols = nparray([i for i, j in zip(cols, value) if j])
-        value = nparray([j for j in value if j]).flatten()
+        table = row.table
         if (self.event_type == 'supersedes'):
             # event is of type supersedes, so we need to update
-            col_sql, parameters, value = self.define_sql_params(cols, value)
+            col_sql, parameters, value = row.sql_params()
             # define sql statments
-            if table == 'frbs':
-                sql = "update {} SET ({}) = {} WHERE id='{}'".format(
-                  table, col_sql, parameters, self.frb_id)
-            elif table == 'observations':
-                sql = "update {} SET ({}) = {} WHERE id='{}'".format(
-                  table, col_sql, parameters, self.obs_id)
-            elif table == 'radio_observations_params':
-                sql = "update {} SET ({}) = {} WHERE id='{}'".format(
-                  table, col_sql, parameters, self.rop_id)
-            elif table == 'radio_measured_params':
-                sql = "update {} SET ({}) = {} WHERE id='{}'".format(
-                  table, col_sql, parameters, self.rmp_id)
-            else:
-                pass
+            ids = {'frbs': 'frb_id', 'observations': 'obs_id',
+                   'radio_observations_params': 'rop_id',
+                   'radio_measured_params': 'rmp_id'}
+            if table in ids:
+                sql = "update {} SET ({}) = {} WHERE id = %s".format(
+                  table, col_sql, parameters)
+                value = tuple(value) + (getattr(self, ids[table]),)
             try:
                 # execute sql statement
-                self.cursor.execute(sql, tuple(value))
+                self.cursor.execute(sql, value)
             except NameError:
                 pass
         else:
@@ -416,7 +574,12 @@ class FRBCat_add:
         method that iterates over all tables and calls the
         respective method for each table.
         Finally, the database changes are committed and the
-        database connection is closed.
+        database connection is closed. In batch mode the
+        transaction is left open for the caller.
+
+        :returns: True if the event was added or updated, False if the
+            event was already in the database
+        :rtype: bool
         '''
         # define database tables in the order they need to be filled
         tables = ['authors', 'frbs', 'observations',
@@ -425,6 +588,13 @@ class FRBCat_add:
                   'radio_measured_params', 'radio_measured_params_notes']
         # get time voevent file was authored
         self.authortime = self.get_authortime()
+        # serialize the events of this FRB until the transaction ends,
+        # this covers the observation lookups and set_rank as well. The
+        # FRB is locked before the author (see add_authors), in the
+        # same order as FRBCat_add_cte and batch_VOEvent
+        dbase.advisory_lock(self.cursor, 'frbs', [
+            plain_value(item.get('value')) for item in self.mapping.get('frbs')
+            if item.get('column') == 'name'])
         # loop over defined tables
         for table in tables:
             # extract cols that have values
@@ -440,7 +610,8 @@ class FRBCat_add:
                 self.add_authors(table, cols, values)
                 try:
                     # set authorname, needed for notes
-                    self.authorname = values[cols.index('contact_name')]
+                    self.authorname = plain_value(
+                        values[cols.index('contact_name')])
                 except ValueError:
                     self.authorname = 'FRBCat insert'
             if table == 'frbs':
@@ -449,9 +620,6 @@ class FRBCat_add:
                 self.add_frbs_notes(table, cols, values)
             if table == 'observations':
                 self.add_observations(table, cols, values)
-                # create first part of settings_id
-                self.settings_id1 = str(values[cols == 'telescope'][0]
-                                        ) + ';' + str(values[cols == 'utc'][0])
             if table == 'observations_notes':
                 self.add_observations_notes(table, cols, values)
             if table == 'radio_observations_params':
@@ -465,74 +633,297 @@ class FRBCat_add:
                     break  # don't want to add already existing event
             if table == 'radio_measured_params_notes':
                 self.add_radio_measured_params_notes(table, cols, notes)
-        if (self.event_exists and (self.event_type != 'supersedes')):
-            # event is already in database, rollback
-            self.connection.rollback()
+        added = not (self.event_exists and
+                     (self.event_type != 'supersedes'))
+        if self.batch:
+            # caller commits or rolls back the batch transaction
+            return added
+        if added and dbase.commitToDB(self.connection, self.cursor):
+            IDENTITY_CACHE.commit()
         else:
-            dbase.commitToDB(self.connection, self.cursor)
+            # event is already in database or commit failed, rollback
+            self.connection.rollback()
+            IDENTITY_CACHE.rollback()
         dbase.closeDBConnection(self.connection, self.cursor)
+        return added
 
     def retract(self, voevent_cited):
         '''
         Retract event with the ivorn given by voevent_cited.
         Retracting event should set detected/verified to False in
         observations table. Database changes are committed and
-        database connection is closed.
+        database connection is closed. In batch mode the
+        transaction is left open for the caller.
 
         :param voevent_cited: event ivorn to be retracted
         :type voevent_cited: str
+        :returns: True if the cited event was found and retracted
+        :rtype: bool
         '''
-        sql = ("select o.id from radio_measured_params rmp join " +
-               "radio_observations_params rop ON rmp.rop_id=rop.id join " +
-               "observations o on rop.obs_id=o.id join frbs on " +
-               "o.frb_id=frbs.id join authors on frbs.author_id=authors.id " +
-               "where voevent_ivorn='{}'").format(voevent_cited)
-        try:
-            # execute sql statement
-            self.cursor.execute(sql)
-        except NameError:
-            pass
+        dbase.execute(self.cursor, 'retracted_observation', (voevent_cited,))
         # get id in the observations table
         obs_id = self.cursor.fetchone()
         if obs_id:
             # observation is indeed in the database
-            col_sql = ', '.join(map(str, ['detected', 'verified']))
-            parameters = ', '.join(map(str, [False, False]))
-            sql = "update {} SET ({}) = ({}) WHERE id='{}'".format(
-              'observations', col_sql, parameters, obs_id[0])
+            dbase.execute(self.cursor, 'retract_observation', (obs_id[0],))
+            if not self.batch:
+                # commit changes to database
+                dbase.commitToDB(self.connection, self.cursor)
+        if not self.batch:
+            # close database connection
+            dbase.closeDBConnection(self.connection, self.cursor)
+        return bool(obs_id)
+
+
+class FRBCat_add_cte(FRBCat_add):
+    '''
+    Class module that adds a decoded VOEvent file to the FRBCat
+    database in two round trips: a lookup of the author and event
+    ivorn, followed by a single data-modifying CTE statement that
+    inserts (or for supersedes updates) the authors, frbs,
+    observations, radio_observations_params, radio_measured_params
+    and notes rows and returns all ids together.
+
+    :param connection: database connection
+    :param cursor: database cursor object
+    :param mapping: mapping between database entry and VOEvent value.
+    :param event_type: type of VOEvent
+    :param batch: caller owns the transaction (no commit, rollback or
+        closing of the database connection by this class)
+    :type connection: psycopg2.extensions.connection
+    :type cursor: psycopg2.extras.DictCursor
+    :type mapping: dict
+    :type event_type: str
+    :type batch: bool
+    '''
+    # natural key columns used to find an existing row per table
+    keys = {'authors': ['ivorn'],
+            'frbs': ['name'],
+            'observations': ['frb_id', 'telescope', 'utc'],
+            'radio_observations_params': ['obs_id', 'settings_id'],
+            'radio_measured_params': ['voevent_ivorn']}
+    # alias of each table in the CTE statement
+    aliases = {'authors': 'a', 'frbs': 'f', 'observations': 'o',
+               'radio_observations_params': 'rop',
+               'radio_measured_params': 'rmp'}
+
+    def add_VOEvent_to_FRBCat(self):
+        '''
+        Add a VOEvent to the FRBCat database in two round trips.
+        Finally, the database changes are committed and the
+        database connection is closed. In batch mode the
+        transaction is left open for the caller.
+
+        :returns: True if the event was added or updated, False if the
+            event was already in the database
+        :rtype: bool
+        '''
+        # get time voevent file was authored
+        self.authortime = self.get_authortime()
+        rows = {}
+        for table in ['authors', 'frbs', 'observations',
+                      'radio_observations_params', 'radio_measured_params']:
+            rows[table] = self.define_row(table)
+        cols, values = rows['authors']
+        self.authorname = dict(zip(cols, values)).get('contact_name',
+                                                      'FRBCat insert')
+        ivorn = dict(zip(*rows['authors'])).get('ivorn')
+        event_ivorn = dict(zip(*rows['radio_measured_params'])).get(
+            'voevent_ivorn')
+        frb_name = dict(zip(*rows['frbs'])).get('name')
+        # first round trip: lock the FRB, which serializes the events of
+        # this FRB until the transaction ends, look up the existing author
+        # and event, and lock the author if it is new
+        dbase.execute(self.cursor, 'existing_ids', tuple(
+            None if value is None else str(value)
+            for value in [frb_name, ivorn, event_ivorn]))
+        author_id, event_id = self.cursor.fetchone()
+        self.event_exists = event_id is not None
+        if author_id is not None:
+            IDENTITY_CACHE.set(('authors', str(ivorn)), author_id)
+        added = not (self.event_exists and
+                     (self.event_type != 'supersedes'))
+        if added:
+            # second round trip: insert/update all tables
+            sql, params = self.define_cte(rows, author_id)
             try:
-                # execute sql statement
-                self.cursor.execute(sql)
-            except NameError:
-                pass
-            # commit changes to database
-            dbase.commitToDB(self.connection, self.cursor)
-        # close database connection
+                self.cursor.execute(sql, params)
+            except psycopg2.IntegrityError:
+                # rollback changes, in batch mode the caller rolls back
+                if not self.batch:
+                    self.connection.rollback()
+                    IDENTITY_CACHE.rollback()
+                raise
+            (self.author_id, self.frb_id, self.obs_id, self.rop_id,
+             self.rmp_id) = self.cursor.fetchone()
+            for key, value in [(('authors', str(ivorn)), self.author_id),
+                               (('frbs', str(frb_name)), self.frb_id)]:
+                if value is not None:
+                    IDENTITY_CACHE.set(key, value)
+        if self.batch:
+            # caller commits or rolls back the batch transaction
+            return added
+        if added and dbase.commitToDB(self.connection, self.cursor):
+            IDENTITY_CACHE.commit()
+        else:
+            # event is already in database or commit failed, rollback
+            self.connection.rollback()
+            IDENTITY_CACHE.rollback()
         dbase.closeDBConnection(self.connection, self.cursor)
+        return added
 
-    @staticmethod
-    def define_sql_params(cols, value):
-        '''
-        Format sql params for the sql command from the cols and values.
-
-        :param cols: cols in the db table the sql command needs to operate on
-        :param value: values of the col variables
-        :type cols: numpy.ndarray
-        :type value: numpy.ndarray
-        :returns: col_sql (formatted cols array as a comma-seperated string),
-            parameters (string of format (%s,%s,...), equal to the number of
-            elements in cols),
-            value (values of the col objects, converted to flattened
-            regular numpy array)
-        :rtype: str, str, numpy.ndarray
-        '''
-        # define sql params
-        col_sql = ', '.join(map(str, cols))
-        parameters = '(' + ','.join(['%s' for i in value]) + ')'
-        value = [x.text if isinstance(
-                 x, lxml.objectify.StringElement) else x for x in value]
-        value = nparray(value)
-        return col_sql, parameters, value
+    def define_row(self, table):
+        '''
+        Get the cols and values from the mapping for a table, dropping
+        empty values.
+
+        :param table: name of database table
+        :type table: str
+        :returns: cols, values
+        :rtype: list, list
+        '''
+        row = table_row(table)
+        for item in self.mapping.get(table):
+            row.append(item.get('column'), item.get('value'))
+        return row.cols, row.values
+
+    def define_notes(self, table):
+        '''
+        Get the notes from the mapping for a notes table.
+
+        :param table: name of database table
+        :type table: str
+        :returns: list of notes
+        :rtype: list
+        '''
+        return [str(item.get('note')) for item in self.mapping.get(table)
+                if item.get('note')]
+
+    def define_cte(self, rows, author_id):
+        '''
+        Define the data-modifying CTE statement for the event.
+
+        :param rows: (cols, values) per table
+        :param author_id: id of the author if already in the database
+        :type rows: dict
+        :type author_id: int, NoneType
+        :returns: sql statement, parameters
+        :rtype: str, list
+        '''
+        ctes = []
+        params = []
+        refs = {'author_id': '(SELECT id FROM a)',
+                'frb_id': '(SELECT id FROM f)',
+                'obs_id': '(SELECT id FROM o)',
+                'rop_id': '(SELECT id FROM rop)',
+                'rank': '(SELECT rank FROM next_rank)'}
+        # extra cols set from the ids of the tables before
+        extra = {'authors': [],
+                 'frbs': ['author_id'],
+                 'observations': ['frb_id', 'author_id'],
+                 'radio_observations_params': ['obs_id', 'author_id'],
+                 'radio_measured_params': ['rop_id', 'author_id', 'rank']}
+        observation = dict(zip(*rows['observations']))
+        settings_id1 = str(observation.get('telescope')) + ';' + str(
+            observation.get('utc'))
+        for table in ['authors', 'frbs', 'observations',
+                      'radio_observations_params', 'radio_measured_params']:
+            alias = self.aliases[table]
+            cols, values = list(rows[table][0]), list(rows[table][1])
+            if table == 'radio_observations_params' and (
+                    'settings_id' not in cols):
+                row = dict(zip(cols, values))
+                cols.append('settings_id')
+                values.append(settings_id1 + ';' + str(row.get('raj')) +
+                              ';' + str(row.get('decj')))
+            if table == 'radio_measured_params':
+                # rank of the event, first event of an FRB is rank=1
+                # allocated from the frb_ranks counter, see set_rank
+                ctes.append("rank_upd AS ({})".format(
+                    dbase.NEXT_RANK.format(frb_id='(SELECT id FROM f)')))
+                ctes.append("rank_ins AS ({})".format(
+                    dbase.FIRST_RANK.format(
+                        frb_id='f.id', source=' FROM f WHERE NOT EXISTS '
+                        '(SELECT 1 FROM rank_upd)')))
+                ctes.append(
+                    "next_rank AS (SELECT last_rank AS rank FROM rank_upd "
+                    "UNION ALL SELECT last_rank FROM rank_ins)")
+            if table == 'authors' and author_id is not None:
+                # author exists already, it is not updated
+                ctes.append("a AS (SELECT %s::integer AS id)")
+                params.append(author_id)
+                continue
+            # values of all cols, ids of other tables are subqueries
+            vals = ['%s'] * len(values) + [refs[col] for col in extra[table]]
+            col_sql = ', '.join(cols + extra[table])
+            val_sql = ', '.join(vals)
+            row = dict(zip(cols, values))
+            key_sql = ' AND '.join(
+                ['{} = {}'.format(key, refs[key]) if key in refs
+                 else '{} = %s'.format(key) for key in self.keys[table]])
+            key_params = [row.get(key) for key in self.keys[table]
+                          if key not in refs]
+            if self.insertable(table, cols + extra[table]):
+                ctes.append(
+                    "{0}_ins AS (INSERT INTO {1} ({2}) VALUES ({3}) "
+                    "ON CONFLICT DO NOTHING RETURNING id)".format(
+                        alias, table, col_sql, val_sql))
+                params.extend(values)
+                ctes.append(
+                    "{0} AS (SELECT id FROM {0}_ins UNION ALL SELECT id "
+                    "FROM {1} WHERE {2} LIMIT 1)".format(alias, table,
+                                                         key_sql))
+            else:
+                # not all required parameters are in voevent xml file
+                ctes.append("{0} AS (SELECT id FROM {1} WHERE {2})".format(
+                    alias, table, key_sql))
+            params.extend(key_params)
+            if self.event_type == 'supersedes' and table != 'authors':
+                set_sql = ', '.join(['{} = {}'.format(col, val) for col, val
+                                     in zip(cols + extra[table], vals)])
+                ctes.append(
+                    "{0}_upd AS (UPDATE {1} SET {2} WHERE id = "
+                    "(SELECT id FROM {0}))".format(alias, table, set_sql))
+                params.extend(values)
+        for table, ref in [('radio_observations_params_notes', 'rop_id'),
+                           ('radio_measured_params_notes', 'rmp_id')]:
+            notes = self.define_notes(table)
+            if not notes:
+                continue
+            parent = 'rop' if ref == 'rop_id' else 'rmp'
+            ctes.append("{}_notes AS ({})".format(
+                parent, self.notes_sql.format(
+                    table=table, ref=ref,
+                    parent='(SELECT id FROM {})'.format(parent))))
+            params.extend([self.authortime, self.authorname, notes])
+        sql = ("WITH " + ',\n'.join(ctes) +
+               "\nSELECT (SELECT id FROM a), (SELECT id FROM f), "
+               "(SELECT id FROM o), (SELECT id FROM rop), "
+               "(SELECT id FROM rmp)")
+        return sql, params
+
+    def retract(self, voevent_cited):
+        '''
+        Retract event with the ivorn given by voevent_cited in a single
+        statement. Retracting event should set detected/verified to
+        False in observations table. Database changes are committed and
+        database connection is closed. In batch mode the
+        transaction is left open for the caller.
+
+        :param voevent_cited: event ivorn to be retracted
+        :type voevent_cited: str
+        :returns: True if the cited event was found and retracted
+        :rtype: bool
+        '''
+        dbase.execute(self.cursor, 'retract', (voevent_cited,))
+        obs_id = self.cursor.fetchone()
+        if not self.batch:
+            if obs_id:
+                # commit changes to database
+                dbase.commitToDB(self.connection, self.cursor)
+            # close database connection
+            dbase.closeDBConnection(self.connection, self.cursor)
+        return bool(obs_id)
 
 
 class FRBCat_create:
@@ -577,8 +968,8 @@ class FRBCat_create:
                   radio_observations_params.id
                 LEFT JOIN observations_notes
                  ON observations_notes.obs_id=observations.id
-                WHERE frbs.id in ({})""".format(self.frbs_id)
-        self.cursor.execute(sql)
+                WHERE frbs.id = %s"""
+        self.cursor.execute(sql, (self.frbs_id,))
         while True:
             # extract next event from cursor
             self.event = self.cursor.fetchone()
@@ -669,17 +1060,8 @@ class FRBCat_create:
         '''
         Add What section to voevent object.
         '''
-        mapping = parse_mapping()
         # flatten the mapping dictionary into a list of dicts
-        try:
-            values = mapping.itervalues()  # python 2 compatibility
-        except AttributeError:
-            values = mapping.values()
-        for value in values:
-            try:
-                supermapping += value
-            except NameError:
-                supermapping = value
+        supermapping = list(chain.from_iterable(load_mapping().values()))
         self.add_params(supermapping)
 
     def set_how(self):
@@ -825,3 +1207,18 @@ def parse_mapping():
     with open(mfile) as f:
         mapping = yaml.safe_load(f)
     return mapping
+
+
+@lru_cache(maxsize=None)
+def load_mapping():
+    '''
+    Read mapping from json file once per process. The returned mapping
+    is read-only and shared, use parse_mapping for a mutable copy.
+
+    :returns: frozen mapping dictionary from mapping.json data file
+    :rtype: mappingproxy
+    '''
+    mapping = parse_mapping()
+    return MappingProxyType(
+        {table: tuple(MappingProxyType(item) for item in items)
+         for table, items in mapping.items()})
@@ -0,0 +1,350 @@
+'''
+description:    Backfill the FRBCat database from an archive of VOEvents
+license:        APACHE 2.0
+author:         Ronald van Haren, NLeSC (r.vanharen@esciencecenter.nl)
+'''
+import csv
+import io
+import psycopg2
+from pyfrbcatdb import dbase
+from pyfrbcatdb.FRBCat import FRBCat_add_cte
+from pyfrbcatdb.batch_VOEvent import batch_VOEvent
+
+# tables merged from the staging table, in dependency order
+TABLES = ['authors', 'frbs', 'observations', 'radio_observations_params',
+          'radio_measured_params']
+# cols set from the ids of the tables before (see FRBCat_add_cte)
+EXTRA = {'authors': [],
+         'frbs': ['author_id'],
+         'observations': ['frb_id', 'author_id'],
+         'radio_observations_params': ['obs_id', 'author_id'],
+         'radio_measured_params': ['rop_id', 'author_id', 'rank']}
+# ids of the rows of the tables before, selected through JOINS
+REFS = {'author_id': 'a.id', 'frb_id': 'f.id', 'obs_id': 'o.id',
+        'rop_id': 'rop.id'}
+# cols that are not read from the VOEvent
+IDS = frozenset(['id', 'rank']).union(REFS)
+NOTES = ['radio_observations_params_notes', 'radio_measured_params_notes']
+# joins from a staged event to the rows it refers to
+JOINS = {'authors': "JOIN authors a ON a.ivorn = s.a_ivorn",
+         'frbs': "JOIN frbs f ON f.name = s.f_name",
+         'observations': "JOIN observations o ON o.frb_id = f.id AND "
+                         "o.telescope = s.o_telescope AND o.utc = s.o_utc",
+         'radio_observations_params':
+             "JOIN radio_observations_params rop ON rop.obs_id = o.id AND "
+             "rop.settings_id = s.rop_settings_id",
+         'radio_measured_params':
+             "JOIN radio_measured_params rmp ON "
+             "rmp.voevent_ivorn = s.rmp_voevent_ivorn"}
+# natural key of each table in the staging table
+KEYS = {'authors': ['a_ivorn'],
+        'frbs': ['f_name'],
+        'observations': ['f_name', 'o_telescope', 'o_utc'],
+        'radio_observations_params': ['f_name', 'o_telescope', 'o_utc',
+                                      'rop_settings_id']}
+
+
+class backfill_VOEvent(batch_VOEvent):
+    '''
+    Class to backfill the FRBCat database from an archive of VOEvent
+    files. The VOEvents are parsed into flat records, streamed into
+    temporary staging tables with COPY and merged into the authors,
+    frbs, observations, radio_observations_params,
+    radio_measured_params and notes tables with one set-based insert
+    per table. Ranks are allocated with a window function over the
+    input order.
+
+    Only new and followup events with all required values are staged.
+    Supersedes and retraction events, incomplete events and the events
+    of a set-based merge that fails are applied one by one in input
+    order, as in batch_VOEvent, so the result matches sequential
+    ingest.
+
+    :param voevents: list of filestreams or filenames
+    :param dbName: database name
+    :param dbHost: database host
+    :param dbPort: database port
+    :param dbUser: database user name
+    :param dbPassword: database user password
+    :param logfile: name of log file
+    :param batch_size: number of VOEvents per transaction
+    :param cte: apply the events that are not staged with a single
+        data-modifying CTE statement (FRBCat_add_cte)
+    :param validator: validation tier of the VOEvents, default is full
+        validation against the schema
+    :param pool: connection pool or connection to use instead of
+        connecting with the database settings
+    :type voevents: list
+    :type dbName: str
+    :type dbHost: str, NoneType
+    :type dbPort: str, NoneType
+    :type dbUser: str, NoneType
+    :type dbPassword: str, NoneType
+    :type logfile: str
+    :type batch_size: int
+    :type cte: bool
+    :type validator: pyfrbcatdb.validation.validator, NoneType
+    :type pool: pyfrbcatdb.dbase.connection_pool,
+        psycopg2.extensions.connection, NoneType
+    '''
+    def __init__(self, voevents, dbName, dbHost, dbPort, dbUser,
+                 dbPassword, logfile, batch_size=10000, cte=False,
+                 validator=None, pool=None):
+        # staged cols per table, set by create_staging
+        self.columns = None
+        batch_VOEvent.__init__(self, voevents, dbName, dbHost, dbPort,
+                               dbUser, dbPassword, logfile, batch_size, cte,
+                               validator, pool)
+
+    def apply_VOEvents(self, records, stats):
+        '''
+        Merge the parsed VOEvents of a batch in the open batch
+        transaction. Consecutive staged events are merged set-based,
+        the other events are applied one by one in between.
+
+        :param records: list of (name, mapping, event_type) tuples
+        :param stats: statistics of the batch, updated in place
+        :type records: list
+        :type stats: dict
+        '''
+        if self.columns is None:
+            self.create_staging()
+        stats.setdefault('merged', 0)
+        segment = []
+        for name, vo_dict, event_type in records:
+            stats['events'] += 1
+            if vo_dict is None:
+                # ('known', ivorn) events were skipped before parsing
+                stats['skipped' if event_type else 'failed'] += 1
+                continue
+            record = self.stage_record(vo_dict, event_type)
+            if record is not None:
+                segment.append((name, vo_dict, event_type, record))
+                continue
+            # merge the events before this one to keep the input order
+            self.merge_segment(segment, stats)
+            segment = []
+            stats[self.apply_VOEvent(vo_dict, event_type, name)] += 1
+        self.merge_segment(segment, stats)
+
+    def create_staging(self):
+        '''
+        Create the temporary staging tables. The staging table of the
+        events has a col per col of the database tables read from the
+        VOEvent, with the same type and named <table alias>_<col>.
+        '''
+        self.cursor.execute(
+            "SELECT table_name, column_name, column_default FROM "
+            "information_schema.columns WHERE table_schema = "
+            "current_schema() AND table_name = ANY(%s) "
+            "ORDER BY ordinal_position", (TABLES,))
+        self.columns = {table: {} for table in TABLES}
+        for table, column, default in self.cursor.fetchall():
+            if column not in IDS:
+                self.columns[table][column] = default
+        aliases = FRBCat_add_cte.aliases
+        cols = ['NULL::integer AS seq', 'NULL::timestamp AS authortime',
+                'NULL::text AS authorname']
+        cols.extend(['{0}.{1} AS {0}_{1}'.format(aliases[table], col)
+                     for table in TABLES for col in self.columns[table]])
+        self.cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS backfill_events AS SELECT {} "
+            "FROM {} WITH NO DATA".format(', '.join(cols), ', '.join(
+                ['{} {}'.format(table, aliases[table]) for table in TABLES])))
+        self.cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS backfill_notes (seq INTEGER, "
+            "tbl TEXT, idx INTEGER, note TEXT)")
+        self.connection.commit()
+
+    def stage_record(self, mapping, event_type):
+        '''
+        Flatten a parsed VOEvent into a record for the staging tables.
+
+        :param mapping: mapping from mapping.json with values filled
+        :param event_type: event_type and citation if applicable
+        :type mapping: dict
+        :type event_type: tuple
+        :returns: (rows, notes, authortime, authorname) with a dict of
+            col: value per table and a list of notes per notes table,
+            None if the event needs to be applied one by one
+        :rtype: tuple, NoneType
+        '''
+        if event_type[0] not in ['new', 'followup']:
+            return None
+        FRBCat = FRBCat_add_cte(self.connection, self.cursor, mapping,
+                                event_type[0], batch=True)
+        rows = {}
+        for table in TABLES:
+            cols, values = FRBCat.define_row(table)
+            rows[table] = dict(zip(cols, values))
+        observation = rows['observations']
+        rop = rows['radio_observations_params']
+        if 'settings_id' not in rop:
+            rop['settings_id'] = ';'.join(
+                [str(observation.get('telescope')),
+                 str(observation.get('utc')), str(rop.get('raj')),
+                 str(rop.get('decj'))])
+        for table in TABLES:
+            if not FRBCat.insertable(table, list(rows[table]) +
+                                     EXTRA[table]):
+                # relies on rows in the database (or fails)
+                return None
+            if any(col not in self.columns[table] for col in rows[table]):
+                return None
+        notes = {table: FRBCat.define_notes(table) for table in NOTES}
+        authorname = rows['authors'].get('contact_name', 'FRBCat insert')
+        return rows, notes, FRBCat.get_authortime(), authorname
+
+    def merge_segment(self, segment, stats):
+        '''
+        Merge consecutive staged events in a savepoint. If the
+        set-based merge fails, the events are applied one by one.
+
+        :param segment: list of (name, mapping, event_type, record)
+        :param stats: statistics of the batch, updated in place
+        :type segment: list
+        :type stats: dict
+        '''
+        if not segment:
+            return
+        self.cursor.execute("SAVEPOINT backfill")
+        try:
+            self.copy_segment(segment)
+            skipped = self.merge(len(segment))
+        except psycopg2.DatabaseError as e:
+            self.cursor.execute("ROLLBACK TO SAVEPOINT backfill")
+            self.logger.warning(
+                "Unable to merge {} VOEvents, applying them one by one: "
+                "{}".format(len(segment), e))
+            for name, vo_dict, event_type, record in segment:
+                stats[self.apply_VOEvent(vo_dict, event_type, name)] += 1
+            return
+        self.cursor.execute("RELEASE SAVEPOINT backfill")
+        stats['added'] += len(segment) - skipped
+        stats['skipped'] += skipped
+        stats['merged'] += len(segment) - skipped
+
+    def copy_segment(self, segment):
+        '''
+        Stream the records of the staged events into the staging
+        tables with COPY.
+
+        :param segment: list of (name, mapping, event_type, record)
+        :type segment: list
+        '''
+        self.cursor.execute("TRUNCATE backfill_events, backfill_notes")
+        events = io.StringIO()
+        notes = io.StringIO()
+        events_csv = csv.writer(events)
+        notes_csv = csv.writer(notes)
+        for seq, (name, vo_dict, event_type, record) in enumerate(segment):
+            rows, event_notes, authortime, authorname = record
+            events_csv.writerow(
+                [seq, authortime, authorname] +
+                [rows[table].get(col) for table in TABLES
+                 for col in self.columns[table]])
+            for table in NOTES:
+                for idx, note in enumerate(event_notes[table]):
+                    notes_csv.writerow([seq, table, idx, note])
+        events.seek(0)
+        notes.seek(0)
+        self.cursor.copy_expert("COPY backfill_events FROM STDIN CSV", events)
+        self.cursor.copy_expert("COPY backfill_notes FROM STDIN CSV", notes)
+        # temporary tables are not analyzed by autovacuum
+        self.cursor.execute("ANALYZE backfill_events, backfill_notes")
+
+    def staged_values(self, table):
+        '''
+        Cols of a table and the expressions selecting their values from
+        the staging table, empty values get the default of the col.
+
+        :param table: name of database table
+        :type table: str
+        :returns: cols, expressions
+        :rtype: list, list
+        '''
+        alias = FRBCat_add_cte.aliases[table]
+        cols = list(self.columns[table])
+        exprs = []
+        for col, default in self.columns[table].items():
+            if default is None:
+                exprs.append('s.{}_{}'.format(alias, col))
+            else:
+                exprs.append('COALESCE(s.{}_{}, {})'.format(alias, col,
+                                                            default))
+        return cols, exprs
+
+    def merge(self, events):
+        '''
+        Merge the staging tables into the database tables with one
+        set-based insert per table, in dependency order. For each
+        natural key the values of the first event in input order are
+        inserted, existing rows are kept.
+
+        :param events: number of staged events
+        :type events: int
+        :returns: number of events skipped because they are already in
+            the database or earlier in the staging table
+        :rtype: int
+        '''
+        self.cursor.execute(
+            "DELETE FROM backfill_events s USING radio_measured_params r "
+            "WHERE r.voevent_ivorn = s.rmp_voevent_ivorn")
+        skipped = self.cursor.rowcount
+        self.cursor.execute(
+            "DELETE FROM backfill_events WHERE seq IN (SELECT seq FROM "
+            "(SELECT seq, row_number() OVER (PARTITION BY rmp_voevent_ivorn "
+            "ORDER BY seq) AS n FROM backfill_events) d WHERE d.n > 1)")
+        skipped += self.cursor.rowcount
+        joins = []
+        for table in TABLES[:-1]:
+            cols, exprs = self.staged_values(table)
+            cols += EXTRA[table]
+            exprs += [REFS[col] for col in EXTRA[table]]
+            keys = ', '.join(KEYS[table])
+            self.cursor.execute(
+                "INSERT INTO {0} ({1}) SELECT {2} FROM (SELECT DISTINCT ON "
+                "({3}) * FROM backfill_events ORDER BY {3}, seq) s {4} "
+                "ORDER BY s.seq ON CONFLICT DO NOTHING".format(
+                    table, ', '.join(cols), ', '.join(exprs), keys,
+                    ' '.join(joins)))
+            joins.append(JOINS[table])
+        # ranks continue from the frb_ranks counter (see set_rank)
+        self.cursor.execute(
+            "INSERT INTO frb_ranks (frb_id, last_rank) SELECT f.id, ({}) "
+            "FROM frbs f WHERE f.name IN (SELECT f_name FROM "
+            "backfill_events) ON CONFLICT (frb_id) DO NOTHING".format(
+                dbase.LAST_RANK.format(frb_id='f.id')))
+        cols, exprs = self.staged_values('radio_measured_params')
+        self.cursor.execute(
+            "WITH counts AS (SELECT f.id AS frb_id, count(*) AS n FROM "
+            "backfill_events s {0} GROUP BY f.id), "
+            "reserved AS (UPDATE frb_ranks fr SET last_rank = fr.last_rank "
+            "+ c.n FROM counts c WHERE fr.frb_id = c.frb_id RETURNING "
+            "fr.frb_id, fr.last_rank - c.n AS base) "
+            "INSERT INTO radio_measured_params ({1}, rop_id, author_id, "
+            "rank) SELECT {2}, rop.id, a.id, r.base + row_number() OVER "
+            "(PARTITION BY f.id ORDER BY s.seq) FROM backfill_events s {3} "
+            "JOIN reserved r ON r.frb_id = f.id ORDER BY s.seq".format(
+                JOINS['frbs'], ', '.join(cols), ', '.join(exprs),
+                ' '.join(joins)))
+        if self.cursor.rowcount != events - skipped:
+            raise psycopg2.IntegrityError(
+                "Unable to merge all events: {} of {} inserted".format(
+                    self.cursor.rowcount, events - skipped))
+        for table, parent in zip(NOTES, ['radio_observations_params',
+                                         'radio_measured_params']):
+            alias = FRBCat_add_cte.aliases[parent]
+            parent_joins = (joins[1:] if parent == TABLES[3] else
+                            [JOINS[parent]])
+            self.cursor.execute(
+                "INSERT INTO {0} ({1}_id, last_modified, author, note) "
+                "SELECT ref_id, authortime, authorname, note FROM (SELECT "
+                "DISTINCT ON ({1}.id, n.note) {1}.id AS ref_id, "
+                "s.authortime, s.authorname, n.note, s.seq, n.idx FROM "
+                "backfill_notes n JOIN backfill_events s ON s.seq = n.seq {2} "
+                "WHERE n.tbl = %s ORDER BY {1}.id, n.note, s.seq, n.idx) x "
+                "WHERE NOT EXISTS (SELECT 1 FROM {0} e WHERE e.{1}_id = "
+                "x.ref_id AND e.note = x.note) ORDER BY x.seq, x.idx".format(
+                    table, alias, ' '.join(parent_joins)), (table,))
+        return skipped
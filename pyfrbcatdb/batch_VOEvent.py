@@ -0,0 +1,285 @@
+'''
+description:    Create db entries for many VOEvents over one connection
+license:        APACHE 2.0
+author:         Ronald van Haren, NLeSC (r.vanharen@esciencecenter.nl)
+'''
+import time
+from pyfrbcatdb import dbase
+from pyfrbcatdb.FRBCat import FRBCat_add
+from pyfrbcatdb.FRBCat import FRBCat_add_cte
+from pyfrbcatdb.FRBCat import IDENTITY_CACHE
+from pyfrbcatdb.decode_VOEvent import decode_VOEvent
+from pyfrbcatdb.decode_VOEvent import read_citation
+from pyfrbcatdb.decode_VOEvent import read_ivorn
+from pyfrbcatdb.logger import logger
+from pyfrbcatdb.table_row import plain_value
+
+
+class batch_VOEvent(decode_VOEvent):
+    '''
+    Class to decode a list of VOEvent files and insert them into the
+    FRBCat database. A single database connection is used for all
+    VOEvents and every batch_size events are committed in a single
+    transaction. Each event is wrapped in a savepoint, so a failing
+    event only rolls back itself.
+
+    :param voevents: list of filestreams or filenames
+    :param dbName: database name
+    :param dbHost: database host
+    :param dbPort: database port
+    :param dbUser: database user name
+    :param dbPassword: database user password
+    :param logfile: name of log file
+    :param batch_size: number of VOEvents per transaction
+    :param cte: insert each event with a single data-modifying CTE
+        statement (FRBCat_add_cte) instead of a statement per table
+    :param validator: validation tier of the VOEvents, default is full
+        validation against the schema
+    :param pool: connection pool or connection to use instead of
+        connecting with the database settings
+    :type voevents: list
+    :type dbName: str
+    :type dbHost: str, NoneType
+    :type dbPort: str, NoneType
+    :type dbUser: str, NoneType
+    :type dbPassword: str, NoneType
+    :type logfile: str
+    :type batch_size: int
+    :type cte: bool
+    :type validator: pyfrbcatdb.validation.validator, NoneType
+    :type pool: pyfrbcatdb.dbase.connection_pool,
+        psycopg2.extensions.connection, NoneType
+    '''
+    def __init__(self, voevents, dbName, dbHost, dbPort, dbUser,
+                 dbPassword, logfile, batch_size=100, cte=False,
+                 validator=None, pool=None):
+        logger.__init__(self, logfile)
+        self.dbName = dbName
+        self.dbHost = dbHost
+        self.dbPort = dbPort
+        self.dbUser = dbUser
+        self.dbPassword = dbPassword
+        self.batch_size = max(int(batch_size), 1)
+        self.cte = cte
+        self.pool = pool
+        if validator is not None:
+            self.validator = validator
+        # per-batch statistics, one dictionary per committed batch
+        self.batch_stats = []
+        self.process_VOEvents(voevents)
+
+    def process_VOEvents(self, voevents):
+        '''
+        Split the VOEvents in batches and ingest the batches over
+        a single database connection.
+
+        :param voevents: list of filestreams or filenames
+        :type voevents: list
+        '''
+        statements = {name: (calls, seconds) for name, calls, seconds in
+                      dbase.statement_stats()}
+        with dbase.lend(self.pool, self.dbName, self.dbUser,
+                        self.dbPassword, self.dbHost,
+                        self.dbPort) as (self.connection, self.cursor):
+            batch = []
+            start = time.time()
+            for record in self.parse_VOEvents(voevents):
+                batch.append(record)
+                if len(batch) == self.batch_size:
+                    self.write_batch(batch, start)
+                    batch = []
+                    start = time.time()
+            if batch:
+                self.write_batch(batch, start)
+        # calls and latency of the statements of this run, slowest first
+        run = [(seconds - statements.get(name, (0, 0))[1],
+                calls - statements.get(name, (0, 0))[0], name)
+               for name, calls, seconds in dbase.statement_stats()]
+        for seconds, calls, name in sorted(run, reverse=True):
+            if calls:
+                self.logger.info("Statement {}: {} calls in {:.3f}s".format(
+                    name, calls, seconds))
+
+    def parse_VOEvents(self, voevents):
+        '''
+        Parse the VOEvents one by one. Events that are already in the
+        database are skipped before the full parse, see known_VOEvents.
+
+        :param voevents: list of filestreams or filenames
+        :type voevents: list
+        :returns: generator of (name, mapping, event_type) tuples, mapping
+            and event_type are None if the VOEvent could not be parsed,
+            mapping is None and event_type is ('known', ivorn) if the
+            VOEvent is already in the database
+        :rtype: generator
+        '''
+        for start in range(0, len(voevents), self.batch_size):
+            chunk = voevents[start:start + self.batch_size]
+            for voevent, known in zip(chunk, self.known_VOEvents(chunk)):
+                name = getattr(voevent, 'name', voevent)
+                if known:
+                    yield name, None, ('known', known)
+                    continue
+                try:
+                    vo_dict, event_type = self.parse_VOEvent(voevent)
+                except Exception as e:
+                    self.logger.error("Unable to parse VOEvent {}: "
+                                      "{}".format(name, e))
+                    yield name, None, None
+                    continue
+                yield name, vo_dict, event_type
+
+    def known_VOEvents(self, voevents):
+        '''
+        Find the VOEvents that would be skipped because their event is
+        already in the database, without parsing them. The ivorns are
+        read from the root elements and checked with a single query.
+        Supersedes events are not skipped, they update the event.
+
+        :param voevents: list of filestreams or filenames
+        :type voevents: list
+        :returns: ivorn of each VOEvent that is already in the database,
+            None for the other VOEvents
+        :rtype: list
+        '''
+        ivorns = [read_ivorn(voevent) for voevent in voevents]
+        self.cursor.execute("SELECT voevent_ivorn FROM radio_measured_params "
+                            "WHERE voevent_ivorn = ANY(%s)",
+                            ([ivorn for ivorn in ivorns if ivorn],))
+        found = set(row[0] for row in self.cursor.fetchall())
+        known = []
+        for voevent, ivorn in zip(voevents, ivorns):
+            # the citation is only read for the events in the database
+            citation = read_citation(voevent) if ivorn in found else None
+            if citation is None or citation[0] == 'supersedes':
+                known.append(None)
+                continue
+            self.logger.info("Skipping VOEvent {}: event {} is already in "
+                             "the database".format(
+                                 getattr(voevent, 'name', voevent), ivorn))
+            known.append(ivorn)
+        return known
+
+    def write_batch(self, records, start=None):
+        '''
+        Insert a batch of parsed VOEvents in a single transaction
+        and log the throughput of the batch.
+
+        :param records: list of (name, mapping, event_type) tuples
+        :param start: time the batch started, default is now
+        :type records: list
+        :type start: float, NoneType
+        :returns: statistics of the batch
+        :rtype: dict
+        '''
+        if start is None:
+            start = time.time()
+        stats = {'batch': len(self.batch_stats) + 1, 'events': 0,
+                 'added': 0, 'skipped': 0, 'failed': 0}
+        hits, misses = IDENTITY_CACHE.hits, IDENTITY_CACHE.misses
+        self.apply_VOEvents(records, stats)
+        stats['committed'] = dbase.commitToDB(self.connection, self.cursor)
+        if stats['committed']:
+            IDENTITY_CACHE.commit()
+        else:
+            # the whole batch is rolled back, nothing was added
+            IDENTITY_CACHE.rollback()
+            self.logger.error(
+                "Unable to commit batch {}, {} added events are rolled "
+                "back".format(stats['batch'], stats['added']))
+            stats['failed'] += stats['added']
+            stats['added'] = 0
+        stats['seconds'] = time.time() - start
+        stats['rate'] = stats['events'] / max(stats['seconds'], 1e-9)
+        stats['cache_hits'] = IDENTITY_CACHE.hits - hits
+        stats['cache_misses'] = IDENTITY_CACHE.misses - misses
+        self.logger.info(
+            "Batch {batch}: {events} events, {added} added, {skipped} "
+            "skipped, {failed} failed in {seconds:.2f}s "
+            "({rate:.1f} events/s), identity cache {cache_hits} hits, "
+            "{cache_misses} misses".format(**stats))
+        self.batch_stats.append(stats)
+        return stats
+
+    def apply_VOEvents(self, records, stats):
+        '''
+        Insert or retract the parsed VOEvents of a batch one by one in
+        the open batch transaction.
+
+        :param records: list of (name, mapping, event_type) tuples
+        :param stats: statistics of the batch, updated in place
+        :type records: list
+        :type stats: dict
+        '''
+        # lock the FRBs of the whole batch in sorted order before the
+        # first event, concurrent batches sharing FRBs then wait for each
+        # other instead of deadlocking
+        dbase.advisory_lock(self.cursor, 'frbs', [
+            plain_value(item.get('value')) for name, vo_dict, event_type
+            in records if vo_dict for item in vo_dict.get('frbs')
+            if item.get('column') == 'name'])
+        for name, vo_dict, event_type in records:
+            stats['events'] += 1
+            stats[self.apply_record(name, vo_dict, event_type)] += 1
+
+    def apply_record(self, name, mapping, event_type):
+        '''
+        Insert or retract a parsed VOEvent of a batch.
+
+        :param name: name of the VOEvent
+        :param mapping: mapping from mapping.json with values filled, None
+            if the VOEvent was not parsed
+        :param event_type: event_type and citation if applicable
+        :type name: str
+        :type mapping: dict, NoneType
+        :type event_type: tuple, NoneType
+        :returns: 'added', 'skipped' or 'failed'
+        :rtype: str
+        '''
+        if mapping is None:
+            # ('known', ivorn) events were skipped before parsing
+            return 'skipped' if event_type else 'failed'
+        return self.apply_VOEvent(mapping, event_type, name)
+
+    def apply_VOEvent(self, mapping, event_type, name=None):
+        '''
+        Insert or retract a single parsed VOEvent inside a savepoint of
+        the open batch transaction.
+
+        :param mapping: mapping from mapping.json with values filled
+        :param event_type: event_type and citation if applicable
+        :param name: name of the VOEvent, used for logging
+        :type mapping: dict
+        :type event_type: tuple
+        :type name: str, NoneType
+        :returns: 'added', 'skipped' or 'failed'
+        :rtype: str
+        '''
+        self.cursor.execute("SAVEPOINT voevent")
+        savepoint = IDENTITY_CACHE.savepoint()
+        if self.cte:
+            FRBCat = FRBCat_add_cte(self.connection, self.cursor, mapping,
+                                    event_type[0], batch=True)
+        else:
+            FRBCat = FRBCat_add(self.connection, self.cursor, mapping,
+                                event_type[0], batch=True)
+        try:
+            if event_type[0] in ['new', 'followup', 'supersedes']:
+                changed = FRBCat.add_VOEvent_to_FRBCat()
+            elif event_type[0] in ['retraction']:
+                changed = FRBCat.retract(event_type[1])
+            else:
+                changed = False
+        except Exception as e:
+            self.cursor.execute("ROLLBACK TO SAVEPOINT voevent")
+            IDENTITY_CACHE.rollback(savepoint)
+            self.logger.error("Unable to insert VOEvent {}: {}".format(
+                name, e))
+            return 'failed'
+        if changed:
+            self.cursor.execute("RELEASE SAVEPOINT voevent")
+            return 'added'
+        # event already in database, undo any partial inserts
+        self.cursor.execute("ROLLBACK TO SAVEPOINT voevent")
+        IDENTITY_CACHE.rollback(savepoint)
+        return 'skipped'
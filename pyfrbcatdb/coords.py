@@ -0,0 +1,158 @@
+'''
+description:    Sexagesimal formatting of event coordinates
+license:        APACHE 2.0
+author:         Ronald van Haren, NLeSC (r.vanharen@esciencecenter.nl)
+'''
+import math
+import numpy
+
+# scale to convert degrees to hours, computed the way astropy units
+# does (degree / hourangle), which is not exactly 1 / 15
+DEG_TO_HOUR = (math.pi / 180) / (15 * (math.pi / 180))
+
+
+def wrap_ra(ra):
+    '''
+    Wrap ra to the range 0 <= ra < 360 degrees, as astropy Longitude.
+
+    :param ra: right ascension in degrees
+    :type ra: float
+    :returns: wrapped right ascension in degrees
+    :rtype: float
+    '''
+    wraps = ra // 360.0
+    if math.isfinite(wraps) and wraps != 0:
+        ra -= wraps * 360.0
+        if ra >= 360.0:
+            ra -= 360.0
+        if ra < 0.0:
+            ra += 360.0
+    return ra
+
+
+def check_dec(dec):
+    '''
+    Check that dec is within -90 <= dec <= 90 degrees, as astropy
+    Latitude.
+
+    :param dec: declination in degrees
+    :type dec: float, numpy.ndarray
+    '''
+    if numpy.any(numpy.abs(dec) > 90.0):
+        raise ValueError('Latitude angle(s) must be within -90 deg <= '
+                         'angle <= 90 deg, got {}'.format(dec))
+
+
+def sexagesimal(value):
+    '''
+    Split a value in (hours or degrees, minutes, seconds), all with the
+    sign of value.
+
+    :param value: value in hours or degrees
+    :type value: float
+    :returns: (hours or degrees, minutes, seconds)
+    :rtype: tuple
+    '''
+    sign = math.copysign(1.0, value)
+    (vf, v) = math.modf(abs(value))
+    (mf, m) = math.modf(vf * 60.0)
+    return math.floor(sign * v), sign * math.floor(m), sign * mf * 60.0
+
+
+def locstring(coordloc):
+    '''
+    Format a (hours or degrees, minutes, seconds) tuple as
+    HH:MM:SS.SS or DD:MM:SS.SS. The sign of values between -1 and 0
+    is lost and seconds are rounded, e.g. to 60.00.
+
+    :param coordloc: (hours or degrees, minutes, seconds)
+    :type coordloc: tuple
+    :returns: location string
+    :rtype: str
+    '''
+    return '{}:{}:{}'.format(
+        str(int(round(coordloc[0]))).zfill(2),
+        str(abs(int(round(coordloc[1])))).zfill(2),
+        "{:.2f}".format(abs(coordloc[2])).zfill(5))
+
+
+def format_ra(ra):
+    '''
+    Format right ascension in degrees as HH:MM:SS.SS.
+
+    :param ra: right ascension in degrees
+    :type ra: float
+    :returns: location string in HH:MM:SS.SS
+    :rtype: str
+    '''
+    return locstring(sexagesimal(wrap_ra(float(ra)) * DEG_TO_HOUR))
+
+
+def format_dec(dec):
+    '''
+    Format declination in degrees as DD:MM:SS.SS.
+
+    :param dec: declination in degrees
+    :type dec: float
+    :returns: location string in DD:MM:SS.SS
+    :rtype: str
+    '''
+    dec = float(dec)
+    check_dec(dec)
+    return locstring(sexagesimal(dec))
+
+
+def locstrings(value):
+    '''
+    Vectorized version of locstring(sexagesimal(value)).
+
+    :param value: values in hours or degrees
+    :type value: numpy.ndarray
+    :returns: location strings
+    :rtype: numpy.ndarray
+    '''
+    sign = numpy.copysign(1.0, value)
+    (vf, v) = numpy.modf(numpy.abs(value))
+    (mf, m) = numpy.modf(vf * 60.0)
+    first = numpy.floor(sign * v).astype(numpy.int64)
+    minutes = numpy.floor(m).astype(numpy.int64)
+    seconds = numpy.abs(mf * 60.0)
+    # zero padding with a minimum width equals str.zfill
+    return numpy.char.add(numpy.char.add(
+        numpy.char.add(numpy.char.mod('%02d', first), ':'),
+        numpy.char.add(numpy.char.mod('%02d', minutes), ':')),
+        numpy.char.mod('%05.2f', seconds))
+
+
+def format_ra_batch(ra):
+    '''
+    Format an array of right ascensions in degrees as HH:MM:SS.SS.
+
+    :param ra: right ascensions in degrees
+    :type ra: numpy.ndarray, list
+    :returns: location strings in HH:MM:SS.SS
+    :rtype: numpy.ndarray
+    '''
+    ra = numpy.array(ra, dtype=numpy.float64)
+    with numpy.errstate(invalid='ignore'):
+        wraps = ra // 360.0
+    valid = numpy.isfinite(wraps) & (wraps != 0)
+    if numpy.any(valid):
+        ra -= numpy.where(valid, wraps, 0) * 360.0
+        ra[valid & (ra >= 360.0)] -= 360.0
+        ra[valid & (ra < 0.0)] += 360.0
+    return locstrings(ra * DEG_TO_HOUR)
+
+
+def format_dec_batch(dec):
+    '''
+    Format an array of declinations in degrees as DD:MM:SS.SS.
+
+    :param dec: declinations in degrees
+    :type dec: numpy.ndarray, list
+    :returns: location strings in DD:MM:SS.SS
+    :rtype: numpy.ndarray
+    '''
+    dec = numpy.array(dec, dtype=numpy.float64)
+    check_dec(dec)
+    return locstrings(dec)
@@ -7,7 +7,8 @@ from pyfrbcatdb import dbase
 from pyfrbcatdb.FRBCat import *
 
 
-def create_VOEvent(frb_ids, dbName, dbHost, dbPort, dbUser, dbPassword):
+def create_VOEvent(frb_ids, dbName, dbHost, dbPort, dbUser, dbPassword,
+                   pool=None):
     '''
     Decode FRBCat entry.
 
@@ -17,20 +18,21 @@ def create_VOEvent(frb_ids, dbName, dbHost, dbPort, dbUser, dbPassword):
     :param dbPort: database port
     :param dbUser: database user name
     :param dbPassword: database user password
+    :param pool: connection pool or connection to use instead of
+        connecting with the database settings
     :type frb_ids: list
     :type dbName: str
     :type dbHost: str, NoneType
     :type dbPort: str, NoneType
     :type dbUser: str, NoneType
     :type dbPassword: str, NoneType
+    :type pool: pyfrbcatdb.dbase.connection_pool,
+        psycopg2.extensions.connection, NoneType
 
     '''
     # connect to database
-    connection, cursor = dbase.connectToDB(dbName,
-                                           dbUser,
-                                           dbPassword,
-                                           dbHost,
-                                           dbPort)
-    for frb_id in frb_ids:
-        FRBCat = FRBCat_create(connection, cursor, frb_id)
-        FRBCat.create_VOEvent_from_FRBCat()
+    with dbase.lend(pool, dbName, dbUser, dbPassword, dbHost,
+                    dbPort) as (connection, cursor):
+        for frb_id in frb_ids:
+            FRBCat = FRBCat_create(connection, cursor, frb_id)
+            FRBCat.create_VOEvent_from_FRBCat()
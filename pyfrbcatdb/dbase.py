@@ -5,8 +5,15 @@ description:    Common database functionality for pyfrbcatdb
 license:        APACHE 2.0
 author:         Ronald van Haren, NLeSC (r.vanharen@esciencecenter.nl)
 '''
+import re
+import threading
+import time
+import weakref
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
+import psycopg2.pool
+from contextlib import contextmanager
 
 
 def connectToDB(dbName=None, dbUser=None, dbPassword=None, dbHost=None,
@@ -30,24 +37,276 @@ def connectToDB(dbName=None, dbUser=None, dbPassword=None, dbHost=None,
         psycopg2.extras.DictCursor
     '''
     # Start DB connection
-    try:
-        connectionString = "dbname='" + dbName + "'"
-        if (dbUser and dbUser is not '='):
-            connectionString += " user='" + dbUser + "'"
-        if (dbHost and dbHost is not '='):
-            connectionString += " host='" + dbHost + "'"
-        if (dbPassword and dbPassword is not '='):
-            connectionString += " password='" + dbPassword + "'"
-        if (dbPort and dbPort is not '='):
-            connectionString += " port='" + str(dbPort) + "'"
-        connection = psycopg2.connect(connectionString)
-    except Exception:
-        raise
+    connection = psycopg2.connect(connectionString(dbName, dbUser,
+                                                   dbPassword, dbHost,
+                                                   dbPort))
     # if the connection succeeded get a cursor
     cursor = connection.cursor(cursor_factory=dbCursor)
     return connection, cursor
 
 
+def connectionString(dbName=None, dbUser=None, dbPassword=None, dbHost=None,
+                     dbPort=None):
+    '''
+    Connection string of a PostgreSQL DB, settings that are not given
+    or '=' are left to the libpq defaults.
+
+    :param dbName: database name
+    :param dbHost: database host
+    :param dbPort: database port
+    :param dbUser: database user name
+    :param dbPassword: database user password
+    :type dbName: str
+    :type dbHost: str, NoneType
+    :type dbPort: str, NoneType
+    :type dbUser: str, NoneType
+    :type dbPassword: str, NoneType
+    :returns: connection string
+    :rtype: str
+    '''
+    connectionString = "dbname='" + dbName + "'"
+    if (dbUser and dbUser != '='):
+        connectionString += " user='" + dbUser + "'"
+    if (dbHost and dbHost != '='):
+        connectionString += " host='" + dbHost + "'"
+    if (dbPassword and dbPassword != '='):
+        connectionString += " password='" + dbPassword + "'"
+    if (dbPort and dbPort != '='):
+        connectionString += " port='" + str(dbPort) + "'"
+    return connectionString
+
+
+class connection_pool:
+    '''
+    Pool of connections to a PostgreSQL DB, shared by the threads of a
+    long-running process. Connections are lent as context managers, see
+    connection. A connection that has been idle for check_interval
+    seconds is checked before it is lent and replaced if it is broken.
+
+    :param dbName: database name
+    :param dbUser: database user name
+    :param dbPassword: database user password
+    :param dbHost: database host
+    :param dbPort: database port
+    :param minconn: number of connections opened up front
+    :param maxconn: maximum number of connections
+    :param check_interval: seconds a connection can be idle before it
+        is checked
+    :param timeout: seconds to wait for a free connection, wait
+        forever if None
+    :type dbName: str
+    :type dbUser: str, NoneType
+    :type dbPassword: str, NoneType
+    :type dbHost: str, NoneType
+    :type dbPort: str, NoneType
+    :type minconn: int
+    :type maxconn: int
+    :type check_interval: float
+    :type timeout: float, NoneType
+    '''
+    def __init__(self, dbName=None, dbUser=None, dbPassword=None,
+                 dbHost=None, dbPort=None, minconn=1, maxconn=4,
+                 check_interval=30, timeout=None):
+        if not 0 <= minconn <= maxconn or maxconn < 1:
+            raise ValueError("Invalid pool size: minconn={}, "
+                             "maxconn={}".format(minconn, maxconn))
+        self.dsn = connectionString(dbName, dbUser, dbPassword, dbHost,
+                                    dbPort)
+        self.maxconn = maxconn
+        self.check_interval = check_interval
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        # idle connections with the time they were returned
+        self.idle = []
+        # number of open connections, idle or lent
+        self.size = 0
+        self.closed = False
+        self.opened = 0
+        self.replaced = 0
+        for idx in range(minconn):
+            self.idle.append((psycopg2.connect(self.dsn), time.time()))
+            self.size += 1
+            self.opened += 1
+
+    @contextmanager
+    def connection(self, dbCursor=psycopg2.extras.DictCursor):
+        '''
+        Lend a connection and a new cursor. An open transaction is
+        rolled back when the connection is returned.
+
+        :param dbCursor: cursor class
+        :type dbCursor: type
+        :returns: connection, cursor
+        :rtype: psycopg2.extensions.connection,
+            psycopg2.extras.DictCursor
+        '''
+        connection = self.getconn()
+        try:
+            cursor = connection.cursor(cursor_factory=dbCursor)
+            try:
+                yield connection, cursor
+            finally:
+                if not cursor.closed:
+                    cursor.close()
+        finally:
+            self.putconn(connection)
+
+    def getconn(self):
+        '''
+        Take a healthy connection from the pool, open a new connection
+        if there is no idle one and the pool is not full.
+
+        :returns: connection
+        :rtype: psycopg2.extensions.connection
+        '''
+        deadline = None if self.timeout is None else (time.time() +
+                                                      self.timeout)
+        with self.condition:
+            while True:
+                if self.closed:
+                    raise psycopg2.pool.PoolError("connection pool is closed")
+                if self.idle:
+                    connection, returned = self.idle.pop()
+                    break
+                if self.size < self.maxconn:
+                    # reserve the slot, connect outside the lock
+                    self.size += 1
+                    connection, returned = None, None
+                    break
+                wait = None if deadline is None else deadline - time.time()
+                if wait is not None and wait <= 0:
+                    raise psycopg2.pool.PoolError(
+                        "no free connection within {}s".format(self.timeout))
+                self.condition.wait(wait)
+        try:
+            if connection is not None and not self.healthy(connection,
+                                                           returned):
+                self.replaced += 1
+                connection.close()
+                connection = None
+            if connection is None:
+                connection = psycopg2.connect(self.dsn)
+                self.opened += 1
+        except Exception:
+            self.discard()
+            raise
+        return connection
+
+    def healthy(self, connection, returned):
+        '''
+        Check an idle connection before it is lent.
+
+        :param connection: idle connection
+        :param returned: time the connection was returned to the pool
+        :type connection: psycopg2.extensions.connection
+        :type returned: float
+        :returns: False if the connection is broken
+        :rtype: bool
+        '''
+        if connection.closed:
+            return False
+        if time.time() - returned < self.check_interval:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def putconn(self, connection):
+        '''
+        Return a lent connection to the pool. An open transaction is
+        rolled back, a broken connection is closed.
+
+        :param connection: lent connection
+        :type connection: psycopg2.extensions.connection
+        '''
+        status = psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN
+        if not connection.closed:
+            status = connection.get_transaction_status()
+        if status not in [psycopg2.extensions.TRANSACTION_STATUS_IDLE,
+                          psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN]:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                status = psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN
+        if self.closed or \
+                status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            if not connection.closed:
+                connection.close()
+            self.discard()
+            return
+        with self.condition:
+            self.idle.append((connection, time.time()))
+            self.condition.notify()
+
+    def discard(self):
+        '''
+        Free the slot of a connection that is closed.
+        '''
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def close(self):
+        '''
+        Close the idle connections, lent connections are closed when
+        they are returned.
+        '''
+        with self.condition:
+            self.closed = True
+            for connection, returned in self.idle:
+                connection.close()
+                self.size -= 1
+            self.idle = []
+            self.condition.notify_all()
+
+
+@contextmanager
+def lend(pool=None, dbName=None, dbUser=None, dbPassword=None, dbHost=None,
+         dbPort=None, dbCursor=psycopg2.extras.DictCursor):
+    '''
+    Lend a connection and a new cursor from a connection pool or from
+    an existing connection, both are left open. Without a pool or
+    connection, a new connection to dbName is opened and closed
+    afterwards.
+
+    :param pool: connection pool or connection to use
+    :param dbName: database name
+    :param dbUser: database user name
+    :param dbPassword: database user password
+    :param dbHost: database host
+    :param dbPort: database port
+    :param dbCursor: cursor class
+    :type pool: pyfrbcatdb.dbase.connection_pool,
+        psycopg2.extensions.connection, NoneType
+    :type dbName: str
+    :type dbUser: str, NoneType
+    :type dbPassword: str, NoneType
+    :type dbHost: str, NoneType
+    :type dbPort: str, NoneType
+    :type dbCursor: type
+    :returns: connection, cursor
+    :rtype: psycopg2.extensions.connection,
+        psycopg2.extras.DictCursor
+    '''
+    if isinstance(pool, connection_pool):
+        with pool.connection(dbCursor) as (connection, cursor):
+            yield connection, cursor
+    elif pool is not None:
+        with pool.cursor(cursor_factory=dbCursor) as cursor:
+            yield pool, cursor
+    else:
+        connection, cursor = connectToDB(dbName, dbUser, dbPassword, dbHost,
+                                         dbPort, dbCursor)
+        try:
+            yield connection, cursor
+        finally:
+            closeDBConnection(connection, cursor)
+
+
 def closeDBConnection(connection, cursor):
     '''
     Closes a connection to a DB given the connection and cursor objects.
@@ -70,11 +329,15 @@ def commitToDB(connection, cursor):
     :param cursor: database cursor object
     :type connection: psycopg2.extensions.connection
     :type cursor: psycopg2.extras.DictCursor
+    :returns: True if the changes were committed
+    :rtype: bool
     '''
     try:
         connection.commit()
     except psycopg2.DatabaseError:
         connection.rollback()
+        return False
+    return True
 
 
 def extract_from_db_sql(cursor, table, column, col, value):
@@ -92,7 +355,232 @@ def extract_from_db_sql(cursor, table, column, col, value):
     :type col: str
     :type value: str
     '''
-    sql = "select {} from {} where {}='{}'".format(column, table,
-                                                   col, value)
-    cursor.execute(sql)
+    name = 'extract_{}_{}_{}'.format(table, column, col)
+    if name not in STATEMENTS:
+        register(name, "select {} from {} where {} = %s".format(
+            column, table, col))
+    execute(cursor, name, (value,))
     return cursor.fetchone()
+
+
+class statement:
+    '''
+    SQL statement of the statement registry, with %s bind parameters.
+    The statement keeps the number of calls and the cumulative
+    latency of its executions in this process.
+
+    :param name: name of the statement, used for PREPARE
+    :param sql: sql with a %s placeholder per parameter
+    :param types: PostgreSQL types of the parameters, inferred by the
+        server if not given
+    :type name: str
+    :type sql: str
+    :type types: tuple
+    '''
+    def __init__(self, name, sql, types=()):
+        self.name = name
+        self.sql = sql
+        self.types = tuple(types)
+        self.calls = 0
+        self.seconds = 0.0
+
+    def prepare_sql(self):
+        '''
+        PREPARE statement of the sql, with $n placeholders.
+
+        :returns: sql of the PREPARE statement
+        :rtype: str
+        '''
+        count = iter(range(1, self.sql.count('%s') + 1))
+        sql = re.sub('%s', lambda match: '${}'.format(next(count)),
+                     self.sql)
+        types = ' ({})'.format(', '.join(self.types)) if self.types else ''
+        return "PREPARE {}{} AS {}".format(self.name, types, sql)
+
+    def execute_sql(self):
+        '''
+        EXECUTE statement of a prepared statement.
+
+        :returns: sql of the EXECUTE statement with %s placeholders
+        :rtype: str
+        '''
+        params = self.sql.count('%s')
+        if not params:
+            return "EXECUTE {}".format(self.name)
+        return "EXECUTE {} ({})".format(self.name, ', '.join(['%s'] * params))
+
+
+# statement registry, statements by name
+STATEMENTS = {}
+# names of the statements prepared per connection, None if the
+# connection can not prepare statements
+PREPARED = weakref.WeakKeyDictionary()
+
+
+def register(name, sql, types=()):
+    '''
+    Add a statement to the statement registry.
+
+    :param name: name of the statement
+    :param sql: sql with a %s placeholder per parameter
+    :param types: PostgreSQL types of the parameters
+    :type name: str
+    :type sql: str
+    :type types: tuple
+    :returns: the registered statement
+    :rtype: pyfrbcatdb.dbase.statement
+    '''
+    STATEMENTS[name] = statement(name, sql, types)
+    return STATEMENTS[name]
+
+
+def prepare(cursor, stmt):
+    '''
+    Prepare a statement once per connection. If the connection can
+    not prepare statements (e.g. behind a transaction pooler), the
+    connection is marked and its statements are executed unprepared.
+
+    :param cursor: database cursor object
+    :param stmt: registered statement
+    :type cursor: psycopg2.extras.DictCursor
+    :type stmt: pyfrbcatdb.dbase.statement
+    :returns: True if the statement is prepared on the connection
+    :rtype: bool
+    '''
+    connection = cursor.connection
+    prepared = PREPARED.setdefault(connection, set())
+    if prepared is None:
+        return False
+    if stmt.name in prepared:
+        return True
+    # a failing PREPARE must not abort the open transaction
+    savepoint = not connection.autocommit
+    if savepoint:
+        cursor.execute("SAVEPOINT dbase_prepare")
+    try:
+        cursor.execute(stmt.prepare_sql())
+    except psycopg2.Error:
+        if savepoint:
+            cursor.execute("ROLLBACK TO SAVEPOINT dbase_prepare")
+        PREPARED[connection] = None
+        return False
+    if savepoint:
+        cursor.execute("RELEASE SAVEPOINT dbase_prepare")
+    # prepared statements are not undone by a rollback
+    prepared.add(stmt.name)
+    return True
+
+
+def execute(cursor, name, params=()):
+    '''
+    Execute a registered statement, prepared on first use per
+    connection. Results are fetched from the cursor as usual.
+
+    :param cursor: database cursor object
+    :param name: name of the registered statement
+    :param params: values of the bind parameters
+    :type cursor: psycopg2.extras.DictCursor
+    :type name: str
+    :type params: tuple
+    '''
+    stmt = STATEMENTS[name]
+    start = time.time()
+    if prepare(cursor, stmt):
+        cursor.execute(stmt.execute_sql(), params)
+    else:
+        cursor.execute(stmt.sql, params)
+    stmt.calls += 1
+    stmt.seconds += time.time() - start
+
+
+def advisory_lock(cursor, namespace, keys):
+    '''
+    Take transaction-scoped advisory locks on the hashes of keys, e.g.
+    FRB names. The locks are taken in sorted order with one statement,
+    so transactions locking several keys can not deadlock on each
+    other. A lock is released when the transaction ends, or when the
+    savepoint it was taken in is rolled back.
+
+    :param cursor: database cursor object
+    :param namespace: namespace of the keys, e.g. a table name
+    :param keys: keys to lock
+    :type cursor: psycopg2.extras.DictCursor
+    :type namespace: str
+    :type keys: list
+    '''
+    keys = sorted(set(str(key) for key in keys if key is not None))
+    if keys:
+        execute(cursor, 'advisory_locks', (namespace, keys))
+
+
+def statement_stats():
+    '''
+    Number of calls and cumulative latency of the registered
+    statements in this process, slowest first.
+
+    :returns: list of (name, calls, seconds)
+    :rtype: list
+    '''
+    return sorted([(stmt.name, stmt.calls, stmt.seconds)
+                   for stmt in STATEMENTS.values()],
+                  key=lambda item: -item[2])
+
+
+# rank allocation from the frb_ranks counter (see FRBCat_add.set_rank),
+# {frb_id} is the FRB id: a parameter, a column or a subquery
+# highest rank of the events of an FRB in the database
+LAST_RANK = ("SELECT COALESCE(max(rmp.rank), 0) "
+             "FROM radio_measured_params rmp JOIN "
+             "radio_observations_params rop ON rmp.rop_id=rop.id "
+             "JOIN observations o ON rop.obs_id=o.id "
+             "WHERE o.frb_id = {frb_id}")
+# next rank of an FRB with a counter
+NEXT_RANK = ("UPDATE frb_ranks SET last_rank = last_rank + 1 "
+             "WHERE frb_id = {frb_id} RETURNING last_rank")
+# first rank of an FRB without a counter, continuing from its events in
+# the database, {source} is the FROM clause of the FRB id
+FIRST_RANK = ("INSERT INTO frb_ranks (frb_id, last_rank) "
+              "SELECT {frb_id}, (" + LAST_RANK + ") + 1{source} "
+              "ON CONFLICT (frb_id) DO UPDATE "
+              "SET last_rank = frb_ranks.last_rank + 1 "
+              "RETURNING last_rank")
+
+# hot statements of the ingest (see pyfrbcatdb.FRBCat)
+register('author_id', "SELECT id FROM authors WHERE ivorn = %s", ('text',))
+register('frb_id', "SELECT id FROM frbs WHERE name = %s", ('text',))
+register('observation_id',
+         "SELECT id FROM observations WHERE frb_id = %s AND "
+         "telescope = %s AND utc = %s", ('integer', 'text', 'timestamp'))
+register('rop_id',
+         "SELECT id FROM radio_observations_params WHERE obs_id = %s AND "
+         "settings_id = %s", ('integer', 'text'))
+register('event_id',
+         "SELECT id FROM radio_measured_params WHERE voevent_ivorn = %s",
+         ('text',))
+register('existing_ids',
+         "SELECT author_id, event_id FROM lock_existing_ids(%s, %s, %s)",
+         ('text', 'text', 'text'))
+register('next_rank', NEXT_RANK.format(frb_id='%s'), ('integer',))
+register('first_rank', FIRST_RANK.format(frb_id='%s', source=''),
+         ('integer', 'integer'))
+register('advisory_locks',
+         "SELECT pg_advisory_xact_lock(hashtext(%s), hashtext(k)) "
+         "FROM unnest(%s) AS k", ('text', 'text[]'))
+register('retracted_observation',
+         "SELECT o.id FROM radio_measured_params rmp "
+         "JOIN radio_observations_params rop ON rmp.rop_id=rop.id "
+         "JOIN observations o ON rop.obs_id=o.id "
+         "JOIN frbs ON o.frb_id=frbs.id "
+         "JOIN authors ON frbs.author_id=authors.id "
+         "WHERE voevent_ivorn = %s", ('text',))
+register('retract_observation',
+         "UPDATE observations SET detected = FALSE, verified = FALSE "
+         "WHERE id = %s", ('integer',))
+register('retract',
+         "UPDATE observations SET detected = FALSE, verified = FALSE "
+         "WHERE id = (SELECT o.id FROM radio_measured_params rmp "
+         "JOIN radio_observations_params rop ON rmp.rop_id=rop.id "
+         "JOIN observations o ON rop.obs_id=o.id "
+         "JOIN frbs ON o.frb_id=frbs.id "
+         "JOIN authors ON frbs.author_id=authors.id "
+         "WHERE voevent_ivorn = %s LIMIT 1) RETURNING id", ('text',))
@@ -4,13 +4,22 @@ license:        APACHE 2.0
 author:         Ronald van Haren, NLeSC (r.vanharen@esciencecenter.nl)
 '''
 import voeventparse as vp
+from pyfrbcatdb import coords
 from pyfrbcatdb import dbase
+from pyfrbcatdb import validation
 from pyfrbcatdb.FRBCat import FRBCat_add
-from pyfrbcatdb.FRBCat import parse_mapping
+from pyfrbcatdb.FRBCat import FRBCat_add_cte
+from pyfrbcatdb.FRBCat import IDENTITY_CACHE
+from pyfrbcatdb.FRBCat import load_mapping
 from pyfrbcatdb.logger import logger
 from dateutil import parser
-from astropy import units as u
-from astropy.coordinates import SkyCoord
+from contextlib import contextmanager
+from functools import lru_cache
+from lxml import etree
+from types import MappingProxyType
+
+# xpath of the citations, precompiled once per process
+CITATIONS = etree.XPath('Citations')
 
 
 class decode_VOEvent(logger):
@@ -25,6 +34,12 @@ class decode_VOEvent(logger):
     :param dbUser: database user name
     :param dbPassword: database user password
     :param logfile: name of log file
+    :param cte: insert the event with a single data-modifying CTE
+        statement (FRBCat_add_cte) instead of a statement per table
+    :param validator: validation tier of the VOEvent, default is full
+        validation against the schema
+    :param pool: connection pool or connection to use instead of
+        connecting with the database settings
     :type voevent: _io.BufferedReader, str
     :type dbName: str
     :type dbHost: str, NoneType
@@ -32,15 +47,26 @@ class decode_VOEvent(logger):
     :type dbUser: str, NoneType
     :type dbPassword: str, NoneType
     :type logfile: str
+    :type cte: bool
+    :type validator: pyfrbcatdb.validation.validator, NoneType
+    :type pool: pyfrbcatdb.dbase.connection_pool,
+        psycopg2.extensions.connection, NoneType
     '''
+    # default validation tier
+    validator = validation.validator()
+
     def __init__(self, voevent, dbName, dbHost, dbPort, dbUser,
-                 dbPassword, logfile):
+                 dbPassword, logfile, cte=False, validator=None, pool=None):
         logger.__init__(self, logfile)
         self.dbName = dbName
         self.dbHost = dbHost
         self.dbPort = dbPort
         self.dbUser = dbUser
         self.dbPassword = dbPassword
+        self.cte = cte
+        self.pool = pool
+        if validator is not None:
+            self.validator = validator
         self.process_VOEvent(voevent)
 
     def process_VOEvent(self, voevent):
@@ -54,10 +80,8 @@ class decode_VOEvent(logger):
             self.logger.info("Processing file {}".format(voevent.name))
         except AttributeError:
             self.logger.info("Processing file {}".format(voevent))
-        # load mapping VOEvent -> FRBCAT
-        mapping = parse_mapping()
-        # parse VOEvent xml file
-        vo_dict, event_type = self.parse_VOEvent(voevent, mapping)
+        # parse VOEvent xml file using the compiled mapping VOEvent -> FRBCAT
+        vo_dict, event_type = self.parse_VOEvent(voevent)
         # create/delete a new FRBCat entry
         self.update_FRBCat(vo_dict, event_type)
         try:
@@ -70,44 +94,45 @@ class decode_VOEvent(logger):
         '''
         Get param data for a given attribute.
 
-        :param param_data: all param data from VOEvent file
+        :param param_data: index of all params in VOEvent file, see
+            index_params
         :param param_group: param group in VOEvent which holds param_name
         :param param_name: name of parameter to get value for
-        :type param_data: orderedmultidict.orderedmultidict.omdict
+        :type param_data: dict
         :type param_group: str
         :type param_name: str
         :returns: param value if defined in VOEvent, else None
         :rtype: str, float, int, NoneType
         '''
-        try:
-            # return value of the param if defined in the XML
-            return param_data.get(param_group).get(param_name).get('value')
-        except AttributeError:
+        param = param_data.get((param_group, param_name))
+        if param is None:
             # return None for the ones that are not defined in the XML
             return None
+        # return value of the param if defined in the XML
+        return param.get('value')
 
     @staticmethod
-    def get_description(v, item):
+    def get_description(param_data, item):
         '''
         Return description of parameter.
 
-        :param v: VOEvent xml
+        :param param_data: index of all params in VOEvent file, see
+            index_params
         :param item: single dictionary item from mapping
-        :type v: lxml.objectify.ObjectifiedElement
+        :type param_data: dict
         :type item: dict
         :returns: Description on parameter is applicable, else None
         :rtype: str, NoneType
         '''
         param_group = item.get('param_group')
         param_name = item.get('param_name')
-        try:
-            note = v.find(".//Group[@name='{}']".format(param_group)).find(
-              ".//Param[@name='{}']".format(param_name)).Description
-            if note:
-                return "[{}] {}".format(param_name, note)
-            else:
-                return None
-        except AttributeError:
+        param = param_data.get((param_group, param_name))
+        if param is None:
+            return None
+        note = param.find('Description')
+        if note:
+            return "[{}] {}".format(param_name, note)
+        else:
             return None
 
     @staticmethod
@@ -126,33 +151,20 @@ class decode_VOEvent(logger):
         :rtype: str
         '''
         try:
-            units = getattr(vp.get_event_position(v, index=0), 'units')
+            position = vp.get_event_position(v, index=0)
+            units = position.units
         except AttributeError:
             return None
         if not (units == 'deg'):
             raise AttributeError(
                 'Unable to determine units for position: {}'.format(
-                  vp.get_event_position(v, index=0)))
-        position = vp.get_event_position(v, index=0)
-        if (position.system == 'UTC-FK5-GEO'):
-            skcoord = SkyCoord(ra=position.ra*u.degree,
-                               dec=position.dec*u.degree, frame='fk5')
-        else:
-            # use default reference frame
-            skcoord = SkyCoord(ra=position.ra*u.degree,
-                               dec=position.dec*u.degree)
+                  position))
         if (coordname == 'ra'):
             # ra location is in hms
-            coordloc = skcoord.ra.hms
+            return coords.format_ra(position.ra)
         elif (coordname == 'dec'):
             # dec location is in dms
-            coordloc = skcoord.dec.dms
-        # format location tuple to string
-        locstring = '{}:{}:{}'.format(
-            str(int(round(coordloc[0]))).zfill(2),
-            str(abs(int(round(coordloc[1])))).zfill(2),
-            "{:.2f}".format(abs(coordloc[2])).zfill(5))
-        return locstring
+            return coords.format_dec(position.dec)
 
     @staticmethod
     def get_attrib(v, attribname):
@@ -186,86 +198,28 @@ class decode_VOEvent(logger):
         utctime = vp.get_event_time_as_utc(v, index=0)
         return utctime.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
 
-    def get_value(self, v, param_data, item, event_type):
-        '''
-        Extract the value of item from VOEvent.
-
-        :param v: VOEvent xml
-        :param param_data: all param data from VOEvent file
-        :param item: single dictionary item from mapping
-        :param event_type: event type of VOEvent, including
-            citation if applicable, e.g. ('new', None)
-        :type v: lxml.objectify.ObjectifiedElement, str
-        :type param_data: orderedmultidict.orderedmultidict.omdict
-        :type item: dict
-        :type event_type: tuple
-        :returns: value for item
-        :rtype: int, float, str, bool, NoneType
-        '''
-        itemtype = item.get('type')
-        if itemtype == 'ivorn':
-            if (event_type[0] == 'supersedes'):
-                if event_type[1]:
-                    # type supersedes with a valid ivorn citation
-                    return event_type[1]
-                else:
-                    # type supersedes with no ivorn citation, use event ivorn
-                    return self.get_attrib(v, item.get('name'))
-            else:
-                return self.get_attrib(v, item.get('name'))
-        elif itemtype == 'Param':
-            return self.get_param(param_data, item.get('param_group'),
-                                  item.get('param_name'))
-        elif itemtype == 'ISOTime':
-            try:
-                return self.get_utc_time_str(v)
-            except AttributeError:
-                # for type 'retraction' there is no time defined
-                return None
-        elif itemtype == 'authortime':
-            try:
-                timestr = v.xpath('.//' +
-                                  item.get('voevent').replace('.', '/'))[0]
-                return parser.parse(str(timestr)).strftime('%Y-%m-%d %H:%M:%S')
-            except IndexError:
-                return None
-        elif itemtype == 'XML':
-            return vp.dumps(v)
-        elif itemtype == 'voevent':
-            try:
-                return v.xpath('.//' +
-                               item.get('voevent').replace('.', '/'))[0]
-            except IndexError:
-                return None
-        elif itemtype == 'Coord':
-            return self.get_coord(v, item.get('name'))
-        elif itemtype == 'verify':
-            # get importance attribute from <Why> section
-            importance = v.Why.attrib.get(item.get('name'))
-            # for high importance set verified=True, else False
-            try:
-                if (float(importance) >= 0.95):
-                    # high importance, so default to verified
-                    return True
-                else:
-                    return False
-            except TypeError:
-                return False
-        else:
-            return None
-
-    def parse_VOEvent(self, voevent, mapping):
+    def parse_VOEvent(self, voevent, mapping=None):
         '''
         Parse VOEvent xml file.
 
         :param voevent: VOEvent xml file
-        :param mapping: mapping from mapping.json
+        :param mapping: compiled mapping from compile_mapping or a
+            mapping dictionary from parse_mapping, default is the
+            compiled mapping.json
         :type voevent: lxml.objectify.ObjectifiedElement, str
-        :type mapping: dict
-        :returns:  mapping (mapping from mapping.json with values filled),
+        :type mapping: mappingproxy, dict, NoneType
+        :returns:  mapping (new dictionary with the column, type, value
+            and note of each mapping item, the validation tier of the
+            VOEvent is added to radio_measured_params),
             event_type (event_type and citation if applicable)
         :rtype: dict, tuple
         '''
+        if mapping is None:
+            plan = compile_mapping()
+        elif isinstance(mapping, MappingProxyType):
+            plan = mapping
+        else:
+            plan = compile_plan(mapping)
         # load VOEvent xml file
         try:
             v = vp.load(voevent)
@@ -274,54 +228,337 @@ class decode_VOEvent(logger):
             v = vp.load(f)
             f.close()
         # assert if xml file is a valid VOEvent
-        vp.assert_valid_as_v2_0(v)
+        tier = self.validator.validate(v)
+        self.logger.debug("Validation tier: {}".format(tier))
         # Check if the event is a new VOEvent
         # For a new VOEvent there should be no citations
         try:
-            event_type = (v.xpath('Citations')[0].EventIVORN.attrib['cite'],
-                          v.xpath('Citations')[0].EventIVORN.text)
+            citations = CITATIONS(v)[0]
+            event_type = (citations.EventIVORN.attrib['cite'],
+                          citations.EventIVORN.text)
         except IndexError:
             event_type = ('new', None)
         self.logger.info("Event of of type: {}".format(event_type))
         # use the mapping to get required data from VOEvent xml
         # if a path is not found in the xml it gets an empty list which is
         # removed in the next step
-        # puts all params into dict param_data[group][param_name]
-        try:
-            param_data = vp.get_grouped_params(v)
-        except AttributeError:
-            # <What> section is not needed for retractions
-            param_data = None
-        for table in mapping.keys():  # iterate over all tables
-            for idx, item in enumerate(mapping[table]):
+        # index all params by param_data[(group, param_name)]
+        param_data = index_params(v)
+        result = {}
+        for table, items in plan.items():  # iterate over all tables
+            values = []
+            for column, itemtype, extract, describe in items:
                 # Add values from XML to dictionary
-                mapping[table][idx]['value'] = self.get_value(v, param_data,
-                                                              item, event_type)
-                if item.get('description'):
-                    note = self.get_description(v, item)
+                value = {'column': column, 'type': itemtype,
+                         'value': extract(v, param_data, event_type)}
+                if describe:
+                    note = describe(param_data)
                     if note:
-                        mapping[table][idx]['note'] = note
-        return mapping, event_type
+                        value['note'] = note
+                values.append(value)
+            result[table] = values
+        # record the validation tier of the event
+        result.setdefault('radio_measured_params', []).append(
+            {'column': 'validation', 'type': 'validation', 'value': tier})
+        return result, event_type
 
     def update_FRBCat(self, mapping, event_type):
         '''
-        Add new FRBCat entry. Calls the FRBCat_add class.
+        Add new FRBCat entry. Calls the FRBCat_add class and commits
+        the changes.
 
         :param mapping: mapping from mapping.json
         :param event_type: event_type and citation if applicable
         :type mapping: dict
         :type event_type: tuple
         '''
-        # connect to database
-        connection, cursor = dbase.connectToDB(self.dbName,
-                                               self.dbUser,
-                                               self.dbPassword,
-                                               self.dbHost,
-                                               self.dbPort)
-        FRBCat = FRBCat_add(connection, cursor, mapping, event_type[0])
-        if event_type[0] in ['new', 'followup', 'supersedes']:
-            # for new, followup, supersedes we need to add an entry to FRBCat
-            FRBCat.add_VOEvent_to_FRBCat()
-        elif event_type[0] in ['retraction']:
-            # retract the event
-            FRBCat.retract(event_type[1])
+        with dbase.lend(self.pool, self.dbName, self.dbUser,
+                        self.dbPassword, self.dbHost,
+                        self.dbPort) as (connection, cursor):
+            # the connection may be lent, commit here instead of FRBCat
+            if self.cte:
+                FRBCat = FRBCat_add_cte(connection, cursor, mapping,
+                                        event_type[0], batch=True)
+            else:
+                FRBCat = FRBCat_add(connection, cursor, mapping,
+                                    event_type[0], batch=True)
+            try:
+                if event_type[0] in ['new', 'followup', 'supersedes']:
+                    # for new, followup, supersedes we need to add an entry
+                    changed = FRBCat.add_VOEvent_to_FRBCat()
+                elif event_type[0] in ['retraction']:
+                    # retract the event
+                    changed = FRBCat.retract(event_type[1])
+                else:
+                    changed = False
+            except Exception:
+                connection.rollback()
+                IDENTITY_CACHE.rollback()
+                raise
+            if changed and dbase.commitToDB(connection, cursor):
+                IDENTITY_CACHE.commit()
+            else:
+                # event is already in database or commit failed
+                connection.rollback()
+                IDENTITY_CACHE.rollback()
+
+
+def extract_none(item):
+    '''
+    Extractor for mapping items without a VOEvent value.
+    '''
+    def extract(v, param_data, event_type):
+        return None
+    return extract
+
+
+def extract_ivorn(item):
+    '''
+    Extractor for the event ivorn, the cited ivorn for supersedes.
+    '''
+    name = item.get('name')
+
+    def extract(v, param_data, event_type):
+        if (event_type[0] == 'supersedes') and event_type[1]:
+            # type supersedes with a valid ivorn citation
+            return event_type[1]
+        return decode_VOEvent.get_attrib(v, name)
+    return extract
+
+
+def extract_param(item):
+    '''
+    Extractor for a Param in a Group of the What section.
+    '''
+    param_group = item.get('param_group')
+    param_name = item.get('param_name')
+
+    def extract(v, param_data, event_type):
+        return decode_VOEvent.get_param(param_data, param_group, param_name)
+    return extract
+
+
+def extract_isotime(item):
+    '''
+    Extractor for the event time in UTC.
+    '''
+    def extract(v, param_data, event_type):
+        try:
+            return decode_VOEvent.get_utc_time_str(v)
+        except AttributeError:
+            # for type 'retraction' there is no time defined
+            return None
+    return extract
+
+
+def extract_authortime(item):
+    '''
+    Extractor for the time the VOEvent was authored.
+    '''
+    xpath = etree.XPath('.//' + item.get('voevent').replace('.', '/'))
+
+    def extract(v, param_data, event_type):
+        try:
+            timestr = xpath(v)[0]
+            return parser.parse(str(timestr)).strftime('%Y-%m-%d %H:%M:%S')
+        except IndexError:
+            return None
+    return extract
+
+
+def extract_xml(item):
+    '''
+    Extractor for the complete VOEvent xml.
+    '''
+    def extract(v, param_data, event_type):
+        return vp.dumps(v)
+    return extract
+
+
+def extract_voevent(item):
+    '''
+    Extractor for an element or attribute in the VOEvent.
+    '''
+    xpath = etree.XPath('.//' + item.get('voevent').replace('.', '/'))
+
+    def extract(v, param_data, event_type):
+        try:
+            return xpath(v)[0]
+        except IndexError:
+            return None
+    return extract
+
+
+def extract_coord(item):
+    '''
+    Extractor for the ra or dec of the event position.
+    '''
+    name = item.get('name')
+
+    def extract(v, param_data, event_type):
+        return decode_VOEvent.get_coord(v, name)
+    return extract
+
+
+def extract_verify(item):
+    '''
+    Extractor for the verified flag from the importance in <Why>.
+    '''
+    name = item.get('name')
+
+    def extract(v, param_data, event_type):
+        # get importance attribute from <Why> section
+        importance = v.Why.attrib.get(name)
+        # for high importance set verified=True, else False
+        try:
+            return float(importance) >= 0.95
+        except TypeError:
+            return False
+    return extract
+
+
+# extractor factory for each mapping item type
+EXTRACTORS = {'ivorn': extract_ivorn,
+              'Param': extract_param,
+              'ISOTime': extract_isotime,
+              'authortime': extract_authortime,
+              'XML': extract_xml,
+              'voevent': extract_voevent,
+              'Coord': extract_coord,
+              'verify': extract_verify}
+
+
+def compile_plan(mapping):
+    '''
+    Compile a mapping dictionary into an extraction plan with, for each
+    table, a tuple of (column, type, extractor, describer) per item.
+    The describer is None for items without a description.
+
+    :param mapping: mapping dictionary
+    :type mapping: dict
+    :returns: frozen extraction plan
+    :rtype: mappingproxy
+    '''
+    plan = {}
+    for table, items in mapping.items():
+        compiled = []
+        for item in items:
+            extract = EXTRACTORS.get(item.get('type'), extract_none)(item)
+            describe = None
+            if item.get('description'):
+                describe = describer(item)
+            compiled.append((item.get('column'), item.get('type'), extract,
+                             describe))
+        plan[table] = tuple(compiled)
+    return MappingProxyType(plan)
+
+
+def describer(item):
+    '''
+    Describer returning the note on the parameter of a mapping item.
+    '''
+    def describe(param_data):
+        return decode_VOEvent.get_description(param_data, item)
+    return describe
+
+
+def index_params(v):
+    '''
+    Index the Params of the Groups in the What section in a single pass.
+    As for vp.get_grouped_params, the first Group with a name and the
+    first Param with a name in that Group are used.
+
+    :param v: VOEvent xml
+    :type v: lxml.objectify.ObjectifiedElement
+    :returns: Param elements by (group name, param name), empty if
+        there is no What section (e.g. for retractions)
+    :rtype: dict
+    '''
+    index = {}
+    try:
+        what = v.What
+    except AttributeError:
+        # <What> section is not needed for retractions
+        return index
+    groups = set()
+    for group in what.iterchildren('Group'):
+        name = group.get('name')
+        if name in groups:
+            continue
+        groups.add(name)
+        for param in group.iterchildren('Param'):
+            index.setdefault((name, param.get('name')), param)
+    return index
+
+
+@lru_cache(maxsize=None)
+def compile_mapping():
+    '''
+    Compile mapping.json once per process.
+
+    :returns: frozen extraction plan
+    :rtype: mappingproxy
+    '''
+    return compile_plan(load_mapping())
+
+
+def read_ivorn(voevent):
+    '''
+    Read the ivorn of a VOEvent from the root element only, without
+    parsing or validating the rest of the file.
+
+    :param voevent: VOEvent xml file
+    :type voevent: _io.BufferedReader, str
+    :returns: ivorn of the VOEvent, None if the file can not be read
+    :rtype: str, NoneType
+    '''
+    try:
+        with voevent_source(voevent) as source:
+            for action, element in etree.iterparse(source,
+                                                   events=('start',)):
+                return element.get('ivorn')
+    except (etree.XMLSyntaxError, OSError):
+        return None
+
+
+def read_citation(voevent):
+    '''
+    Read the citation of a VOEvent with an incremental parse, without
+    building the tree or validating the file.
+
+    :param voevent: VOEvent xml file
+    :type voevent: _io.BufferedReader, str
+    :returns: event_type and citation as returned by parse_VOEvent,
+        None if the file can not be read
+    :rtype: tuple, NoneType
+    '''
+    try:
+        with voevent_source(voevent) as source:
+            for action, element in etree.iterparse(source, events=('end',)):
+                if etree.QName(element).localname == 'EventIVORN':
+                    return element.get('cite'), element.text
+                element.clear()
+    except (etree.XMLSyntaxError, OSError):
+        return None
+    return 'new', None
+
+
+@contextmanager
+def voevent_source(voevent):
+    '''
+    Open a VOEvent file for reading. A filestream is rewound
+    afterwards, so it can be parsed again.
+
+    :param voevent: VOEvent xml file
+    :type voevent: _io.BufferedReader, str
+    :returns: binary filestream
+    :rtype: _io.BufferedReader
+    '''
+    if hasattr(voevent, 'read'):
+        try:
+            yield voevent
+        finally:
+            voevent.seek(0)
+    else:
+        with open(voevent, 'rb') as f:
+            yield f
@@ -0,0 +1,519 @@
+'''
+description:    Write the FRBCat database to several files in one pass
+license:        APACHE 2.0
+author:         Ronald van Haren, NLeSC (r.vanharen@esciencecenter.nl)
+'''
+from pyfrbcatdb.logger import logger
+from pyfrbcatdb.writeCSV import COMPRESSION
+from pyfrbcatdb.writeCSV import catalogue_table
+from pyfrbcatdb.writeCSV import compressor
+from pyfrbcatdb.writeCSV import select_catalogue
+from pyfrbcatdb.writeCSV import writeCSV
+from pyfrbcatdb.writeCSV import zstandard
+from contextlib import ExitStack
+from json.encoder import encode_basestring
+from xml.sax.saxutils import escape
+from xml.sax.saxutils import quoteattr
+import abc
+import csv
+import os
+import time
+
+# PostgreSQL types of the columns by oid
+INTEGERS = {20: 'long', 21: 'short', 23: 'int'}
+FLOATS = {700: 'float', 701: 'double'}
+BOOLEAN = 16
+TIMESTAMPS = {1114, 1184}
+
+
+def timestamp(value):
+    '''
+    Convert a utc of the CSV file (YYYY/MM/DD HH24:MI:SS.MS) to ISO 8601
+
+    :param value: utc of the CSV file
+    :type value: str
+    :returns: ISO 8601 utc
+    :rtype: str
+    '''
+    return value.replace('/', '-').replace(' ', 'T')
+
+
+class empty_string(str):
+    '''
+    An empty string field of a row, true unlike the empty NULL fields
+    '''
+
+    def __bool__(self):
+        return True
+
+
+EMPTY = empty_string()
+
+
+def empty_fields(line, row):
+    '''
+    Mark the empty string fields of a row of the COPY. COPY writes NULL
+    as an empty field and an empty string as a quoted empty field "",
+    which csv.reader both reads as an empty string.
+
+    :param line: CSV line of the row
+    :param row: fields of the row by csv.reader
+    :type line: str
+    :type row: list
+    :returns: fields of the row, EMPTY for empty strings
+    :rtype: list
+    '''
+    # find the quoted fields
+    quoted = []
+    inside = False
+    start = True
+    for char in line:
+        if start:
+            quoted.append(char == '"')
+            start = False
+        if char == '"':
+            # a doubled quote in a quoted field toggles twice
+            inside = not inside
+        elif char == ',' and not inside:
+            start = True
+    if start:
+        quoted.append(False)
+    return [EMPTY if value == '' and is_quoted else value
+            for value, is_quoted in zip(row, quoted)]
+
+
+class catalogue_writer(abc.ABC):
+    '''
+    Writer of the catalogue rows to a file. The rows are written to
+    filename.tmp, which replaces filename when the file is complete.
+
+    :param filename: name of the file to write
+    :param columns: (name, PostgreSQL type oid) of the columns
+    :param compression: gzip, zstd or None
+    :type filename: str
+    :type columns: list
+    :type compression: str, NoneType
+    '''
+    # the writer needs the fields of the rows, not only the CSV lines
+    fields = True
+
+    def __init__(self, filename, columns, compression=None):
+        self.filename = filename
+        self.tmpfile = filename + '.tmp'
+        self.columns = columns
+        self.compression = compression
+        self.stack = ExitStack()
+        self.file = None
+
+    def open(self):
+        '''
+        Open the tmp file and write the header
+        '''
+        rawfile = self.stack.enter_context(open(self.tmpfile, 'wb'))
+        self.file = self.stack.enter_context(
+            compressor(rawfile, self.compression, self.filename))
+        self.file.write(self.header().encode('utf-8'))
+
+    @abc.abstractmethod
+    def write(self, lines, rows):
+        '''
+        Write a chunk of rows
+
+        :param lines: CSV lines of the rows, the first chunk starts with
+            the header line
+        :param rows: fields of the rows, empty for NULL and EMPTY for
+            empty strings, no rows if the writer does not need the fields
+        :type lines: list
+        :type rows: list
+        '''
+
+    def close(self):
+        '''
+        Write the footer and close the tmp file
+        '''
+        self.file.write(self.footer().encode('utf-8'))
+        self.stack.close()
+
+    def abort(self):
+        '''
+        Close and remove the tmp file
+        '''
+        self.stack.close()
+        try:
+            os.remove(self.tmpfile)
+        except OSError:
+            pass
+
+    def replace(self):
+        '''
+        Replace the file with the complete tmp file
+        '''
+        os.replace(self.tmpfile, self.filename)
+
+    def header(self):
+        return ''
+
+    def footer(self):
+        return ''
+
+
+class csv_writer(catalogue_writer):
+    '''
+    Writer of the CSV file, the CSV lines of COPY are written as they
+    are, the CSV file is the CSV file of writeCSV.
+    '''
+    fields = False
+
+    def write(self, lines, rows):
+        self.file.write(b''.join(lines))
+
+
+class json_writer(catalogue_writer):
+    '''
+    Writer of a JSON array with an object per row, with the columns by
+    name. Numbers are JSON numbers (as in the CSV file), utc is in ISO
+    8601, missing values are null and empty strings are "".
+    '''
+
+    def __init__(self, filename, columns, compression=None):
+        catalogue_writer.__init__(self, filename, columns, compression)
+        self.keys = [encode_basestring(name) + ':'
+                     for name, type_code in columns]
+        self.converters = [self.converter(type_code)
+                           for name, type_code in columns]
+        self.separator = '\n'
+
+    @staticmethod
+    def converter(type_code):
+        '''
+        Get the conversion of a CSV field of a column type
+
+        :param type_code: oid of the PostgreSQL type
+        :type type_code: int
+        :returns: conversion of the field to a JSON value, None if the
+            field is the JSON value
+        :rtype: function, NoneType
+        '''
+        if type_code in INTEGERS:
+            return None
+        elif type_code in FLOATS:
+            # NaN and Infinity are not JSON numbers
+            return lambda value: 'null' if value[-1].isalpha() else value
+        elif type_code == BOOLEAN:
+            return lambda value: 'true' if value == 't' else 'false'
+        elif type_code in TIMESTAMPS:
+            return lambda value: encode_basestring(timestamp(value))
+        return encode_basestring
+
+    def write(self, lines, rows):
+        if not rows:
+            return
+        columns = list(zip(self.keys, self.converters))
+        self.file.write((self.separator + ',\n'.join(
+            '{' + ','.join([
+                key + ((convert(value) if convert else value)
+                       if value else 'null')
+                for (key, convert), value in zip(columns, row)]) + '}'
+            for row in rows)).encode('utf-8'))
+        self.separator = ',\n'
+
+    def header(self):
+        return '['
+
+    def footer(self):
+        return '\n]\n'
+
+
+class votable_writer(catalogue_writer):
+    '''
+    Writer of a VOTable 1.3 with the rows in TABLEDATA, empty cells are
+    missing values (and empty strings).
+    '''
+
+    def __init__(self, filename, columns, compression=None):
+        catalogue_writer.__init__(self, filename, columns, compression)
+        self.converters = [self.converter(type_code)
+                           for name, type_code in columns]
+
+    @staticmethod
+    def converter(type_code):
+        '''
+        Get the conversion of a CSV field of a column type
+
+        :param type_code: oid of the PostgreSQL type
+        :type type_code: int
+        :returns: conversion of the field to a cell, None if the field
+            is the cell
+        :rtype: function, NoneType
+        '''
+        if type_code in INTEGERS or type_code in FLOATS:
+            return None
+        elif type_code == BOOLEAN:
+            return str.upper
+        elif type_code in TIMESTAMPS:
+            return timestamp
+        return escape
+
+    @staticmethod
+    def field(name, type_code):
+        '''
+        Get the FIELD element of a column
+
+        :param name: name of the column
+        :param type_code: oid of the PostgreSQL type
+        :type name: str
+        :type type_code: int
+        :returns: FIELD element
+        :rtype: str
+        '''
+        if type_code in INTEGERS:
+            datatype = 'datatype="{}"'.format(INTEGERS[type_code])
+        elif type_code in FLOATS:
+            datatype = 'datatype="{}"'.format(FLOATS[type_code])
+        elif type_code == BOOLEAN:
+            datatype = 'datatype="boolean"'
+        elif type_code in TIMESTAMPS:
+            datatype = 'datatype="char" arraysize="*" xtype="timestamp"'
+        else:
+            datatype = 'datatype="unicodeChar" arraysize="*"'
+        return '<FIELD name={} {}/>'.format(quoteattr(name), datatype)
+
+    def write(self, lines, rows):
+        converters = self.converters
+        self.file.write(''.join(
+            '<TR><TD>' + '</TD><TD>'.join([
+                convert(value) if convert and value else value
+                for convert, value in zip(converters, row)]) +
+            '</TD></TR>\n' for row in rows).encode('utf-8'))
+
+    def header(self):
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<VOTABLE version="1.3" '
+                'xmlns="http://www.ivoa.net/xml/VOTable/v1.3">\n'
+                '<RESOURCE>\n<TABLE name="frbcat">\n' +
+                ''.join(self.field(name, type_code) + '\n'
+                        for name, type_code in self.columns) +
+                '<DATA>\n<TABLEDATA>\n')
+
+    def footer(self):
+        return '</TABLEDATA>\n</DATA>\n</TABLE>\n</RESOURCE>\n</VOTABLE>\n'
+
+
+# writer by file extension
+WRITERS = {'.csv': csv_writer, '.json': json_writer,
+           '.vot': votable_writer, '.votable': votable_writer,
+           '.xml': votable_writer}
+
+
+def catalogue_format(filename):
+    '''
+    Get the writer and the compression of a file by its extension, e.g.
+    frbcat.json.gz is a gzip compressed JSON file
+
+    :param filename: name of the file
+    :type filename: str
+    :returns: writer class, compression
+    :rtype: tuple
+    '''
+    name, extension = os.path.splitext(filename)
+    compression = COMPRESSION.get(extension)
+    if compression:
+        extension = os.path.splitext(name)[1]
+    return WRITERS.get(extension.lower()), compression
+
+
+class fanout(object):
+    '''
+    File-like target of the COPY of the catalogue, that hands the CSV
+    lines to all writers in chunks of chunk_size rows and records the
+    seconds spent in each writer.
+
+    :param writers: writers of the files
+    :param chunk_size: number of rows per chunk
+    :type writers: list
+    :type chunk_size: int
+    '''
+
+    def __init__(self, writers, chunk_size):
+        self.writers = writers
+        self.chunk_size = chunk_size
+        # split the lines in fields only for the writers that need them
+        self.fields = any(writer.fields for writer in writers)
+        self.lines = []
+        self.header = True
+        self.seconds = dict((writer.filename, 0.) for writer in writers)
+        self.seconds['parse'] = 0.
+
+    def write(self, data):
+        # COPY writes a row at a time
+        self.lines.append(data)
+        if len(self.lines) >= self.chunk_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        lines = self.lines
+        self.lines = []
+        rows = []
+        if self.fields and lines:
+            start = time.perf_counter()
+            text = [line.decode('utf-8') for line in
+                    lines[1 if self.header else 0:]]
+            rows = list(csv.reader(text))
+            for idx in [idx for idx, line in enumerate(text)
+                        if '""' in line]:
+                rows[idx] = empty_fields(text[idx], rows[idx])
+            self.seconds['parse'] += time.perf_counter() - start
+        self.header = False
+        for writer in self.writers:
+            self.timed(writer, writer.write, lines, rows)
+
+    def timed(self, writer, method, *args):
+        '''
+        Call a method of a writer and add its seconds to the writer
+
+        :param writer: writer
+        :param method: method of the writer
+        :type writer: pyfrbcatdb.exportCatalogue.catalogue_writer
+        :type method: method
+        '''
+        start = time.perf_counter()
+        method(*args)
+        self.seconds[writer.filename] += time.perf_counter() - start
+
+
+class exportCatalogue(writeCSV):
+    '''
+    Class module that writes the FRBCat database to several files in a
+    single pass over the public catalogue, e.g. the CSV file for Zenodo,
+    a JSON file for the website and a VOTable for VO tools. The rows of
+    the COPY of writeCSV are handed to a writer per file, by extension:
+    .csv, .json, .vot, .votable or .xml, optionally with .gz or .zst
+    compression. Each file is written to a tmp file that replaces the
+    file when all files are complete, a file is not written if the
+    catalogue did not change since its last export.
+
+    The seconds of the export are in timings, by filename for the
+    writers, 'parse' for splitting the CSV lines in fields and
+    'database' for the rest of the COPY.
+
+    :param filenames: names of the files to write
+    :param dbName: database name
+    :param dbHost: database host
+    :param dbPort: database port
+    :param dbUser: database user name
+    :param dbPassword: database user password
+    :param logfile: name of log file
+    :param pool: connection pool or connection to use instead of
+        connecting with the database settings
+    :param force: write the files even if the catalogue did not change
+        since the last export
+    :param compression: compress all files with gzip or zstd, default is
+        by the extension of each file (.gz or .zst)
+    :param chunk_size: number of rows handed to the writers at a time
+    :type filenames: list
+    :type dbName: str
+    :type dbHost: str, NoneType
+    :type dbPort: str, NoneType
+    :type dbUser: str, NoneType
+    :type dbPassword: str, NoneType
+    :type logfile: str
+    :type pool: pyfrbcatdb.dbase.connection_pool,
+        psycopg2.extensions.connection, NoneType
+    :type force: bool
+    :type compression: str, NoneType
+    :type chunk_size: int
+    '''
+
+    def __init__(self, filenames, dbName, dbHost, dbPort, dbUser,
+                 dbPassword, logfile, pool=None, force=False,
+                 compression=None, chunk_size=10000):
+        logger.__init__(self, logfile)
+        self.dbName = dbName
+        self.dbHost = dbHost
+        self.dbPort = dbPort
+        self.dbUser = dbUser
+        self.dbPassword = dbPassword
+        self.pool = pool
+        self.force = force
+        self.chunk_size = max(int(chunk_size), 1)
+        if compression not in [None, 'gzip', 'zstd']:
+            raise ValueError("Unknown compression: {}".format(compression))
+        self.formats = []
+        for filename in filenames:
+            writer, extension = catalogue_format(filename)
+            if writer is None:
+                raise ValueError("Unknown export format: {}".format(
+                    filename))
+            if (compression or extension) == 'zstd' and zstandard is None:
+                raise ImportError("zstd compression needs the zstandard "
+                                  "package")
+            self.formats.append((filename, writer, compression or extension))
+        self.CSV = None
+        # names of the files that are (re)written
+        self.written = []
+        self.timings = {}
+        self.writeToCSV()
+
+    def copyToCSV(self, connection, cursor):
+        '''
+        Write the catalogue to the files over a database connection
+
+        :param connection: database connection
+        :param cursor: database cursor object
+        :type connection: psycopg2.extensions.connection
+        :type cursor: psycopg2.extras.DictCursor
+        '''
+        version = self.catalogueVersion(connection, cursor)
+        formats = [(filename, writer, compression)
+                   for filename, writer, compression in self.formats
+                   if self.force or version is None or
+                   not os.path.exists(filename) or
+                   version != self.exportedVersion(filename)]
+        for filename, writer, compression in self.formats:
+            if (filename, writer, compression) not in formats:
+                self.logger.info("Catalogue unchanged since the last "
+                                 "export, not writing: {}".format(filename))
+        if not formats:
+            connection.rollback()
+            return
+        table = catalogue_table(cursor)
+        # the types of the columns, the COPY only has text
+        cursor.execute(select_catalogue(table=table) + "\nLIMIT 0")
+        columns = [(column.name, column.type_code)
+                   for column in cursor.description]
+        writers = [writer(filename, columns, compression)
+                   for filename, writer, compression in formats]
+        target = fanout(writers, self.chunk_size)
+        try:
+            start = time.perf_counter()
+            for writer in writers:
+                target.timed(writer, writer.open)
+            cursor.copy_expert(self.defineSQLStatement(table), target)
+            target.flush()
+            for writer in writers:
+                target.timed(writer, writer.close)
+            total = time.perf_counter() - start
+            # end the read-only transaction of the copy
+            connection.rollback()
+            for writer in writers:
+                writer.replace()
+                self.written.append(writer.filename)
+                self.writeVersion(version, writer.filename)
+        except (FileNotFoundError, PermissionError):
+            self.logger.error("Failed to write database to: {}".format(
+                ', '.join(writer.filename for writer in writers)))
+            return
+        finally:
+            for writer in writers:
+                writer.abort()
+        self.timings = target.seconds
+        self.timings['database'] = total - sum(self.timings.values())
+        for writer in writers:
+            self.logger.info("Succesfully written database to: {} "
+                             "({:.2f} s)".format(
+                                 writer.filename,
+                                 self.timings[writer.filename]))
+        self.logger.info("Read the catalogue in {:.2f} s, split the rows "
+                         "in {:.2f} s".format(self.timings['database'],
+                                              self.timings['parse']))
@@ -0,0 +1,213 @@
+'''
+description:    Parse VOEvents in worker processes, insert with one writer
+license:        APACHE 2.0
+author:         Ronald van Haren, NLeSC (r.vanharen@esciencecenter.nl)
+'''
+import logging
+import multiprocessing
+from pyfrbcatdb.batch_VOEvent import batch_VOEvent
+from pyfrbcatdb.decode_VOEvent import decode_VOEvent
+from pyfrbcatdb.table_row import plain_value
+
+
+class parallel_VOEvent(batch_VOEvent):
+    '''
+    Class to decode a list of VOEvent files in a pool of worker
+    processes and insert them into the FRBCat database from a single
+    writer. Workers parse, validate and map the VOEvents into plain
+    picklable records, the writer applies them in input order with the
+    batch transactions of batch_VOEvent. Supersedes and retraction
+    events are held back until the event they cite has been written.
+
+    :param voevents: list of filestreams or filenames
+    :param dbName: database name
+    :param dbHost: database host
+    :param dbPort: database port
+    :param dbUser: database user name
+    :param dbPassword: database user password
+    :param logfile: name of log file
+    :param batch_size: number of VOEvents per transaction
+    :param processes: number of worker processes, default is the
+        number of cpus
+    :param cte: insert each event with a single data-modifying CTE
+        statement (FRBCat_add_cte) instead of a statement per table
+    :param validator: validation tier of the VOEvents, default is full
+        validation against the schema
+    :param pool: connection pool or connection to use instead of
+        connecting with the database settings
+    :type voevents: list
+    :type dbName: str
+    :type dbHost: str, NoneType
+    :type dbPort: str, NoneType
+    :type dbUser: str, NoneType
+    :type dbPassword: str, NoneType
+    :type logfile: str
+    :type batch_size: int
+    :type processes: int, NoneType
+    :type cte: bool
+    :type validator: pyfrbcatdb.validation.validator, NoneType
+    :type pool: pyfrbcatdb.dbase.connection_pool,
+        psycopg2.extensions.connection, NoneType
+    '''
+    def __init__(self, voevents, dbName, dbHost, dbPort, dbUser,
+                 dbPassword, logfile, batch_size=100, processes=None,
+                 cte=False, validator=None, pool=None):
+        self.processes = processes
+        batch_VOEvent.__init__(self, voevents, dbName, dbHost, dbPort,
+                               dbUser, dbPassword, logfile, batch_size, cte,
+                               validator, pool)
+
+    def parse_VOEvents(self, voevents):
+        '''
+        Parse the VOEvents in a pool of worker processes.
+
+        :param voevents: list of filestreams or filenames
+        :type voevents: list
+        :returns: generator of (name, mapping, event_type) tuples in
+            citation order
+        :rtype: generator
+        '''
+        names = [getattr(voevent, 'name', voevent) for voevent in voevents]
+        # events already in the database are not sent to the workers
+        known = []
+        for start in range(0, len(voevents), self.batch_size):
+            known.extend(self.known_VOEvents(
+                voevents[start:start + self.batch_size]))
+        processes = self.processes or multiprocessing.cpu_count()
+        chunksize = max(1, min(self.batch_size,
+                               len(names) // (4 * processes)))
+        pool = multiprocessing.Pool(processes, init_parser,
+                                    (self.validator,))
+        try:
+            parsed = pool.imap(parse_record, [
+                name for name, ivorn in zip(names, known) if not ivorn],
+                chunksize)
+            records = ((name, None, ('known', ivorn), None) if ivorn else
+                       next(parsed) for name, ivorn in zip(names, known))
+            for record in self.order_records(records):
+                yield record
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def order_records(self, records):
+        '''
+        Hold back supersedes and retraction events whose cited event is
+        neither in the database nor written yet by this run, until the
+        cited event has been written. Events still waiting at the end
+        of the run are released in input order.
+
+        :param records: iterable of (name, mapping, event_type, error)
+        :type records: iterable
+        :returns: generator of (name, mapping, event_type) tuples
+        :rtype: generator
+        '''
+        written = set()
+        waiting = {}
+        for name, mapping, event_type, error in records:
+            if error:
+                self.logger.error("Unable to parse VOEvent {}: {}".format(
+                    name, error))
+                yield name, None, None
+                continue
+            cited = event_type[1]
+            if (event_type[0] in ['supersedes', 'retraction'] and cited and
+                    cited not in written and not self.in_database(cited)):
+                self.logger.info("Holding back VOEvent {} until {} is "
+                                 "written".format(name, cited))
+                waiting.setdefault(cited, []).append(
+                    (name, mapping, event_type))
+                continue
+            released = [(name, mapping, event_type)]
+            while released:
+                record = released.pop(0)
+                yield record
+                ivorn = record_ivorn(record[1], record[2])
+                if ivorn:
+                    written.add(ivorn)
+                    released.extend(waiting.pop(ivorn, []))
+        for cited in list(waiting):
+            for record in waiting.pop(cited):
+                yield record
+
+    def in_database(self, ivorn):
+        '''
+        Check if an event ivorn is in the radio_measured_params table.
+
+        :param ivorn: event ivorn
+        :type ivorn: str
+        :returns: True if the event is in the database
+        :rtype: bool
+        '''
+        self.cursor.execute("SELECT 1 FROM radio_measured_params "
+                            "WHERE voevent_ivorn = %s", (ivorn,))
+        return self.cursor.fetchone() is not None
+
+
+class _record_parser(decode_VOEvent):
+    '''
+    VOEvent parser used inside the worker processes.
+    '''
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+
+
+_parser = None
+
+
+def init_parser(validator):
+    '''
+    Create the VOEvent parser of a worker process.
+
+    :param validator: validation tier of the VOEvents
+    :type validator: pyfrbcatdb.validation.validator
+    '''
+    global _parser
+    _parser = _record_parser()
+    _parser.validator = validator
+
+
+def parse_record(voevent):
+    '''
+    Parse a VOEvent file into a plain picklable record, used by the
+    worker processes.
+
+    :param voevent: filename of the VOEvent
+    :type voevent: str
+    :returns: (name, mapping, event_type, error), error is None if the
+        VOEvent was parsed
+    :rtype: tuple
+    '''
+    global _parser
+    if _parser is None:
+        _parser = _record_parser()
+    try:
+        mapping, event_type = _parser.parse_VOEvent(voevent)
+    except Exception as e:
+        return voevent, None, None, str(e)
+    for table in mapping.values():
+        for item in table:
+            if 'value' in item:
+                item['value'] = plain_value(item['value'])
+            if 'note' in item:
+                item['note'] = plain_value(item['note'])
+    return voevent, mapping, (event_type[0], plain_value(event_type[1])), None
+
+
+def record_ivorn(mapping, event_type):
+    '''
+    Return the event ivorn a record writes to radio_measured_params.
+
+    :param mapping: mapping from mapping.json with values filled
+    :param event_type: event_type and citation if applicable
+    :type mapping: dict
+    :type event_type: tuple
+    :returns: event ivorn or None for retractions
+    :rtype: str, NoneType
+    '''
+    if not mapping or event_type[0] == 'retraction':
+        return None
+    for item in mapping.get('radio_measured_params', []):
+        if item.get('column') == 'voevent_ivorn':
+            return item.get('value')
+    return None
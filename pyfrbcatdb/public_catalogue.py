@@ -0,0 +1,100 @@
+'''
+description:    Maintain the public_catalogue table of the FRBCat database
+license:        APACHE 2.0
+author:         Ronald van Haren, NLeSC (r.vanharen@esciencecenter.nl)
+'''
+from pyfrbcatdb import dbase
+from pyfrbcatdb.writeCSV import CATALOGUE
+from pyfrbcatdb.writeCSV import COLUMNS
+
+# the public_catalogue rows of the tables and of the public_catalogue
+# table, compared column by column
+CHECK_SQL = """WITH live AS (
+    SELECT rmp.id AS rmp_id, f.id AS frb_id, o.id AS obs_id,
+    rop.id AS rop_id, {live}
+    {catalogue}),
+  stored AS (
+    SELECT rmp_id, frb_id, obs_id, rop_id, {stored}
+    FROM public_catalogue)
+SELECT coalesce(l.rmp_id, s.rmp_id), s.rmp_id IS NULL, l.rmp_id IS NULL
+FROM live l FULL JOIN stored s ON l.rmp_id = s.rmp_id
+WHERE l IS DISTINCT FROM s
+ORDER BY 1""".format(
+    live=', '.join('{} AS {}'.format(expression, name)
+                   for name, expression in COLUMNS),
+    catalogue=CATALOGUE,
+    stored=', '.join(name for name, expression in COLUMNS))
+
+
+def refresh_public_catalogue(dbName, dbHost, dbPort, dbUser, dbPassword,
+                             pool=None):
+    '''
+    Rebuild the public_catalogue table from the tables. The triggers on
+    the tables keep the public_catalogue table up to date, a full
+    refresh is only needed when it is inconsistent, e.g. after loading
+    the tables with the triggers disabled.
+
+    :param dbName: database name
+    :param dbHost: database host
+    :param dbPort: database port
+    :param dbUser: database user name
+    :param dbPassword: database user password
+    :param pool: connection pool or connection to use instead of
+        connecting with the database settings
+    :type dbName: str
+    :type dbHost: str, NoneType
+    :type dbPort: str, NoneType
+    :type dbUser: str, NoneType
+    :type dbPassword: str, NoneType
+    :type pool: pyfrbcatdb.dbase.connection_pool,
+        psycopg2.extensions.connection, NoneType
+    :returns: number of rows in the public_catalogue table
+    :rtype: int
+    '''
+    with dbase.lend(pool, dbName, dbUser, dbPassword, dbHost,
+                    dbPort) as (connection, cursor):
+        cursor.execute("SELECT refresh_public_catalogue()")
+        cursor.execute("SELECT count(*) FROM public_catalogue")
+        rows = cursor.fetchone()[0]
+        connection.commit()
+    return rows
+
+
+def check_public_catalogue(dbName, dbHost, dbPort, dbUser, dbPassword,
+                           pool=None):
+    '''
+    Compare the public_catalogue table with the public catalogue joined
+    from the tables.
+
+    :param dbName: database name
+    :param dbHost: database host
+    :param dbPort: database port
+    :param dbUser: database user name
+    :param dbPassword: database user password
+    :param pool: connection pool or connection to use instead of
+        connecting with the database settings
+    :type dbName: str
+    :type dbHost: str, NoneType
+    :type dbPort: str, NoneType
+    :type dbUser: str, NoneType
+    :type dbPassword: str, NoneType
+    :type pool: pyfrbcatdb.dbase.connection_pool,
+        psycopg2.extensions.connection, NoneType
+    :returns: radio_measured_params ids of the rows that are missing
+        from the table, that should not be in the table and that differ,
+        by 'missing', 'extra' and 'different'
+    :rtype: dict
+    '''
+    differences = {'missing': [], 'extra': [], 'different': []}
+    with dbase.lend(pool, dbName, dbUser, dbPassword, dbHost,
+                    dbPort) as (connection, cursor):
+        cursor.execute(CHECK_SQL)
+        for rmp_id, missing, extra in cursor.fetchall():
+            if missing:
+                differences['missing'].append(rmp_id)
+            elif extra:
+                differences['extra'].append(rmp_id)
+            else:
+                differences['different'].append(rmp_id)
+        connection.rollback()
+    return differences
@@ -0,0 +1,306 @@
+'''
+description:    Ingest VOEvents from a job queue in the database
+license:        APACHE 2.0
+author:         Ronald van Haren, NLeSC (r.vanharen@esciencecenter.nl)
+'''
+import io
+import os
+import signal
+import socket
+import threading
+import psycopg2
+from pyfrbcatdb import dbase
+from pyfrbcatdb.batch_VOEvent import batch_VOEvent
+from pyfrbcatdb.decode_VOEvent import read_ivorn
+from pyfrbcatdb.decode_VOEvent import voevent_source
+from pyfrbcatdb.logger import logger
+
+
+class queue_VOEvent(batch_VOEvent):
+    '''
+    Worker that ingests the VOEvents queued in the ingest_jobs table.
+    Any number of workers on any number of hosts can share the queue.
+    A worker claims up to batch_size visible jobs with SELECT ... FOR
+    UPDATE SKIP LOCKED, so concurrent workers never claim the same job,
+    and hides them for visibility_timeout seconds. The claimed VOEvents
+    are inserted with FRBCat_add (or FRBCat_add_cte) and the jobs are
+    marked done in the transaction of the batch. Jobs that fail are
+    retried after retry_delay seconds until max_attempts attempts,
+    then marked failed, VOEvents that can not be parsed are failed at
+    once. Jobs of a batch that can not be committed are released without
+    using up an attempt. Jobs of a worker that stopped are claimed again
+    once their visibility timeout expires.
+
+    :param dbName: database name
+    :param dbHost: database host
+    :param dbPort: database port
+    :param dbUser: database user name
+    :param dbPassword: database user password
+    :param logfile: name of log file
+    :param batch_size: maximum number of VOEvents per transaction
+    :param poll_interval: seconds between checks of an empty queue
+    :param visibility_timeout: seconds a claimed job is hidden from
+        other workers
+    :param max_attempts: number of attempts before a job is failed
+    :param retry_delay: seconds before a failed job is retried
+    :param once: ingest the visible jobs and return instead of running
+        until SIGTERM/SIGINT
+    :param cte: insert each event with a single data-modifying CTE
+        statement (FRBCat_add_cte) instead of a statement per table
+    :param validator: validation tier of the VOEvents, default is full
+        validation against the schema
+    :param pool: connection pool or connection to use instead of
+        connecting with the database settings
+    :type dbName: str
+    :type dbHost: str, NoneType
+    :type dbPort: str, NoneType
+    :type dbUser: str, NoneType
+    :type dbPassword: str, NoneType
+    :type logfile: str
+    :type batch_size: int
+    :type poll_interval: float
+    :type visibility_timeout: float
+    :type max_attempts: int
+    :type retry_delay: float
+    :type once: bool
+    :type cte: bool
+    :type validator: pyfrbcatdb.validation.validator, NoneType
+    :type pool: pyfrbcatdb.dbase.connection_pool,
+        psycopg2.extensions.connection, NoneType
+    '''
+    claim_sql = ("UPDATE ingest_jobs j SET status = 'running', "
+                 "attempts = j.attempts + 1, claimed_by = %s, "
+                 "visible_at = now() + %s * interval '1 second' "
+                 "FROM (SELECT id FROM ingest_jobs WHERE status IN "
+                 "('pending', 'running') AND visible_at <= now() AND "
+                 "attempts < %s ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED) "
+                 "c WHERE j.id = c.id RETURNING j.id, j.name, j.payload")
+    # jobs without attempts left, e.g. their last attempt ended without
+    # the worker marking them
+    expire_sql = ("UPDATE ingest_jobs SET status = 'failed', "
+                  "finished_at = now(), error = CASE WHEN status = 'running' "
+                  "THEN 'visibility timeout expired' ELSE "
+                  "coalesce(error, 'no attempts left') END "
+                  "WHERE status IN ('pending', 'running') AND "
+                  "visible_at <= now() AND attempts >= %s")
+    # parse errors do not go away on a retry
+    finish_sql = ("UPDATE ingest_jobs j SET status = CASE "
+                  "WHEN o.error IS NULL THEN 'done' "
+                  "WHEN j.attempts < %(max_attempts)s AND "
+                  "o.error <> %(parse_error)s THEN 'pending' "
+                  "ELSE 'failed' END, "
+                  "visible_at = now() + %(retry_delay)s * interval '1 second', "
+                  "finished_at = CASE WHEN o.error IS NULL OR "
+                  "j.attempts >= %(max_attempts)s OR "
+                  "o.error = %(parse_error)s THEN now() END, error = o.error "
+                  "FROM unnest(%(ids)s::bigint[], %(errors)s::text[]) "
+                  "AS o(id, error) WHERE j.id = o.id")
+    parse_error = 'unable to parse VOEvent'
+
+    def __init__(self, dbName, dbHost, dbPort, dbUser, dbPassword, logfile,
+                 batch_size=100, poll_interval=5, visibility_timeout=300,
+                 max_attempts=3, retry_delay=60, once=False, cte=False,
+                 validator=None, pool=None):
+        logger.__init__(self, logfile)
+        self.dbName = dbName
+        self.dbHost = dbHost
+        self.dbPort = dbPort
+        self.dbUser = dbUser
+        self.dbPassword = dbPassword
+        self.batch_size = max(int(batch_size), 1)
+        self.cte = cte
+        if validator is not None:
+            self.validator = validator
+        # keep one connection for the lifetime of the worker
+        self.pool = pool or dbase.connection_pool(
+            dbName, dbUser, dbPassword, dbHost, dbPort, minconn=0,
+            maxconn=1)
+        self.batch_stats = []
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max(int(max_attempts), 1)
+        self.retry_delay = retry_delay
+        self.once = once
+        self.worker = '{}.{}.{}'.format(socket.gethostname(), os.getpid(),
+                                        threading.get_ident())
+        self.running = True
+        self.wakeup = threading.Event()
+        self.status = {'done': 0, 'failed': 0, 'retried': 0}
+        try:
+            self.run()
+        finally:
+            if pool is None:
+                self.pool.close()
+
+    def run(self):
+        '''
+        Ingest batches of queued VOEvents until stopped by SIGTERM or
+        SIGINT, or until no job is visible if once is set.
+        '''
+        if not self.once and \
+                threading.current_thread() is threading.main_thread():
+            for signum in [signal.SIGTERM, signal.SIGINT]:
+                signal.signal(signum, self.stop)
+        self.logger.info("Ingest worker {} started".format(self.worker))
+        while self.running:
+            if self.process_queue():
+                continue
+            if self.once:
+                break
+            self.wakeup.wait(self.poll_interval)
+
+    def stop(self, signum=None, frame=None):
+        '''
+        Stop the worker after the current batch.
+        '''
+        self.logger.info("Stopping ingest worker {}".format(self.worker))
+        self.running = False
+        self.wakeup.set()
+
+    def process_queue(self):
+        '''
+        Claim and ingest a batch of queued VOEvents.
+
+        :returns: number of jobs claimed
+        :rtype: int
+        '''
+        try:
+            with dbase.lend(self.pool) as (self.connection, self.cursor):
+                jobs = self.claim()
+                if not jobs:
+                    return 0
+                self.jobs = {}
+                voevents = []
+                for job_id, name, payload in jobs:
+                    voevent = io.BytesIO(bytes(payload))
+                    voevent.name = '{} (job {})'.format(name, job_id)
+                    self.jobs[voevent.name] = job_id
+                    voevents.append(voevent)
+                self.errors = {}
+                stats = self.write_batch(list(self.parse_VOEvents(voevents)))
+                if not stats['committed']:
+                    self.release([job[0] for job in jobs])
+        except psycopg2.Error as e:
+            # claimed jobs become visible again after the timeout
+            self.logger.error("Unable to ingest queued VOEvents: "
+                              "{}".format(e))
+            if not self.once:
+                self.wakeup.wait(self.poll_interval)
+            return 0
+        self.logger.info("Ingest worker {}: {done} done, {failed} failed, "
+                         "{retried} retried".format(self.worker,
+                                                    **self.status))
+        return len(jobs)
+
+    def claim(self):
+        '''
+        Claim up to batch_size visible jobs for this worker and fail the
+        jobs that have no attempts left.
+
+        :returns: list of (id, name, payload) of the claimed jobs
+        :rtype: list
+        '''
+        self.cursor.execute(self.expire_sql, (self.max_attempts,))
+        if self.cursor.rowcount:
+            self.logger.warning("Failed {} jobs that timed out on their "
+                                "last attempt".format(self.cursor.rowcount))
+        self.cursor.execute(self.claim_sql, (
+            self.worker, self.visibility_timeout, self.max_attempts,
+            self.batch_size))
+        jobs = sorted(tuple(row) for row in self.cursor.fetchall())
+        self.connection.commit()
+        return jobs
+
+    def release(self, ids):
+        '''
+        Make claimed jobs visible again, e.g. after a batch could not be
+        committed. The failed commit is not the fault of the jobs, the
+        attempt of the claim is given back.
+
+        :param ids: ids of the jobs
+        :type ids: list
+        '''
+        self.cursor.execute("UPDATE ingest_jobs SET status = 'pending', "
+                            "attempts = greatest(attempts - 1, 0), "
+                            "visible_at = now() WHERE id = ANY(%s)", (ids,))
+        self.connection.commit()
+        self.status['retried'] += len(ids)
+
+    def apply_VOEvents(self, records, stats):
+        '''
+        Insert the VOEvents of a batch and mark their jobs in the
+        transaction of the batch.
+        '''
+        batch_VOEvent.apply_VOEvents(self, records, stats)
+        ids = [self.jobs[name] for name, mapping, event_type in records]
+        errors = [self.errors.get(name) for name, mapping, event_type
+                  in records]
+        self.cursor.execute(self.finish_sql, {
+            'max_attempts': self.max_attempts,
+            'parse_error': self.parse_error,
+            'retry_delay': self.retry_delay, 'ids': ids, 'errors': errors})
+
+    def apply_record(self, name, mapping, event_type):
+        '''
+        Insert or retract a parsed VOEvent of a batch and keep the error
+        of a failed job.
+        '''
+        status = batch_VOEvent.apply_record(self, name, mapping, event_type)
+        if status == 'failed':
+            self.errors[name] = (self.parse_error if mapping is None
+                                 else 'unable to insert VOEvent')
+        return status
+
+    def write_batch(self, records, start=None):
+        '''
+        Insert a batch of parsed VOEvents and count the jobs as done or
+        failed once the batch is committed, they are counted as retried
+        by release otherwise.
+        '''
+        stats = batch_VOEvent.write_batch(self, records, start)
+        if stats['committed']:
+            self.status['failed'] += len(self.errors)
+            self.status['done'] += len(records) - len(self.errors)
+        return stats
+
+
+def enqueue_VOEvents(voevents, dbName, dbHost, dbPort, dbUser, dbPassword,
+                     pool=None):
+    '''
+    Add VOEvents to the ingest_jobs queue of the workers.
+
+    :param voevents: list of filestreams or filenames
+    :param dbName: database name
+    :param dbHost: database host
+    :param dbPort: database port
+    :param dbUser: database user name
+    :param dbPassword: database user password
+    :param pool: connection pool or connection to use instead of
+        connecting with the database settings
+    :type voevents: list
+    :type dbName: str
+    :type dbHost: str, NoneType
+    :type dbPort: str, NoneType
+    :type dbUser: str, NoneType
+    :type dbPassword: str, NoneType
+    :type pool: pyfrbcatdb.dbase.connection_pool,
+        psycopg2.extensions.connection, NoneType
+    :returns: ids of the queued jobs
+    :rtype: list
+    '''
+    names, ivorns, payloads = [], [], []
+    for voevent in voevents:
+        names.append(os.path.basename(str(getattr(voevent, 'name',
+                                                  voevent))))
+        ivorns.append(read_ivorn(voevent))
+        with voevent_source(voevent) as f:
+            payloads.append(psycopg2.Binary(f.read()))
+    with dbase.lend(pool, dbName, dbUser, dbPassword, dbHost,
+                    dbPort) as (connection, cursor):
+        cursor.execute("INSERT INTO ingest_jobs (name, ivorn, payload) "
+                       "SELECT * FROM unnest(%s::text[], %s::text[], "
+                       "%s::bytea[]) RETURNING id",
+                       (names, ivorns, payloads))
+        ids = [row[0] for row in cursor.fetchall()]
+        connection.commit()
+    return ids
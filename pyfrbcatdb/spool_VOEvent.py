@@ -0,0 +1,358 @@
+'''
+description:    Ingest VOEvents from a spool directory
+license:        APACHE 2.0
+author:         Ronald van Haren, NLeSC (r.vanharen@esciencecenter.nl)
+'''
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import signal
+import socket
+import threading
+import time
+import psycopg2
+from pyfrbcatdb import dbase
+from pyfrbcatdb.batch_VOEvent import batch_VOEvent
+from pyfrbcatdb.logger import logger
+
+
+class spool_VOEvent(batch_VOEvent):
+    '''
+    Daemon that ingests the VOEvent files written to a spool
+    directory. New files are claimed by renaming them into a work
+    directory of this daemon and are ingested in micro-batches of at
+    most batch_size events over a pooled connection. Ingested files are
+    moved to done/, files that fail to parse or insert to failed/. The
+    files of a batch that can not be committed are returned to the
+    spool directory and retried.
+
+    Writers should create the files under a name starting with '.' (or
+    not ending in .xml) and rename them when complete. The directory is
+    watched with inotify where available and polled every poll_interval
+    seconds, so the daemon also works on filesystems without inotify
+    (e.g. NFS). The queue depth and lag are logged and written to
+    status.json in the spool directory after every batch.
+
+    :param spool: spool directory
+    :param dbName: database name
+    :param dbHost: database host
+    :param dbPort: database port
+    :param dbUser: database user name
+    :param dbPassword: database user password
+    :param logfile: name of log file
+    :param batch_size: maximum number of VOEvents per transaction
+    :param poll_interval: seconds between scans of the spool directory
+    :param once: ingest the files in the spool directory and return
+        instead of running until SIGTERM/SIGINT
+    :param cte: insert each event with a single data-modifying CTE
+        statement (FRBCat_add_cte) instead of a statement per table
+    :param validator: validation tier of the VOEvents, default is full
+        validation against the schema
+    :param pool: connection pool or connection to use instead of
+        connecting with the database settings
+    :type spool: str
+    :type dbName: str
+    :type dbHost: str, NoneType
+    :type dbPort: str, NoneType
+    :type dbUser: str, NoneType
+    :type dbPassword: str, NoneType
+    :type logfile: str
+    :type batch_size: int
+    :type poll_interval: float
+    :type once: bool
+    :type cte: bool
+    :type validator: pyfrbcatdb.validation.validator, NoneType
+    :type pool: pyfrbcatdb.dbase.connection_pool,
+        psycopg2.extensions.connection, NoneType
+    '''
+    def __init__(self, spool, dbName, dbHost, dbPort, dbUser, dbPassword,
+                 logfile, batch_size=100, poll_interval=5, once=False,
+                 cte=False, validator=None, pool=None):
+        logger.__init__(self, logfile)
+        self.dbName = dbName
+        self.dbHost = dbHost
+        self.dbPort = dbPort
+        self.dbUser = dbUser
+        self.dbPassword = dbPassword
+        self.batch_size = max(int(batch_size), 1)
+        self.cte = cte
+        if validator is not None:
+            self.validator = validator
+        # keep one connection for the lifetime of the daemon
+        self.pool = pool or dbase.connection_pool(
+            dbName, dbUser, dbPassword, dbHost, dbPort, minconn=0,
+            maxconn=1)
+        self.batch_stats = []
+        self.spool = os.path.abspath(spool)
+        self.work = os.path.join(self.spool, 'work', '{}.{}'.format(
+            socket.gethostname(), os.getpid()))
+        self.done = os.path.join(self.spool, 'done')
+        self.failed = os.path.join(self.spool, 'failed')
+        for directory in [self.work, self.done, self.failed]:
+            os.makedirs(directory, exist_ok=True)
+        self.poll_interval = poll_interval
+        self.once = once
+        self.running = True
+        self.status = {'depth': 0, 'lag': 0.0, 'done': 0, 'failed': 0,
+                       'retried': 0}
+        try:
+            self.run()
+        finally:
+            if pool is None:
+                self.pool.close()
+
+    def run(self):
+        '''
+        Ingest micro-batches from the spool directory until stopped by
+        SIGTERM or SIGINT, or until the spool directory is empty if
+        once is set.
+        '''
+        self.recover()
+        once = self.once
+        watch = None if once else inotify_watch(self.spool)
+        if not once and \
+                threading.current_thread() is threading.main_thread():
+            for signum in [signal.SIGTERM, signal.SIGINT]:
+                signal.signal(signum, self.stop)
+        if once:
+            mode = 'once'
+        else:
+            mode = 'inotify' if watch.fd is not None else 'polling'
+        self.logger.info("Watching spool directory {} ({})".format(
+            self.spool, mode))
+        try:
+            while self.running:
+                if self.process_spool():
+                    continue
+                if once:
+                    break
+                watch.wait(self.poll_interval)
+        finally:
+            if watch:
+                watch.close()
+            self.release(self.claimed())
+            os.rmdir(self.work)
+
+    def stop(self, signum=None, frame=None):
+        '''
+        Stop the daemon after the current batch.
+        '''
+        self.logger.info("Stopping spool daemon")
+        self.running = False
+
+    def pending(self):
+        '''
+        VOEvent files waiting in the spool directory, oldest first.
+
+        :returns: list of (modification time, filename)
+        :rtype: list
+        '''
+        files = []
+        for entry in os.scandir(self.spool):
+            if entry.name.startswith('.') or not entry.name.endswith('.xml'):
+                continue
+            try:
+                if entry.is_file():
+                    files.append((entry.stat().st_mtime, entry.name))
+            except FileNotFoundError:
+                # claimed by another daemon
+                continue
+        return sorted(files)
+
+    def claim(self):
+        '''
+        Claim up to batch_size of the oldest files of the spool directory
+        by renaming them into the work directory of this daemon. Files
+        claimed by another daemon in the meantime are skipped.
+
+        :returns: claimed filenames in the work directory
+        :rtype: list
+        '''
+        pending = self.pending()
+        now = time.time()
+        self.status['depth'] = len(pending)
+        self.status['lag'] = now - pending[0][0] if pending else 0.0
+        claimed = []
+        for mtime, name in pending:
+            if len(claimed) == self.batch_size:
+                break
+            try:
+                os.rename(os.path.join(self.spool, name),
+                          os.path.join(self.work, name))
+            except FileNotFoundError:
+                continue
+            claimed.append(os.path.join(self.work, name))
+        return claimed
+
+    def claimed(self):
+        '''
+        Files in the work directory of this daemon.
+
+        :returns: filenames in the work directory
+        :rtype: list
+        '''
+        return sorted(os.path.join(self.work, name) for name in
+                      os.listdir(self.work))
+
+    def release(self, files):
+        '''
+        Return claimed files to the spool directory.
+
+        :param files: filenames in a work directory
+        :type files: list
+        '''
+        for filename in files:
+            os.rename(filename, os.path.join(self.spool,
+                                             os.path.basename(filename)))
+
+    def recover(self):
+        '''
+        Return the files claimed by daemons on this host that are no
+        longer running to the spool directory.
+        '''
+        work = os.path.dirname(self.work)
+        host = socket.gethostname()
+        for name in os.listdir(work):
+            directory = os.path.join(work, name)
+            try:
+                pid = int(name.rsplit('.', 1)[1])
+            except (IndexError, ValueError):
+                continue
+            if name.rsplit('.', 1)[0] != host or directory == self.work:
+                continue
+            try:
+                os.kill(pid, 0)
+                continue
+            except ProcessLookupError:
+                pass
+            except PermissionError:
+                # running as another user
+                continue
+            files = [os.path.join(directory, f) for f in os.listdir(directory)]
+            self.logger.warning("Recovering {} VOEvents of stopped daemon "
+                                "{}".format(len(files), name))
+            self.release(files)
+            os.rmdir(directory)
+
+    def process_spool(self):
+        '''
+        Claim and ingest a micro-batch of VOEvent files.
+
+        :returns: number of files ingested
+        :rtype: int
+        '''
+        files = self.claim()
+        if not files:
+            self.write_status()
+            return 0
+        self.outcomes = {}
+        start = time.time()
+        try:
+            with dbase.lend(self.pool) as (self.connection, self.cursor):
+                stats = self.write_batch(list(self.parse_VOEvents(files)),
+                                         start)
+        except psycopg2.Error as e:
+            # the database is not reachable, retry the batch later
+            self.logger.error("Unable to ingest {} VOEvents, returning them "
+                              "to the spool: {}".format(len(files), e))
+            stats = {'committed': False}
+        if not stats['committed']:
+            self.release(files)
+            self.status['retried'] += len(files)
+            self.write_status()
+            if self.running and not self.once:
+                time.sleep(self.poll_interval)
+            return 0
+        for filename in files:
+            if self.outcomes.get(filename) == 'failed':
+                target, key = self.failed, 'failed'
+            else:
+                target, key = self.done, 'done'
+            os.replace(filename, os.path.join(target,
+                                              os.path.basename(filename)))
+            self.status[key] += 1
+        self.status['depth'] = max(self.status['depth'] - len(files), 0)
+        self.write_status()
+        self.logger.info("Spool: {depth} VOEvents waiting, lag {lag:.1f}s, "
+                         "{done} done, {failed} failed".format(
+                             **self.status))
+        return len(files)
+
+    def apply_record(self, name, mapping, event_type):
+        '''
+        Insert or retract a parsed VOEvent of a batch and keep the
+        outcome per file.
+        '''
+        status = batch_VOEvent.apply_record(self, name, mapping, event_type)
+        self.outcomes[name] = status
+        return status
+
+    def write_status(self):
+        '''
+        Write the queue depth, lag in seconds of the oldest waiting
+        VOEvent and the counts of this daemon to status.json in the
+        spool directory.
+        '''
+        status = dict(self.status, time=time.time(), pid=os.getpid(),
+                      host=socket.gethostname())
+        tmpfile = os.path.join(self.spool, '.status.json.tmp')
+        with open(tmpfile, 'w') as f:
+            json.dump(status, f)
+        os.replace(tmpfile, os.path.join(self.spool, 'status.json'))
+
+
+class inotify_watch:
+    '''
+    Wait for files written or moved into a directory with inotify. If
+    inotify is not available, waiting falls back to sleeping for the
+    poll interval.
+
+    :param directory: directory to watch
+    :type directory: str
+    '''
+    # IN_CLOSE_WRITE | IN_MOVED_TO
+    MASK = 0x00000008 | 0x00000080
+
+    def __init__(self, directory):
+        self.fd = None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+        if fd < 0:
+            return
+        if libc.inotify_add_watch(fd, os.fsencode(directory),
+                                  self.MASK) < 0:
+            os.close(fd)
+            return
+        self.fd = fd
+
+    def wait(self, timeout):
+        '''
+        Wait until a file is written or moved into the directory, at
+        most timeout seconds.
+
+        :param timeout: seconds to wait
+        :type timeout: float
+        '''
+        if self.fd is None:
+            time.sleep(timeout)
+            return
+        try:
+            if select.select([self.fd], [], [], timeout)[0]:
+                # drain the events, the directory is scanned anyway
+                while True:
+                    os.read(self.fd, 65536)
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def close(self):
+        '''
+        Stop watching the directory.
+        '''
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
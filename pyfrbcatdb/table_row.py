@@ -0,0 +1,107 @@
+'''
+description:    Row of a FRBCat database table
+license:        APACHE 2.0
+author:         Ronald van Haren, NLeSC (r.vanharen@esciencecenter.nl)
+'''
+from lxml import objectify
+
+
+class table_row:
+    '''
+    Class holding the cols and values of a row of a database table.
+    Empty values (None or '') are left out and lxml values are
+    converted to plain python values, so the values can be passed to
+    the database driver as they are.
+
+    :param table: name of database table
+    :param cols: cols in database table
+    :param values: values of the cols
+    :type table: str
+    :type cols: list
+    :type values: list
+    '''
+    __slots__ = ('table', 'cols', 'values')
+
+    def __init__(self, table, cols=(), values=()):
+        self.table = table
+        self.cols = []
+        self.values = []
+        self.extend(cols, values)
+
+    def append(self, col, value):
+        '''
+        Add a col to the row, empty values are left out.
+
+        :param col: col in database table
+        :param value: value of the col
+        :type col: str
+        :type value: str, float, int, bool, lxml.objectify.ObjectifiedElement
+        '''
+        value = plain_value(value)
+        if value is None or value == '':
+            return
+        self.cols.append(col)
+        self.values.append(value)
+
+    def extend(self, cols, values):
+        '''
+        Add cols to the row, empty values are left out.
+
+        :param cols: cols in database table
+        :param values: values of the cols
+        :type cols: list
+        :type values: list
+        '''
+        for col, value in zip(cols, values):
+            self.append(col, value)
+
+    def get(self, col, default=None):
+        '''
+        Get the value of a col.
+
+        :param col: col in database table
+        :param default: value returned if the row has no value for col
+        :type col: str
+        :returns: value of the col
+        '''
+        try:
+            return self.values[self.cols.index(col)]
+        except ValueError:
+            return default
+
+    def __contains__(self, col):
+        return col in self.cols
+
+    def __len__(self):
+        return len(self.cols)
+
+    def sql_params(self):
+        '''
+        Format sql params for the sql command from the cols and values.
+
+        :returns: col_sql (cols as a comma-seperated string),
+            parameters (string of format (%s,%s,...), equal to the number
+            of cols), values (tuple of the values of the cols)
+        :rtype: str, str, tuple
+        '''
+        return (', '.join(self.cols),
+                '(' + ','.join(['%s'] * len(self.values)) + ')',
+                tuple(self.values))
+
+
+def plain_value(value):
+    '''
+    Convert lxml values into plain python values.
+
+    :param value: value from the VOEvent
+    :type value: lxml.objectify.ObjectifiedElement, str, float, int,
+        bool, bytes, NoneType
+    :returns: value as a plain python object
+    :rtype: str, float, int, bool, bytes, NoneType
+    '''
+    if isinstance(value, objectify.ObjectifiedElement):
+        return value.text
+    if isinstance(value, str):
+        # lxml smart strings keep a reference to their element
+        return str(value)
+    return value
@@ -0,0 +1,98 @@
+'''
+description:    Validation tiers for VOEvents
+license:        APACHE 2.0
+author:         Ronald van Haren, NLeSC (r.vanharen@esciencecenter.nl)
+'''
+import voeventparse as vp
+from lxml import etree
+
+# validation tiers, from most to least strict
+TIERS = ('full', 'structural', 'off')
+# allowed values of the VOEvent role and citation attributes
+ROLES = ('observation', 'prediction', 'utility', 'test')
+CITES = ('followup', 'supersedes', 'retraction')
+
+
+class validator:
+    '''
+    Class to validate VOEvents at a given tier:
+      - full: validate against the VOEvent v2.0 schema (the schema is
+        compiled once per process by voevent-parse)
+      - structural: only check the elements and attributes pyfrbcatdb
+        relies on
+      - off: skip validation for VOEvents of a trusted source, VOEvents
+        of other sources are validated in full
+
+    :param tier: validation tier, 'full', 'structural' or 'off'
+    :param trusted: ivorn prefixes of trusted sources (tier off only)
+    :type tier: str
+    :type trusted: list, tuple
+    '''
+    def __init__(self, tier='full', trusted=()):
+        if tier not in TIERS:
+            raise ValueError('Unknown validation tier: {}'.format(tier))
+        self.tier = tier
+        self.trusted = tuple(trusted or ())
+
+    def validate(self, v):
+        '''
+        Validate a VOEvent.
+
+        :param v: VOEvent xml
+        :type v: lxml.objectify.ObjectifiedElement
+        :returns: tier the VOEvent was validated at
+        :rtype: str
+        :raises lxml.etree.DocumentInvalid: if the VOEvent is invalid
+        '''
+        tier = self.tier
+        if tier == 'off' and not self.is_trusted(v):
+            # only trusted sources may skip validation
+            tier = 'full'
+        if tier == 'full':
+            vp.assert_valid_as_v2_0(v)
+        elif tier == 'structural':
+            self.assert_structure(v)
+        return tier
+
+    def is_trusted(self, v):
+        '''
+        Check if the VOEvent ivorn starts with a trusted prefix.
+
+        :param v: VOEvent xml
+        :type v: lxml.objectify.ObjectifiedElement
+        :returns: True if the VOEvent is from a trusted source
+        :rtype: bool
+        '''
+        ivorn = v.attrib.get('ivorn', '')
+        return any(ivorn.startswith(prefix) for prefix in self.trusted)
+
+    @staticmethod
+    def assert_structure(v):
+        '''
+        Check the elements and attributes pyfrbcatdb relies on: the
+        ivorn, role and version attributes, the Who section and the
+        cite attribute of a citation.
+
+        :param v: VOEvent xml
+        :type v: lxml.objectify.ObjectifiedElement
+        :raises lxml.etree.DocumentInvalid: if the VOEvent is invalid
+        '''
+        if etree.QName(v).localname != 'VOEvent':
+            raise etree.DocumentInvalid('Root element is not a VOEvent')
+        if v.attrib.get('version') != '2.0':
+            raise etree.DocumentInvalid('VOEvent version is not 2.0')
+        if not v.attrib.get('ivorn', '').startswith('ivo://'):
+            raise etree.DocumentInvalid('Invalid VOEvent ivorn: {}'.format(
+                v.attrib.get('ivorn')))
+        if v.attrib.get('role') not in ROLES:
+            raise etree.DocumentInvalid('Invalid VOEvent role: {}'.format(
+                v.attrib.get('role')))
+        if v.find('Who') is None:
+            raise etree.DocumentInvalid('Missing Who section')
+        citations = v.find('Citations')
+        if citations is not None:
+            for cited in citations.iterchildren('EventIVORN'):
+                if cited.attrib.get('cite') not in CITES:
+                    raise etree.DocumentInvalid(
+                        'Invalid citation: {}'.format(
+                            cited.attrib.get('cite')))
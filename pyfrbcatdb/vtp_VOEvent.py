@@ -0,0 +1,346 @@
+'''
+description:    Receive VOEvents over the VOEvent Transport Protocol
+license:        APACHE 2.0
+author:         Ronald van Haren, NLeSC (r.vanharen@esciencecenter.nl)
+'''
+import asyncio
+import datetime
+import io
+import signal
+import struct
+import threading
+import psycopg2
+from lxml import etree
+from pyfrbcatdb import dbase
+from pyfrbcatdb.batch_VOEvent import batch_VOEvent
+from pyfrbcatdb.logger import logger
+
+# namespace of VTP transport messages
+TRANSPORT = 'http://telescope-networks.org/schema/Transport/v1.1'
+# messages are prefixed with their length as a 4-byte network order integer
+HEADER = struct.Struct('!I')
+# largest accepted message in bytes
+MAX_MESSAGE = 16 * 1024 * 1024
+# parser for received messages, never resolves entities or fetches urls
+PARSER = etree.XMLParser(resolve_entities=False, no_network=True,
+                         remove_blank_text=True)
+
+
+class vtp_VOEvent(batch_VOEvent):
+    '''
+    Receive VOEvents over the VOEvent Transport Protocol (VTP) and
+    insert them into the FRBCat database. With broker set, the receiver
+    subscribes to a VOEvent broker and reconnects when the connection is
+    lost. Otherwise it listens on host and port for authors and brokers
+    that send VOEvents to it.
+
+    Each received VOEvent is put on a bounded in-memory queue and
+    acknowledged with a transport ack. A single writer drains the queue
+    in batches of at most batch_size events over a pooled connection,
+    using the batch ingest of batch_VOEvent. When the queue is full the
+    receiver stops reading and acknowledging until the writer catches
+    up, so the sender holds on to the VOEvents instead of losing them.
+    Batches that can not be committed are retried every retry_interval
+    seconds. Queued events are written before the receiver exits on
+    SIGTERM or SIGINT.
+
+    :param dbName: database name
+    :param dbHost: database host
+    :param dbPort: database port
+    :param dbUser: database user name
+    :param dbPassword: database user password
+    :param logfile: name of log file
+    :param broker: host and port of a broker to subscribe to, None to
+        listen for connections
+    :param host: address to listen on
+    :param port: port to listen on, 0 picks a free port
+    :param local_ivorn: ivorn of this receiver in transport messages
+    :param queue_size: maximum number of queued VOEvents
+    :param batch_size: maximum number of VOEvents per transaction
+    :param retry_interval: seconds between connection attempts and
+        retries of a batch that could not be committed
+    :param cte: insert each event with a single data-modifying CTE
+        statement (FRBCat_add_cte) instead of a statement per table
+    :param validator: validation tier of the VOEvents, default is full
+        validation against the schema
+    :param pool: connection pool or connection to use instead of
+        connecting with the database settings
+    :type dbName: str
+    :type dbHost: str, NoneType
+    :type dbPort: str, NoneType
+    :type dbUser: str, NoneType
+    :type dbPassword: str, NoneType
+    :type logfile: str
+    :type broker: tuple, NoneType
+    :type host: str
+    :type port: int
+    :type local_ivorn: str
+    :type queue_size: int
+    :type batch_size: int
+    :type retry_interval: float
+    :type cte: bool
+    :type validator: pyfrbcatdb.validation.validator, NoneType
+    :type pool: pyfrbcatdb.dbase.connection_pool,
+        psycopg2.extensions.connection, NoneType
+    '''
+    def __init__(self, dbName, dbHost, dbPort, dbUser, dbPassword, logfile,
+                 broker=None, host='0.0.0.0', port=8099,
+                 local_ivorn='ivo://frbcatdb/vtp', queue_size=1000,
+                 batch_size=100, retry_interval=5, cte=False, validator=None,
+                 pool=None):
+        logger.__init__(self, logfile)
+        self.dbName = dbName
+        self.dbHost = dbHost
+        self.dbPort = dbPort
+        self.dbUser = dbUser
+        self.dbPassword = dbPassword
+        self.batch_size = max(int(batch_size), 1)
+        self.cte = cte
+        if validator is not None:
+            self.validator = validator
+        # keep one connection for the lifetime of the receiver
+        self.pool = pool or dbase.connection_pool(
+            dbName, dbUser, dbPassword, dbHost, dbPort, minconn=0,
+            maxconn=1)
+        self.batch_stats = []
+        self.broker = broker
+        self.host = host
+        self.port = port
+        self.local_ivorn = local_ivorn
+        self.queue_size = max(int(queue_size), 1)
+        self.retry_interval = retry_interval
+        self.loop = None
+        self.status = {'received': 0, 'rejected': 0, 'retried': 0}
+        try:
+            self.run()
+        finally:
+            if pool is None:
+                self.pool.close()
+
+    def run(self):
+        '''
+        Receive and ingest VOEvents until stopped by SIGTERM or SIGINT.
+        '''
+        asyncio.run(self.serve())
+
+    def stop(self, signum=None, frame=None):
+        '''
+        Stop receiving, write the queued VOEvents and return from run.
+        Can be called from any thread.
+        '''
+        self.logger.info("Stopping VTP receiver")
+        self.loop.call_soon_threadsafe(self.stopped.set)
+
+    async def serve(self):
+        '''
+        Subscribe to the broker or listen for connections, and write the
+        received VOEvents until stopped.
+        '''
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(self.queue_size)
+        self.stopped = asyncio.Event()
+        self.sessions = set()
+        writer = asyncio.ensure_future(self.drain())
+        if self.broker:
+            server = None
+            receiver = asyncio.ensure_future(self.subscribe())
+        else:
+            receiver = None
+            server = await asyncio.start_server(self.session, self.host,
+                                                self.port)
+            self.port = server.sockets[0].getsockname()[1]
+            self.logger.info("Listening for VOEvents on {}:{}".format(
+                self.host, self.port))
+        if threading.current_thread() is threading.main_thread():
+            for signum in [signal.SIGTERM, signal.SIGINT]:
+                self.loop.add_signal_handler(signum, self.stop)
+        try:
+            await self.stopped.wait()
+        finally:
+            if server:
+                server.close()
+            if receiver:
+                receiver.cancel()
+            for session in self.sessions:
+                session.close()
+            if self.queue.qsize():
+                self.logger.info("Writing {} queued VOEvents".format(
+                    self.queue.qsize()))
+            await self.queue.join()
+            writer.cancel()
+
+    async def subscribe(self):
+        '''
+        Connect to the broker and receive VOEvents, reconnecting when the
+        connection is lost.
+        '''
+        host, port = self.broker
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(host, port)
+            except OSError as e:
+                self.logger.error("Unable to connect to VOEvent broker "
+                                  "{}:{}: {}".format(host, port, e))
+                await asyncio.sleep(self.retry_interval)
+                continue
+            self.logger.info("Subscribed to VOEvent broker {}:{}".format(
+                host, port))
+            await self.session(reader, writer)
+            self.logger.warning("Lost connection to VOEvent broker "
+                                "{}:{}".format(host, port))
+            await asyncio.sleep(self.retry_interval)
+
+    async def session(self, reader, writer):
+        '''
+        Receive messages over a connection and send the replies until
+        the peer closes the connection.
+
+        :param reader: stream of the connection
+        :param writer: stream of the connection
+        :type reader: asyncio.StreamReader
+        :type writer: asyncio.StreamWriter
+        '''
+        peer = writer.get_extra_info('peername')
+        self.sessions.add(writer)
+        try:
+            while True:
+                message = await read_message(reader)
+                if message is None:
+                    break
+                reply = await self.handle(message)
+                if reply is not None:
+                    writer.write(HEADER.pack(len(reply)) + reply)
+                    await writer.drain()
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            self.logger.error("VTP connection {} failed: {}".format(peer, e))
+        finally:
+            self.sessions.discard(writer)
+            writer.close()
+
+    async def handle(self, message):
+        '''
+        Queue a received VOEvent or answer a transport message. Waits
+        while the queue is full, the VOEvent is acknowledged once it is
+        queued.
+
+        :param message: received message
+        :type message: bytes
+        :returns: reply, None if the message needs no reply
+        :rtype: bytes, NoneType
+        '''
+        try:
+            root = etree.fromstring(message, PARSER)
+        except etree.XMLSyntaxError as e:
+            self.logger.error("Unable to parse VTP message: {}".format(e))
+            self.status['rejected'] += 1
+            return transport('nak', None, self.local_ivorn,
+                             'Unable to parse message')
+        tag = etree.QName(root).localname
+        if tag == 'Transport':
+            if root.get('role') == 'iamalive':
+                return transport('iamalive', root.findtext('Origin'),
+                                 self.local_ivorn)
+            # acks, naks and authentication requests need no reply
+            return None
+        ivorn = root.get('ivorn')
+        if tag != 'VOEvent' or not ivorn:
+            self.status['rejected'] += 1
+            return transport('nak', ivorn, self.local_ivorn,
+                             'Not a VOEvent')
+        voevent = io.BytesIO(message)
+        voevent.name = ivorn
+        await self.queue.put(voevent)
+        self.status['received'] += 1
+        return transport('ack', ivorn, self.local_ivorn)
+
+    async def drain(self):
+        '''
+        Write the queued VOEvents in batches of at most batch_size
+        events, in a worker thread so receiving goes on meanwhile.
+        '''
+        loop = asyncio.get_running_loop()
+        while True:
+            voevents = [await self.queue.get()]
+            while len(voevents) < self.batch_size and not self.queue.empty():
+                voevents.append(self.queue.get_nowait())
+            while not await loop.run_in_executor(None, self.ingest,
+                                                 voevents):
+                # the VOEvents were acknowledged, never drop them
+                self.status['retried'] += len(voevents)
+                await asyncio.sleep(self.retry_interval)
+            for voevent in voevents:
+                self.queue.task_done()
+            self.logger.info("VTP: {} VOEvents queued, {received} received, "
+                             "{rejected} rejected".format(
+                                 self.queue.qsize(), **self.status))
+
+    def ingest(self, voevents):
+        '''
+        Insert a batch of received VOEvents in a single transaction.
+
+        :param voevents: received VOEvents
+        :type voevents: list
+        :returns: the batch is committed
+        :rtype: bool
+        '''
+        for voevent in voevents:
+            voevent.seek(0)
+        try:
+            with dbase.lend(self.pool) as (self.connection, self.cursor):
+                stats = self.write_batch(list(self.parse_VOEvents(voevents)))
+        except psycopg2.Error as e:
+            self.logger.error("Unable to ingest {} VOEvents, retrying: "
+                              "{}".format(len(voevents), e))
+            return False
+        return stats['committed']
+
+
+async def read_message(reader):
+    '''
+    Read a length-prefixed VTP message.
+
+    :param reader: stream of a VTP connection
+    :type reader: asyncio.StreamReader
+    :returns: message, None if the connection was closed between messages
+    :rtype: bytes, NoneType
+    '''
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise
+        return None
+    size = HEADER.unpack(header)[0]
+    if size > MAX_MESSAGE:
+        raise ValueError("message of {} bytes is too large".format(size))
+    return await reader.readexactly(size)
+
+
+def transport(role, origin, response, result=None):
+    '''
+    Create a VTP transport message.
+
+    :param role: ack, nak or iamalive
+    :param origin: ivorn of the acknowledged VOEvent or of the sender of
+        the iamalive message
+    :param response: ivorn of this receiver
+    :param result: reason of a nak
+    :type role: str
+    :type origin: str, NoneType
+    :type response: str
+    :type result: str, NoneType
+    :returns: transport message
+    :rtype: bytes
+    '''
+    root = etree.Element(etree.QName(TRANSPORT, 'Transport'),
+                         nsmap={'trn': TRANSPORT}, role=role, version='1.0')
+    timestamp = datetime.datetime.now(datetime.timezone.utc).strftime(
+        '%Y-%m-%dT%H:%M:%SZ')
+    for tag, text in [('Origin', origin), ('Response', response),
+                      ('TimeStamp', timestamp)]:
+        if text is not None:
+            etree.SubElement(root, tag).text = text
+    if result is not None:
+        etree.SubElement(etree.SubElement(root, 'Meta'), 'Result').text = \
+            result
+    return etree.tostring(root, xml_declaration=True, encoding='UTF-8')
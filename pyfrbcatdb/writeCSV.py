@@ -5,8 +5,161 @@ author:         Ronald van Haren, NLeSC (r.vanharen@esciencecenter.nl)
 '''
 from pyfrbcatdb.logger import logger
 from pyfrbcatdb import dbase
+from contextlib import nullcontext
+import gzip
+import io
+import psycopg2
 import shutil
 import os
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# compression of the CSV file by file extension
+COMPRESSION = {'.gz': 'gzip', '.zst': 'zstd'}
+
+# columns of the public catalogue, (name, SQL expression on the tables)
+COLUMNS = [
+    ('frb', 'f.name'),
+    ('telescope', 'o.telescope'),
+    ('utc', 'o.utc'),
+    ('raj', 'rop.raj'),
+    ('decj', 'rop.decj'),
+    ('gl', 'rop.gl'),
+    ('gb', 'rop.gb'),
+    ('receiver', 'rop.receiver'),
+    ('backend', 'rop.backend'),
+    ('beam_semi_major_axis', 'rop.beam_semi_major_axis'),
+    ('beam_semi_minor_axis', 'rop.beam_semi_minor_axis'),
+    ('beam_rotation_angle', 'rop.beam_rotation_angle'),
+    ('beam', 'rop.beam'),
+    ('sampling_time', 'rop.sampling_time'),
+    ('bandwidth', 'rop.bandwidth'),
+    ('centre_frequency', 'rop.centre_frequency'),
+    ('npol', 'rop.npol'),
+    ('bits_per_sample', 'rop.bits_per_sample'),
+    ('gain', 'rop.gain'),
+    ('tsys', 'rop.tsys'),
+    ('mw_dm_limit', 'rop.mw_dm_limit'),
+    ('galactic_electron_model', 'rop.galactic_electron_model'),
+    ('voevent_ivorn', 'rmp.voevent_ivorn'),
+    ('dm', 'rmp.dm'),
+    ('dm_error', 'rmp.dm_error'),
+    ('dm_index', 'rmp.dm_index'),
+    ('snr', 'rmp.snr'),
+    ('width', 'rmp.width'),
+    ('rank', 'rmp.rank'),
+    ('width_error_upper', 'rmp.width_error_upper'),
+    ('width_error_lower', 'rmp.width_error_lower'),
+    ('flux', 'rmp.flux'),
+    ('flux_error_upper', 'rmp.flux_error_upper'),
+    ('flux_error_lower', 'rmp.flux_error_lower'),
+    ('rm', 'rmp.rm'),
+    ('rm_error', 'rmp.rm_error'),
+    ('redshift_host', 'rmp.redshift_host'),
+    ('dispersion_smearing', 'rmp.dispersion_smearing'),
+    ('scattering_model', 'rmp.scattering_model'),
+    ('scattering_timescale', 'rmp.scattering_timescale'),
+    ('scattering', 'rmp.scattering'),
+    ('scattering_error', 'rmp.scattering_error'),
+    ('scattering_index', 'rmp.scattering_index'),
+    ('scattering_index_error', 'rmp.scattering_index_error'),
+    ('linear_poln_frac', 'rmp.linear_poln_frac'),
+    ('linear_poln_frac_error', 'rmp.linear_poln_frac_error'),
+    ('circular_poln_frac', 'rmp.circular_poln_frac'),
+    ('circular_poln_frac_error', 'rmp.circular_poln_frac_error'),
+    ('spectral_index', 'rmp.spectral_index'),
+    ('spectral_index_error', 'rmp.spectral_index_error')]
+
+# the public catalogue: verified detections of public FRBs
+CATALOGUE = """FROM frbs f JOIN observations o ON (f.id = o.frb_id)
+    JOIN radio_observations_params rop ON (o.id = rop.obs_id)
+    JOIN radio_measured_params rmp ON (rop.id = rmp.rop_id)
+    JOIN authors armp ON (rmp.author_id = armp.id)
+    WHERE (f.private = FALSE AND o.verified = TRUE AND
+     o.detected = TRUE)"""
+
+# formatting of the columns in the CSV file
+CSV_FORMATS = {'utc': "to_char({}, 'YYYY/MM/DD HH24:MI:SS.MS')",
+               'width': "regexp_replace({}::text,'-1','')"}
+
+
+def catalogue_table(cursor):
+    '''
+    Check if the database has the public_catalogue table, which is
+    kept up to date with the tables by triggers.
+
+    :param cursor: database cursor object
+    :type cursor: psycopg2.extras.DictCursor
+    :returns: True if the public_catalogue table exists
+    :rtype: bool
+    '''
+    cursor.execute("SELECT to_regclass('public_catalogue') IS NOT NULL")
+    return cursor.fetchone()[0]
+
+
+def select_catalogue(formats=None, order=('frb', 'utc'), table=True):
+    '''
+    Define the SELECT statement of the public catalogue.
+
+    :param formats: SQL format of a column by name, {} is replaced by
+        the column
+    :param order: names of the columns to order by, rows with equal
+        values are ordered by radio_measured_params id
+    :param table: select from the public_catalogue table instead of
+        joining the tables
+    :type formats: dict, NoneType
+    :type order: tuple
+    :type table: bool
+    :returns: SQL statement
+    :rtype: str
+    '''
+    formats = formats or {}
+    if table:
+        columns = dict((name, 'c.' + name) for name, expression in COLUMNS)
+        source = "FROM public_catalogue c"
+        key = 'c.rmp_id'
+    else:
+        columns = dict(COLUMNS)
+        source = CATALOGUE
+        key = 'rmp.id'
+    select = ',\n    '.join(
+        '{} as {}'.format(formats.get(name, '{}').format(columns[name]), name)
+        for name, expression in COLUMNS)
+    return "SELECT {}\n{}\nORDER BY {}".format(
+        select, source, ', '.join([columns[name] for name in order] + [key]))
+
+
+def compressor(rawfile, compression, filename):
+    '''
+    File-like writer that compresses the data written to it into
+    rawfile, or rawfile itself without compression.
+
+    :param rawfile: binary file to write to
+    :param compression: gzip, zstd or None
+    :param filename: name of the (compressed) file, recorded in the
+        gzip header without the .gz extension
+    :type rawfile: _io.BufferedWriter
+    :type compression: str, NoneType
+    :type filename: str
+    :returns: binary file-like writer, closing it ends the compressed
+        stream but leaves rawfile open
+    :rtype: io.BufferedWriter, contextlib.nullcontext
+    '''
+    if compression == 'gzip':
+        # record the name of the file, not of the tmp file
+        name = os.path.basename(filename)
+        if name.endswith('.gz'):
+            name = name[:-3]
+        writer = gzip.GzipFile(name, 'wb', compresslevel=6, fileobj=rawfile)
+    elif compression == 'zstd':
+        writer = zstandard.ZstdCompressor(level=3).stream_writer(
+            rawfile, closefd=False, write_return_read=True)
+    else:
+        return nullcontext(rawfile)
+    # COPY writes a row at a time, compress larger chunks
+    return io.BufferedWriter(writer, buffer_size=1 << 20)
 
 
 class writeCSV(logger):
@@ -20,6 +173,13 @@ class writeCSV(logger):
     :param dbUser: database user name
     :param dbPassword: database user password
     :param logfile: name of log file
+    :param pool: connection pool or connection to use instead of
+        connecting with the database settings
+    :param force: write the CSV file even if the catalogue did not
+        change since the last export
+    :param compression: compress the CSV file with gzip or zstd (needs
+        the zstandard package) while it is written, default is by the
+        extension of CSV (.gz or .zst)
     :type CSV: str
     :type dbName: str
     :type dbHost: str, NoneType
@@ -27,36 +187,68 @@ class writeCSV(logger):
     :type dbUser: str, NoneType
     :type dbPassword: str, NoneType
     :type logfile: str
+    :type pool: pyfrbcatdb.dbase.connection_pool,
+        psycopg2.extensions.connection, NoneType
+    :type force: bool
+    :type compression: str, NoneType
     '''
 
     def __init__(self, CSV, dbName, dbHost, dbPort, dbUser,
-                 dbPassword, logfile):
+                 dbPassword, logfile, pool=None, force=False,
+                 compression=None):
         logger.__init__(self, logfile)
         self.dbName = dbName
         self.dbHost = dbHost
         self.dbPort = dbPort
         self.dbUser = dbUser
         self.dbPassword = dbPassword
+        self.pool = pool
         self.CSV = CSV
+        self.force = force
+        self.compression = compression or COMPRESSION.get(
+            os.path.splitext(CSV)[1])
+        if self.compression not in [None, 'gzip', 'zstd']:
+            raise ValueError("Unknown compression: {}".format(compression))
+        if self.compression == 'zstd' and zstandard is None:
+            raise ImportError("zstd compression needs the zstandard package")
+        # set to True when the CSV file is (re)written
+        self.written = False
         self.writeToCSV()
 
     def writeToCSV(self):
         '''
         Dump database to CSV file
         '''
-        connection, cursor = dbase.connectToDB(self.dbName,
-                                               self.dbUser,
-                                               self.dbPassword,
-                                               self.dbHost,
-                                               self.dbPort)
-        # get the SQL statement to write database to CSV
-        sql = self.defineSQLStatement()
+        with dbase.lend(self.pool, self.dbName, self.dbUser,
+                        self.dbPassword, self.dbHost,
+                        self.dbPort) as (connection, cursor):
+            self.copyToCSV(connection, cursor)
+
+    def copyToCSV(self, connection, cursor):
+        '''
+        Dump database to CSV file over a database connection
+
+        :param connection: database connection
+        :param cursor: database cursor object
+        :type connection: psycopg2.extensions.connection
+        :type cursor: psycopg2.extras.DictCursor
+        '''
+        # read the version before the copy, changes committed in between
+        # are exported and only cause an extra export next time
+        version = self.catalogueVersion(connection, cursor)
+        if not self.force and version is not None and \
+                os.path.exists(self.CSV) and version == self.exportedVersion():
+            connection.rollback()
+            self.logger.info("Catalogue unchanged since the last export, "
+                             "not writing CSV file: {}".format(self.CSV))
+            return
         # open output file and write CSV file to it
         tmpfile = self.CSV + '.tmp'
         bakfile = self.CSV + '.bak'
         try:
-            with open(tmpfile, 'w') as csvfile:
-                cursor.copy_expert(sql, csvfile)
+            self.exportToFile(cursor, tmpfile)
+            # end the read-only transaction of the copy
+            connection.rollback()
             # rename original CSV file to .bak
             try:
                 shutil.move(self.CSV, bakfile)
@@ -75,72 +267,110 @@ class writeCSV(logger):
                 os.remove(bakfile)
             except OSError:
                 pass
+            self.written = True
             self.logger.info("Succesfully written database to " +
                              "CSV file: {}".format(self.CSV))
+            self.writeVersion(version)
         except (FileNotFoundError, PermissionError):
             self.logger.error("Failed to write database to " +
                               "CSV file: {}".format(self.CSV))
-        # close db connection
-        dbase.closeDBConnection(connection, cursor)
 
-    def defineSQLStatement(self):
+    def exportToFile(self, cursor, filename):
+        '''
+        Write the catalogue to a file
+
+        :param cursor: database cursor object
+        :param filename: name of the file to write
+        :type cursor: psycopg2.extras.DictCursor
+        :type filename: str
+        '''
+        # get the SQL statement to write database to CSV
+        sql = self.defineSQLStatement(catalogue_table(cursor))
+        # compress the rows as they stream out of the copy
+        with open(filename, 'wb') as rawfile, \
+                self.compressor(rawfile) as csvfile:
+            cursor.copy_expert(sql, csvfile)
+
+    def compressor(self, rawfile):
+        '''
+        File-like writer that compresses the data written to it into
+        rawfile, or rawfile itself without compression.
+
+        :param rawfile: binary file to write the CSV file to
+        :type rawfile: _io.BufferedWriter
+        :returns: binary file-like writer, closing it ends the
+            compressed stream but leaves rawfile open
+        :rtype: io.BufferedWriter, contextlib.nullcontext
+        '''
+        return compressor(rawfile, self.compression, self.CSV)
+
+    def catalogueVersion(self, connection, cursor):
+        '''
+        Get the catalogue version, which is bumped by every committed
+        transaction that changes the public catalogue.
+
+        :param connection: database connection
+        :param cursor: database cursor object
+        :type connection: psycopg2.extensions.connection
+        :type cursor: psycopg2.extras.DictCursor
+        :returns: catalogue version, None if the database has no
+            catalogue_version table (see db/upgrade_db.sh)
+        :rtype: int, NoneType
+        '''
+        try:
+            cursor.execute("SELECT version FROM catalogue_version")
+        except psycopg2.ProgrammingError:
+            connection.rollback()
+            self.logger.warning("No catalogue version in the database, " +
+                                "always writing the CSV file")
+            return None
+        return cursor.fetchone()[0]
+
+    def exportedVersion(self, filename=None):
+        '''
+        Get the catalogue version of the last export, recorded next to
+        the CSV file.
+
+        :param filename: exported file, default is the CSV file
+        :type filename: str, NoneType
+        :returns: catalogue version, None if not recorded
+        :rtype: int, NoneType
+        '''
+        try:
+            with open((filename or self.CSV) + '.version') as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def writeVersion(self, version, filename=None):
+        '''
+        Record the catalogue version of the export next to the CSV file.
+
+        :param version: catalogue version, None removes the record
+        :param filename: exported file, default is the CSV file
+        :type version: int, NoneType
+        :type filename: str, NoneType
+        '''
+        versionfile = (filename or self.CSV) + '.version'
+        if version is None:
+            try:
+                os.remove(versionfile)
+            except OSError:
+                pass
+            return
+        with open(versionfile + '.tmp', 'w') as f:
+            f.write(str(version))
+        os.replace(versionfile + '.tmp', versionfile)
+
+    def defineSQLStatement(self, table=True):
         '''
         Define SQL statement for creating CSV file
+
+        :param table: select from the public_catalogue table instead of
+            joining the tables
+        :type table: bool
         '''
-        sql = """COPY (SELECT f.name as FRB,
-                o.telescope as telescope,
-                to_char(o.utc, 'YYYY/MM/DD HH24:MI:SS.MS') as UTC,
-                rop.raj as RAJ, rop.decj as DECJ,
-                rop.gl as gl, rop.gb as gb,
-                rop.receiver as receiver,
-                rop.backend as backend,
-                rop.beam_semi_major_axis as beam_semi_major_axis,
-                rop.beam_semi_minor_axis as beam_semi_minor_axis,
-                rop.beam_rotation_angle as beam_rotation_angle,
-                rop.beam as beam,
-                rop.sampling_time as sampling_time,
-                rop.bandwidth as bandwidth,
-                rop.centre_frequency as centre_frequency,
-                rop.npol as npol,
-                rop.bits_per_sample as bits_per_sample,
-                rop.gain as gain,
-                rop.tsys as tsys,
-                rop.mw_dm_limit as mw_dm_limit,
-                rop.galactic_electron_model as galactic_electron_model,
-                rmp.voevent_ivorn as voevent_ivorn,
-                rmp.dm as dm,
-                rmp.dm_error as dm_error,
-                rmp.dm_index as dm_index,
-                rmp.snr as snr,
-                regexp_replace(rmp.width::text,'-1','') as width,
-                rmp.rank as rank,
-                rmp.width_error_upper as width_error_upper,
-                rmp.width_error_lower as width_error_lower,
-                rmp.flux as flux,
-                rmp.flux_error_upper as flux_error_upper,
-                rmp.flux_error_lower as flux_error_lower,
-                rmp.rm as rm,
-                rmp.rm_error as rm_error,
-                rmp.redshift_host as redshift_host,
-                rmp.dispersion_smearing as dispersion_smearing,
-                rmp.scattering_model as scattering_model,
-                rmp.scattering_timescale as scattering_timescale,
-                rmp.scattering as scattering,
-                rmp.scattering_error as scattering_error,
-                rmp.scattering_index as scattering_index,
-                rmp.scattering_index_error as scattering_index_error,
-                rmp.linear_poln_frac as linear_poln_frac,
-                rmp.linear_poln_frac_error as linear_poln_frac_error,
-                rmp.circular_poln_frac as circular_poln_frac,
-                rmp.circular_poln_frac_error as circular_poln_frac_error,
-                rmp.spectral_index as spectral_index,
-                rmp.spectral_index_error as spectral_index_error
-                FROM frbs f JOIN observations o ON (f.id = o.frb_id)
-                JOIN radio_observations_params rop ON (o.id = rop.obs_id)
-                JOIN radio_measured_params rmp ON (rop.id = rmp.rop_id)
-                JOIN authors armp ON (rmp.author_id = armp.id)
-                WHERE (f.private = FALSE AND o.verified = TRUE AND
-                 o.detected = TRUE)
-                ORDER BY f.name, o.utc)
-                TO STDOUT DELIMITER ',' CSV HEADER"""
+        sql = """COPY ({})
+                TO STDOUT DELIMITER ',' CSV HEADER""".format(
+            select_catalogue(CSV_FORMATS, table=table))
         return sql
@@ -0,0 +1,122 @@
+'''
+description:    Write the changes of the FRBCat database to a CSV file
+license:        APACHE 2.0
+author:         Ronald van Haren, NLeSC (r.vanharen@esciencecenter.nl)
+'''
+from pyfrbcatdb.writeCSV import COLUMNS
+from pyfrbcatdb.writeCSV import CSV_FORMATS
+from pyfrbcatdb.writeCSV import writeCSV
+
+# the rows changed since a version, by rmp id: the first operation since
+# the version, the version and ivorn of the last change
+CHANGES = """WITH changes AS (
+    SELECT rmp_id, (array_agg(operation ORDER BY id))[1] AS operation,
+    max(version) AS version,
+    (array_agg(voevent_ivorn ORDER BY id DESC))[1] AS voevent_ivorn
+    FROM catalogue_changes WHERE version > {since} GROUP BY rmp_id)
+SELECT CASE WHEN c.rmp_id IS NULL THEN 'delete'
+    WHEN ch.operation = 'insert' THEN 'insert' ELSE 'update' END as operation,
+    ch.version as version,
+    {columns}
+FROM changes ch LEFT JOIN public_catalogue c ON c.rmp_id = ch.rmp_id
+WHERE c.rmp_id IS NOT NULL OR ch.operation <> 'insert'
+ORDER BY ch.version, ch.rmp_id"""
+
+
+class writeChanges(writeCSV):
+    '''
+    Class module that writes the rows of the public catalogue that
+    changed since a catalogue version to a CSV file, for mirrors of the
+    CSV file. The columns of the CSV file of writeCSV follow the
+    operation and the version of the last change of the row:
+
+        - insert: the row was added to the catalogue
+        - update: the row changed, e.g. by a supersedes
+        - delete: the row was removed, e.g. by a retraction or
+          supersedes, only the voevent_ivorn is given
+
+    A row inserted and deleted since the version is left out. The
+    changes are logged in the catalogue_changes table by the refreshes
+    of the public_catalogue table, the catalogue version of the export
+    is recorded in a .version file next to the CSV file, the version to
+    export the next changes since.
+
+    :param CSV: CSV filename
+    :param since: catalogue version, e.g. of the full CSV file of the
+        mirror
+    :param dbName: database name
+    :param dbHost: database host
+    :param dbPort: database port
+    :param dbUser: database user name
+    :param dbPassword: database user password
+    :param logfile: name of log file
+    :param pool: connection pool or connection to use instead of
+        connecting with the database settings
+    :param compression: compress the CSV file with gzip or zstd, default
+        is by the extension of CSV (.gz or .zst)
+    :type CSV: str
+    :type since: int
+    :type dbName: str
+    :type dbHost: str, NoneType
+    :type dbPort: str, NoneType
+    :type dbUser: str, NoneType
+    :type dbPassword: str, NoneType
+    :type logfile: str
+    :type pool: pyfrbcatdb.dbase.connection_pool,
+        psycopg2.extensions.connection, NoneType
+    :type compression: str, NoneType
+    '''
+
+    def __init__(self, CSV, since, dbName, dbHost, dbPort, dbUser,
+                 dbPassword, logfile, pool=None, compression=None):
+        self.since = int(since)
+        writeCSV.__init__(self, CSV, dbName, dbHost, dbPort, dbUser,
+                          dbPassword, logfile, pool, True, compression)
+
+    def copyToCSV(self, connection, cursor):
+        '''
+        Dump the changes to CSV file over a database connection
+
+        :param connection: database connection
+        :param cursor: database cursor object
+        :type connection: psycopg2.extensions.connection
+        :type cursor: psycopg2.extras.DictCursor
+        '''
+        # read the version and the changes from the same snapshot
+        connection.rollback()
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, "
+                       "READ ONLY")
+        cursor.execute("SELECT to_regclass('catalogue_changes') IS NOT NULL")
+        if not cursor.fetchone()[0]:
+            connection.rollback()
+            self.logger.error("No catalogue changes in the database, see "
+                              "db/upgrade_db.sh")
+            return
+        cursor.execute("SELECT changes_from FROM catalogue_version")
+        changes_from = cursor.fetchone()[0]
+        if self.since < changes_from:
+            connection.rollback()
+            raise ValueError("The changes since version {} are not logged, "
+                             "the oldest version is {}".format(
+                                 self.since, changes_from))
+        writeCSV.copyToCSV(self, connection, cursor)
+
+    def defineSQLStatement(self, table=True):
+        '''
+        Define SQL statement to write the changes to CSV
+
+        :param table: unused, the changes are read from the
+            public_catalogue table
+        :type table: bool
+        '''
+        columns = []
+        for name, expression in COLUMNS:
+            column = 'c.' + name
+            if name == 'voevent_ivorn':
+                # the rows of deletes are not in public_catalogue
+                column = 'coalesce(c.voevent_ivorn, ch.voevent_ivorn)'
+            columns.append('{} as {}'.format(
+                CSV_FORMATS.get(name, '{}').format(column), name))
+        sql = CHANGES.format(since=self.since,
+                             columns=',\n    '.join(columns))
+        return "COPY ({}) TO STDOUT DELIMITER ',' CSV HEADER".format(sql)
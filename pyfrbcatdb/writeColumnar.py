@@ -0,0 +1,168 @@
+'''
+description:    Write the FRBCat database to a columnar file
+license:        APACHE 2.0
+author:         Ronald van Haren, NLeSC (r.vanharen@esciencecenter.nl)
+'''
+from pyfrbcatdb.logger import logger
+from pyfrbcatdb.writeCSV import catalogue_table
+from pyfrbcatdb.writeCSV import select_catalogue
+from pyfrbcatdb.writeCSV import writeCSV
+import os
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# columnar format by file extension
+FORMATS = {'.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow'}
+
+# unknown widths are -1 in the database
+COLUMNAR_FORMATS = {'width': 'NULLIF({}, -1)'}
+
+
+def arrow_type(type_code):
+    '''
+    Get the Arrow type of a PostgreSQL column type, text for the types
+    that are not mapped.
+
+    :param type_code: oid of the PostgreSQL type
+    :type type_code: int
+    :returns: Arrow type
+    :rtype: pyarrow.DataType
+    '''
+    types = {16: pyarrow.bool_(), 20: pyarrow.int64(), 21: pyarrow.int16(),
+             23: pyarrow.int32(), 700: pyarrow.float32(),
+             701: pyarrow.float64(), 1114: pyarrow.timestamp('us'),
+             1184: pyarrow.timestamp('us', tz='UTC')}
+    return types.get(type_code, pyarrow.string())
+
+
+class writeColumnar(writeCSV):
+    '''
+    Class module that writes the FRBCat database to a Parquet or Arrow
+    IPC file with typed columns. The public catalogue of the CSV file is
+    fetched from a server-side cursor in chunks of chunk_size rows,
+    ordered by utc. Each chunk is a row group of the Parquet file, with
+    the minimum and maximum of every column, so readers can skip row
+    groups by utc and dm.
+
+    :param filename: Parquet or Arrow IPC filename
+    :param dbName: database name
+    :param dbHost: database host
+    :param dbPort: database port
+    :param dbUser: database user name
+    :param dbPassword: database user password
+    :param logfile: name of log file
+    :param pool: connection pool or connection to use instead of
+        connecting with the database settings
+    :param force: write the file even if the catalogue did not change
+        since the last export
+    :param format: parquet or arrow, default is by the extension of
+        filename (.parquet, .arrow or .feather)
+    :param compression: compression codec of the columns (e.g. zstd,
+        snappy for Parquet, lz4 for Arrow IPC) or None
+    :param chunk_size: number of rows fetched at a time
+    :type filename: str
+    :type dbName: str
+    :type dbHost: str, NoneType
+    :type dbPort: str, NoneType
+    :type dbUser: str, NoneType
+    :type dbPassword: str, NoneType
+    :type logfile: str
+    :type pool: pyfrbcatdb.dbase.connection_pool,
+        psycopg2.extensions.connection, NoneType
+    :type force: bool
+    :type format: str, NoneType
+    :type compression: str, NoneType
+    :type chunk_size: int
+    '''
+
+    def __init__(self, filename, dbName, dbHost, dbPort, dbUser,
+                 dbPassword, logfile, pool=None, force=False, format=None,
+                 compression='zstd', chunk_size=65536):
+        logger.__init__(self, logfile)
+        self.dbName = dbName
+        self.dbHost = dbHost
+        self.dbPort = dbPort
+        self.dbUser = dbUser
+        self.dbPassword = dbPassword
+        self.pool = pool
+        self.CSV = filename
+        self.force = force
+        self.format = format or FORMATS.get(os.path.splitext(filename)[1])
+        if self.format not in ['parquet', 'arrow']:
+            raise ValueError("Unknown columnar format of {}: {}".format(
+                filename, format))
+        if pyarrow is None:
+            raise ImportError("The columnar export needs the pyarrow "
+                              "package")
+        self.compression = compression
+        self.chunk_size = max(int(chunk_size), 1)
+        # set to True when the file is (re)written
+        self.written = False
+        self.writeToCSV()
+
+    def exportToFile(self, cursor, filename):
+        '''
+        Write the catalogue to a Parquet or Arrow IPC file, a chunk of
+        rows at a time
+
+        :param cursor: database cursor object
+        :param filename: name of the file to write
+        :type cursor: psycopg2.extras.DictCursor
+        :type filename: str
+        '''
+        sql = self.defineSQLStatement(catalogue_table(cursor))
+        # a server-side cursor keeps the rows in the database
+        rows = cursor.connection.cursor(name='frbcat_columnar')
+        try:
+            rows.execute(sql)
+            chunk = rows.fetchmany(self.chunk_size)
+            schema = pyarrow.schema([
+                (column.name, arrow_type(column.type_code))
+                for column in rows.description])
+            with self.writer(filename, schema) as writer:
+                while chunk:
+                    batch = pyarrow.RecordBatch.from_arrays(
+                        [pyarrow.array(values, type=field.type)
+                         for values, field in zip(zip(*chunk), schema)],
+                        schema=schema)
+                    if self.format == 'parquet':
+                        writer.write_batch(batch,
+                                           row_group_size=self.chunk_size)
+                    else:
+                        writer.write_batch(batch)
+                    chunk = rows.fetchmany(self.chunk_size)
+        finally:
+            rows.close()
+
+    def writer(self, filename, schema):
+        '''
+        Open a writer of record batches to a Parquet or Arrow IPC file
+
+        :param filename: name of the file to write
+        :param schema: schema of the record batches
+        :type filename: str
+        :type schema: pyarrow.Schema
+        :returns: writer, closing it completes the file
+        :rtype: pyarrow.parquet.ParquetWriter,
+            pyarrow.ipc.RecordBatchFileWriter
+        '''
+        if self.format == 'parquet':
+            return pyarrow.parquet.ParquetWriter(
+                filename, schema, compression=self.compression or 'none',
+                write_statistics=True)
+        options = pyarrow.ipc.IpcWriteOptions(compression=self.compression)
+        return pyarrow.ipc.new_file(filename, schema, options=options)
+
+    def defineSQLStatement(self, table=True):
+        '''
+        Define SQL statement for the typed columns of the catalogue
+
+        :param table: select from the public_catalogue table instead of
+            joining the tables
+        :type table: bool
+        '''
+        return select_catalogue(COLUMNAR_FORMATS, ('utc', 'frb'), table)
@@ -103,7 +103,11 @@ class zenodo(logger):
         version = datetime.datetime.now().strftime('%Y.%m.%d')
         versionFn = datetime.datetime.now().strftime('%Y_%m_%d')
         self.metadata['metadata']['version'] = version
-        data = {'filename': "frbcat-{}.csv".format(versionFn)}
+        # keep the extension of a compressed CSV file (.gz or .zst)
+        extension = os.path.splitext(self.CSV)[1]
+        if extension not in ['.gz', '.zst']:
+            extension = ''
+        data = {'filename': "frbcat-{}.csv{}".format(versionFn, extension)}
         # define file to upload
         files = {'file': open(self.CSV, 'rb')}
         resp = requests.post(urljoin
@@ -30,6 +30,7 @@ setup(
                 ['pyfrbcatdb/dbase.config'])],
     scripts=['pyfrbcatdb/scripts/decode_VOEvent',
              'pyfrbcatdb/scripts/create_VOEvent',
+             'pyfrbcatdb/scripts/frbcatdb',
              'pyfrbcatdb/scripts/frbcatdb-image'],
     long_description=read('README.md'),
     classifiers=[
@@ -40,5 +41,6 @@ setup(
     install_requires=['voevent-parse', 'python-dateutil',
                       'psycopg2', 'configargparse',
                       'PyYAML', 'astropy', 'requests'],
+    extras_require={'zstd': ['zstandard'], 'parquet': ['pyarrow']},
     setup_requires=['sphinx', 'sphinx-autobuild'],
 )
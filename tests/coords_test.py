@@ -0,0 +1,82 @@
+import unittest
+import numpy as np
+from astropy import units as u
+from astropy.coordinates import SkyCoord
+from pyfrbcatdb import coords
+
+
+def astropy_locstrings(ra, dec, frame=None):
+    '''
+    Location strings as formatted by decode_VOEvent.get_coord with
+    astropy
+    '''
+    if frame:
+        skcoord = SkyCoord(ra=ra*u.degree, dec=dec*u.degree, frame=frame)
+    else:
+        skcoord = SkyCoord(ra=ra*u.degree, dec=dec*u.degree)
+    result = []
+    for coordloc in [skcoord.ra.hms, skcoord.dec.dms]:
+        result.append(['{}:{}:{}'.format(
+            str(int(round(c0))).zfill(2),
+            str(abs(int(round(c1)))).zfill(2),
+            "{:.2f}".format(abs(c2)).zfill(5))
+            for c0, c1, c2 in zip(*coordloc)])
+    return result
+
+
+class coordstest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(20170719)
+        n = 100000
+        # uniform sample, values close to rounding boundaries of the
+        # seconds, declinations between -1 and 0 degrees and ra outside
+        # of 0 <= ra < 360 degrees
+        seconds = rng.integers(0, 60, n) + rng.choice(
+            [0.995, 0.9949999, 0.9950001, 0.005, 0.0], n)
+        self.ra = np.concatenate([
+            rng.uniform(0, 360, n),
+            (rng.integers(0, 24, n) + rng.integers(0, 60, n) / 60. +
+             seconds / 3600.) * 15.,
+            rng.uniform(-720, 1080, n // 10),
+            [0., 359.99999999, 360., -0., 15., 1e-12]])
+        self.dec = np.concatenate([
+            rng.uniform(-90, 90, n),
+            np.copysign(rng.integers(0, 90, n) + rng.integers(0, 60, n) /
+                        60. + seconds / 3600., rng.uniform(-1, 1, n)),
+            rng.uniform(-1, 0, n // 10),
+            [-90., 90., -0., -1e-12, -0.99999999, -1.]])
+
+    def test_01_single(self):
+        '''
+        Single conversions match astropy byte for byte
+        '''
+        ra_ref, dec_ref = astropy_locstrings(self.ra, self.dec)
+        self.assertEqual(ra_ref, [coords.format_ra(x) for x in self.ra])
+        self.assertEqual(dec_ref, [coords.format_dec(x) for x in self.dec])
+
+    def test_02_batch(self):
+        '''
+        Batch conversions match astropy byte for byte
+        '''
+        ra_ref, dec_ref = astropy_locstrings(self.ra, self.dec, 'fk5')
+        self.assertEqual(ra_ref, coords.format_ra_batch(self.ra).tolist())
+        self.assertEqual(dec_ref,
+                         coords.format_dec_batch(self.dec).tolist())
+
+    def test_03_quirks(self):
+        '''
+        Sign of declinations between -1 and 0 degrees is lost, seconds
+        are rounded to 60.00
+        '''
+        self.assertEqual('00:30:00.00', coords.format_dec(-0.5))
+        self.assertEqual('-12:18:46.00',
+                         coords.format_dec(-(12 + 18 / 60. + 46 / 3600.)))
+        self.assertEqual('00:00:60.00', coords.format_ra(59.996 / 240.))
+        with self.assertRaises(ValueError):
+            coords.format_dec(90.5)
+        with self.assertRaises(ValueError):
+            coords.format_dec_batch([0., -91.])
+
+
+if __name__ == '__main__':
+    unittest.main()
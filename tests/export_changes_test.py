@@ -0,0 +1,124 @@
+import csv
+import os
+import unittest
+from pyfrbcatdb import decode_VOEvent as decode
+from pyfrbcatdb import writeChanges
+from pyfrbcatdb import writeCSV
+from tests.ingest_base import ingesttest
+from tests.voevent_variants import write_variants
+
+
+class changestest(ingesttest):
+    def version(self):
+        self.cursor.execute("SELECT version FROM catalogue_version")
+        version = self.cursor.fetchone()[0]
+        self.connection.rollback()
+        return version
+
+    def ingest(self, variants):
+        for voevent, ivorn, name in variants:
+            decode.decode_VOEvent(voevent, self.dbName, self.dbHost,
+                                  self.dbPort, self.dbUser,
+                                  self.dbPassword, self.logfile)
+
+    def catalogue(self):
+        '''
+        Return the rows of the full CSV file by voevent_ivorn
+        '''
+        CSV = os.path.join(self.tmpdir, 'frbcat.csv')
+        writeCSV.writeCSV(CSV, self.dbName, self.dbHost, self.dbPort,
+                          self.dbUser, self.dbPassword, self.logfile,
+                          force=True)
+        with open(CSV) as f:
+            return dict((row['voevent_ivorn'], row)
+                        for row in csv.DictReader(f))
+
+    def changes(self, since):
+        '''
+        Return the rows of the changes since version since and the
+        recorded version of the export
+        '''
+        CSV = os.path.join(self.tmpdir, 'changes.csv')
+        writeChanges.writeChanges(CSV, since, self.dbName, self.dbHost,
+                                  self.dbPort, self.dbUser,
+                                  self.dbPassword, self.logfile)
+        with open(CSV) as f:
+            rows = list(csv.DictReader(f))
+        with open(CSV + '.version') as f:
+            return rows, int(f.read())
+
+    def operations(self, rows):
+        return dict((row['voevent_ivorn'], row['operation'])
+                    for row in rows)
+
+    def mirror(self, catalogue, rows):
+        '''
+        Apply the changes to the rows of a full CSV file
+        '''
+        catalogue = dict(catalogue)
+        for row in rows:
+            operation = row.pop('operation')
+            row.pop('version')
+            if operation == 'delete':
+                del catalogue[row['voevent_ivorn']]
+            else:
+                catalogue[row['voevent_ivorn']] = row
+        return catalogue
+
+    def test_01_changes(self):
+        '''
+        Inserts, supersedes, retractions and updates are exported as the
+        changes of the rows since a version, a mirror of the CSV file
+        stays equal to the CSV file
+        '''
+        since = self.version()
+        mirror = self.catalogue()
+        det = write_variants(self.tmpdir, 2, prefix='FRBCHANGE_')
+        self.ingest(det)
+        rows, version = self.changes(since)
+        self.assertEqual(self.version(), version)
+        self.assertEqual({det[0][1]: 'insert', det[1][1]: 'insert'},
+                         self.operations(rows))
+        self.assertTrue(all(int(row['version']) > since for row in rows))
+        catalogue = self.catalogue()
+        self.assertEqual(catalogue, self.mirror(mirror, rows))
+        # the supersedes makes the second detection not public, the
+        # followup is inserted and retracted
+        follow = write_variants(self.tmpdir, 1,
+                                template='Subsequent_unitTest1.xml',
+                                cite=det[0][1], name=det[0][2])
+        sup = write_variants(self.tmpdir, 1,
+                             template='Confirmation_unitTest1.xml',
+                             cite=det[1][1], name=det[1][2])
+        retract = write_variants(self.tmpdir, 1,
+                                 template='Retraction_unitTest1.xml',
+                                 cite=follow[0][1])
+        self.ingest(follow + sup + retract)
+        self.cursor.execute("UPDATE radio_measured_params SET dm = dm + 1 "
+                            "WHERE voevent_ivorn = %s", (det[0][1],))
+        self.connection.commit()
+        rows, latest = self.changes(version)
+        self.assertEqual({det[0][1]: 'update', det[1][1]: 'delete'},
+                         self.operations(rows))
+        self.assertEqual(str(float(catalogue[det[0][1]]['dm']) + 1),
+                         rows[-1]['dm'])
+        self.assertEqual(self.catalogue(), self.mirror(catalogue, rows))
+        rows, latest = self.changes(since)
+        self.assertEqual({det[0][1]: 'insert'}, self.operations(rows))
+        self.assertEqual([], self.changes(latest)[0])
+
+    def test_02_pruned(self):
+        '''
+        The changes since a pruned version are not exported
+        '''
+        version = self.version()
+        self.cursor.execute("SELECT prune_catalogue_changes(%s)",
+                            (version,))
+        self.connection.commit()
+        self.assertEqual([], self.changes(version)[0])
+        with self.assertRaises(ValueError):
+            self.changes(version - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,269 @@
+import gzip
+import json
+import os
+import unittest
+from astropy.io.votable import parse_single_table
+from pyfrbcatdb import decode_VOEvent as decode
+from pyfrbcatdb import exportCatalogue
+from pyfrbcatdb import writeColumnar
+from pyfrbcatdb import writeCSV
+from tests.ingest_base import ingesttest
+from tests.voevent_variants import write_variants
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+class exporttest(ingesttest):
+    def setUp(self):
+        ingesttest.setUp(self)
+        self.CSV = os.path.join(self.tmpdir, 'frbcat.csv')
+
+    def write(self, **kwargs):
+        return writeCSV.writeCSV(self.CSV, self.dbName, self.dbHost,
+                                 self.dbPort, self.dbUser, self.dbPassword,
+                                 self.logfile, **kwargs)
+
+    def version(self):
+        self.cursor.execute("SELECT version FROM catalogue_version")
+        version = self.cursor.fetchone()[0]
+        self.connection.rollback()
+        return version
+
+    def test_01_unchanged(self):
+        '''
+        The CSV file is only written again when the catalogue changed,
+        or when forced
+        '''
+        self.assertTrue(self.write().written)
+        with open(self.CSV + '.version') as f:
+            self.assertEqual(self.version(), int(f.read()))
+        mtime = os.stat(self.CSV).st_mtime_ns
+        self.assertFalse(self.write().written)
+        self.assertEqual(mtime, os.stat(self.CSV).st_mtime_ns)
+        self.assertTrue(self.write(force=True).written)
+        voevent, ivorn, name = write_variants(self.tmpdir, 1)[0]
+        decode.decode_VOEvent(voevent, self.dbName, self.dbHost,
+                              self.dbPort, self.dbUser, self.dbPassword,
+                              self.logfile)
+        self.assertTrue(self.write().written)
+        with open(self.CSV) as f:
+            self.assertIn(ivorn, f.read())
+        # a missing CSV file is always written
+        os.remove(self.CSV)
+        self.assertTrue(self.write().written)
+
+    def test_02_version(self):
+        '''
+        The version is bumped once per committed transaction that
+        changes the public catalogue
+        '''
+        version = self.version()
+        self.cursor.execute("SELECT rmp_id FROM public_catalogue WHERE "
+                            "dm <> 0 ORDER BY rmp_id LIMIT 2")
+        ids = [row[0] for row in self.cursor.fetchall()]
+        negate = ("UPDATE radio_measured_params SET dm = -dm WHERE "
+                  "id = ANY(%s)")
+        for idx in range(2):
+            self.cursor.execute(negate, (ids[idx:idx + 1],))
+        self.connection.commit()
+        self.assertEqual(version + 1, self.version())
+        # back to the rows of the catalogue
+        self.cursor.execute(negate, (ids,))
+        self.connection.commit()
+        self.assertEqual(version + 2, self.version())
+        # changes that do not change the catalogue
+        for idx in range(2):
+            self.cursor.execute(negate, (ids,))
+        self.cursor.execute("UPDATE observations SET verified = verified "
+                            "WHERE id = (SELECT min(id) FROM observations)")
+        self.connection.commit()
+        self.cursor.execute(negate, (ids,))
+        self.connection.rollback()
+        self.assertEqual(version + 2, self.version())
+
+    def test_03_compression(self):
+        '''
+        Compressed CSV files have the content of the plain CSV file and
+        no intermediate file is left behind
+        '''
+        self.write()
+        with open(self.CSV, 'rb') as f:
+            plain = f.read()
+        self.CSV += '.gz'
+        self.write()
+        with gzip.open(self.CSV) as f:
+            self.assertEqual(plain, f.read())
+        self.assertLess(os.path.getsize(self.CSV), len(plain))
+        self.assertEqual(['frbcat.csv', 'frbcat.csv.gz',
+                          'frbcat.csv.gz.version', 'frbcat.csv.version'],
+                         sorted(os.listdir(self.tmpdir)))
+
+    @unittest.skipIf(zstandard is None, 'zstandard is not installed')
+    def test_04_zstd(self):
+        '''
+        A CSV file is compressed with zstd by extension or on request
+        '''
+        self.write()
+        with open(self.CSV, 'rb') as f:
+            plain = f.read()
+        self.CSV += '.zst'
+        self.write()
+        with open(self.CSV, 'rb') as f:
+            reader = zstandard.ZstdDecompressor().stream_reader(f)
+            self.assertEqual(plain, reader.read())
+        self.CSV = os.path.join(self.tmpdir, 'catalogue')
+        self.write(compression='zstd')
+        with open(self.CSV, 'rb') as f:
+            reader = zstandard.ZstdDecompressor().stream_reader(f)
+            self.assertEqual(plain, reader.read())
+
+    def write_columnar(self, filename, **kwargs):
+        filename = os.path.join(self.tmpdir, filename)
+        writeColumnar.writeColumnar(filename, self.dbName, self.dbHost,
+                                    self.dbPort, self.dbUser,
+                                    self.dbPassword, self.logfile, **kwargs)
+        return filename
+
+    def public_rows(self):
+        self.write()
+        with open(self.CSV) as f:
+            return len(f.readlines()) - 1
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_05_parquet(self):
+        '''
+        The Parquet file has typed columns and a row group with
+        statistics per chunk of rows, ordered by utc
+        '''
+        rows = self.public_rows()
+        filename = self.write_columnar('frbcat.parquet', chunk_size=2)
+        parquet = pyarrow.parquet.ParquetFile(filename)
+        schema = parquet.schema_arrow
+        self.assertEqual(pyarrow.float64(), schema.field('dm').type)
+        self.assertEqual(pyarrow.int32(), schema.field('rank').type)
+        self.assertEqual(pyarrow.timestamp('us'), schema.field('utc').type)
+        self.assertEqual(pyarrow.string(), schema.field('frb').type)
+        table = parquet.read()
+        self.assertEqual(rows, table.num_rows)
+        self.assertEqual(-(-rows // 2), parquet.num_row_groups)
+        utc = table.column('utc').to_pylist()
+        self.assertEqual(sorted(utc), utc)
+        self.assertNotIn(-1, table.column('width').to_pylist())
+        for idx in range(parquet.num_row_groups):
+            group = parquet.metadata.row_group(idx)
+            for name in ['utc', 'dm']:
+                column = group.column(schema.get_field_index(name))
+                self.assertTrue(column.statistics.has_min_max)
+        self.assertEqual(min(utc), parquet.metadata.row_group(
+            0).column(schema.get_field_index('utc')).statistics.min)
+        # unchanged catalogue
+        self.assertFalse(writeColumnar.writeColumnar(
+            filename, self.dbName, self.dbHost, self.dbPort, self.dbUser,
+            self.dbPassword, self.logfile).written)
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_06_arrow(self):
+        '''
+        The Arrow IPC file has the rows of the Parquet file
+        '''
+        parquet = pyarrow.parquet.read_table(
+            self.write_columnar('frbcat.parquet', compression=None))
+        arrow = pyarrow.ipc.open_file(self.write_columnar(
+            'frbcat.arrow', compression='lz4', chunk_size=3)).read_all()
+        self.assertTrue(parquet.equals(arrow))
+        with self.assertRaises(ValueError):
+            self.write_columnar('frbcat.txt')
+
+    def export(self, filenames, **kwargs):
+        return exportCatalogue.exportCatalogue(
+            [os.path.join(self.tmpdir, f) for f in filenames], self.dbName,
+            self.dbHost, self.dbPort, self.dbUser, self.dbPassword,
+            self.logfile, **kwargs)
+
+    def test_07_formats(self):
+        '''
+        A single export writes the CSV file of writeCSV, a JSON file and
+        a VOTable with the same rows, and reports the time per file
+        '''
+        self.write()
+        with open(self.CSV, 'rb') as f:
+            plain = f.read()
+        export = self.export(['frbcat.csv.gz', 'frbcat.json',
+                              'frbcat.vot'], chunk_size=2)
+        self.assertEqual(3, len(export.written))
+        self.assertEqual(set(export.written) | {'parse', 'database'},
+                         set(export.timings))
+        self.assertEqual(['frbcat.csv', 'frbcat.csv.gz',
+                          'frbcat.csv.gz.version', 'frbcat.csv.version',
+                          'frbcat.json', 'frbcat.json.version',
+                          'frbcat.vot', 'frbcat.vot.version'],
+                         sorted(os.listdir(self.tmpdir)))
+        with gzip.open(export.written[0]) as f:
+            self.assertEqual(plain, f.read())
+        with open(export.written[1]) as f:
+            rows = json.load(f)
+        table = parse_single_table(export.written[2]).array
+        self.assertEqual(plain.count(b'\n') - 1, len(rows))
+        self.assertEqual(len(rows), len(table))
+        for idx, row in enumerate(rows):
+            self.assertIsInstance(row['dm'], (int, float))
+            self.assertIsInstance(row['rank'], int)
+            self.assertIn('T', row['utc'])
+            self.assertNotEqual(-1, row['width'])
+            self.assertEqual(row['voevent_ivorn'],
+                             table['voevent_ivorn'][idx])
+            self.assertEqual(row['dm'], table['dm'][idx])
+            self.assertEqual(row['utc'], table['utc'][idx])
+            self.assertEqual(row['width'] is None,
+                             bool(table['width'].mask[idx]))
+
+    def test_08_unchanged(self):
+        '''
+        Only the files of an older catalogue version are written again
+        '''
+        filenames = ['frbcat.json', 'frbcat.votable']
+        self.assertEqual(2, len(self.export(filenames).written))
+        self.assertEqual([], self.export(filenames).written)
+        export = self.export(filenames + ['frbcat.csv'])
+        self.assertEqual([self.CSV], export.written)
+        self.assertEqual(3, len(self.export(filenames + ['frbcat.csv'],
+                                            force=True).written))
+        with self.assertRaises(ValueError):
+            self.export(['frbcat.txt'])
+
+    def test_09_empty_strings(self):
+        '''
+        Empty strings are exported as empty strings and NULL as null
+        '''
+        self.cursor.execute("SELECT rop_id, voevent_ivorn, receiver, backend "
+                            "FROM public_catalogue ORDER BY rmp_id LIMIT 2")
+        rows = self.cursor.fetchall()
+        update = ("UPDATE radio_observations_params SET receiver = %s, "
+                  "backend = %s WHERE id = %s")
+        self.cursor.execute(update, ('', 'a,"b', rows[0][0]))
+        self.cursor.execute(update, (None, '', rows[1][0]))
+        self.connection.commit()
+        try:
+            export = self.export(['frbcat.json'], force=True)
+        finally:
+            for rop_id, ivorn, receiver, backend in rows:
+                self.cursor.execute(update, (receiver, backend, rop_id))
+            self.connection.commit()
+        with open(export.written[0]) as f:
+            exported = dict((row['voevent_ivorn'], row)
+                            for row in json.load(f))
+        self.assertEqual(('', 'a,"b'), (exported[rows[0][1]]['receiver'],
+                                        exported[rows[0][1]]['backend']))
+        self.assertEqual((None, ''), (exported[rows[1][1]]['receiver'],
+                                      exported[rows[1][1]]['backend']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+from pyfrbcatdb import backfill_VOEvent as backfill
+from pyfrbcatdb import batch_VOEvent as batch
+from tests.ingest_base import ingesttest
+from tests.voevent_variants import write_variants
+
+
+class backfilltest(ingesttest):
+    def scenario(self):
+        '''
+        Write detections, events of an FRB with notes, a followup, a
+        supersedes, a retraction, later events of the superseded FRB, a
+        broken file and a duplicate. Return the files and FRB names.
+        '''
+        det = write_variants(self.tmpdir, 3, prefix='FRBFILL')
+        notes = write_variants(self.tmpdir, 2, template='Notes_unitTest1.xml',
+                               name=det[0][2])
+        follow = write_variants(self.tmpdir, 1,
+                                template='Subsequent_unitTest1.xml',
+                                cite=det[1][1], name=det[1][2])
+        sup = write_variants(self.tmpdir, 1,
+                             template='Confirmation_unitTest1.xml',
+                             cite=det[2][1], name=det[2][2])
+        retract = write_variants(self.tmpdir, 1,
+                                 template='Retraction_unitTest1.xml',
+                                 cite=follow[0][1])
+        later = write_variants(self.tmpdir, 2, name=det[2][2])
+        broken = os.path.join(self.tmpdir, 'broken.xml')
+        with open(broken, 'w') as f:
+            f.write('<VOEvent')
+        files = [v[0] for v in det + notes + follow + sup + retract + later]
+        files += [broken, det[0][0]]
+        return files, [v[2] for v in det]
+
+    def get_rows(self, names):
+        sql = """select a.ivorn, f.utc, f.private, o.telescope, o.utc,
+                 o.detected, o.verified, rop.settings_id, rop.raj, rop.decj,
+                 rop.beam, rop.bandwidth, rmp.dm, rmp.snr, rmp.width,
+                 rmp.flux, rmp.dm_index_error, rmp.rank, rmp.validation,
+                 (select array_agg((note, author, last_modified) order by id)
+                  from radio_observations_params_notes where rop_id=rop.id),
+                 (select array_agg((note, author, last_modified) order by id)
+                  from radio_measured_params_notes where rmp_id=rmp.id),
+                 (select last_rank from frb_ranks where frb_id=f.id)
+                 from frbs f join observations o on o.frb_id=f.id
+                 join radio_observations_params rop on rop.obs_id=o.id
+                 join radio_measured_params rmp on rmp.rop_id=rop.id
+                 join authors a on rmp.author_id=a.id
+                 where f.name = %s order by o.utc, rmp.rank"""
+        rows = []
+        for name in names:
+            self.cursor.execute(sql, (name,))
+            rows.append(self.cursor.fetchall())
+        self.connection.rollback()
+        return rows
+
+    def test_01(self):
+        '''
+        A backfill gives the same rows as a sequential ingest
+        '''
+        files, names = self.scenario()
+        ingest = batch.batch_VOEvent(files, self.dbName, self.dbHost,
+                                     self.dbPort, self.dbUser,
+                                     self.dbPassword, self.logfile,
+                                     batch_size=len(files))
+        sequential = self.get_rows(names)
+        files, names = self.scenario()
+        fill = backfill.backfill_VOEvent(files, self.dbName, self.dbHost,
+                                         self.dbPort, self.dbUser,
+                                         self.dbPassword, self.logfile)
+        self.assertEqual(sequential, self.get_rows(names))
+        self.assertEqual([3, 2, 3], [len(rows) for rows in sequential])
+        for key in ['events', 'added', 'skipped', 'failed']:
+            self.assertEqual(ingest.batch_stats[0][key],
+                             fill.batch_stats[0][key])
+        # all new and followup events except the duplicate are merged
+        self.assertEqual(8, fill.batch_stats[0]['merged'])
+
+    def test_02_fallback(self):
+        '''
+        Events of a set-based merge that fails are applied one by one
+        '''
+        det = write_variants(self.tmpdir, 3, prefix='FRBFILL')
+        with open(det[1][0]) as f:
+            xml = f.read()
+        with open(det[1][0], 'w') as f:
+            # beam is a VARCHAR(8), the event can not be inserted
+            f.write(xml.replace('name="beam" value="1"',
+                                'name="beam" value="123456789"'))
+        fill = backfill.backfill_VOEvent([v[0] for v in det], self.dbName,
+                                         self.dbHost, self.dbPort,
+                                         self.dbUser, self.dbPassword,
+                                         self.logfile)
+        self.assertEqual(2, fill.batch_stats[0]['added'])
+        self.assertEqual(1, fill.batch_stats[0]['failed'])
+        self.assertEqual(0, fill.batch_stats[0]['merged'])
+        self.cursor.execute("select count(*) from frbs where name = ANY(%s)",
+                            ([v[2] for v in det],))
+        self.assertEqual(2, self.cursor.fetchone()[0])
@@ -0,0 +1,37 @@
+import os
+import shutil
+import tempfile
+import unittest
+import psycopg2
+from pyfrbcatdb import dbase as dbase
+
+
+class ingesttest(unittest.TestCase):
+    '''
+    Base class of the ingest tests: settings of the test database, a
+    connection with a plain cursor and a temporary directory for the
+    generated VOEvents.
+    '''
+    def setUp(self):
+        self.dbName = 'frbcat'
+        self.dbUser = 'postgres'
+        self.dbPort = None
+        self.logfile = 'frbcatdb.log'
+        if 'TRAVIS' in os.environ:
+            self.dbHost = None
+            self.dbPassword = None
+        else:
+            self.dbHost = 'localhost'
+            self.dbPassword = 'None'
+        self.connection, self.cursor = self.connect()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.connection.close()
+        shutil.rmtree(self.tmpdir)
+
+    def connect(self, dbCursor=psycopg2.extensions.cursor):
+        return dbase.connectToDB(
+            dbName=self.dbName, dbUser=self.dbUser,
+            dbPassword=self.dbPassword, dbHost=self.dbHost,
+            dbPort=self.dbPort, dbCursor=dbCursor)
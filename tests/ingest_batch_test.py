@@ -0,0 +1,107 @@
+import os
+import unittest
+from unittest import mock
+from pyfrbcatdb import batch_VOEvent as batch
+from pyfrbcatdb.validation import validator
+from tests.ingest_base import ingesttest
+from tests.voevent_variants import write_variants
+
+
+class batchtest(ingesttest):
+    def count_frbs(self, names):
+        self.cursor.execute("select count(*) from frbs where name = ANY(%s)",
+                            (names,))
+        return self.cursor.fetchone()[0]
+
+    def test_01(self):
+        '''
+        Ingest new events in batches over one connection, a broken
+        file and a duplicate event should only roll back themselves
+        '''
+        variants = write_variants(self.tmpdir, 5)
+        broken = os.path.join(self.tmpdir, 'broken.xml')
+        with open(broken, 'w') as f:
+            f.write('<VOEvent')
+        files = [v[0] for v in variants]
+        files = files[:2] + [broken] + files[2:] + [files[0]]
+        ingest = batch.batch_VOEvent(files, self.dbName, self.dbHost,
+                                     self.dbPort, self.dbUser,
+                                     self.dbPassword, self.logfile,
+                                     batch_size=3)
+        self.assertEqual(5, self.count_frbs([v[2] for v in variants]))
+        self.assertEqual(3, len(ingest.batch_stats))
+        self.assertEqual(7, sum(s['events'] for s in ingest.batch_stats))
+        self.assertEqual(5, sum(s['added'] for s in ingest.batch_stats))
+        self.assertEqual(1, sum(s['skipped'] for s in ingest.batch_stats))
+        self.assertEqual(1, sum(s['failed'] for s in ingest.batch_stats))
+
+    def test_02_validation(self):
+        '''
+        The validation tier of each event is recorded, only trusted
+        sources skip validation
+        '''
+        trusted = write_variants(self.tmpdir, 2)
+        other = write_variants(self.tmpdir, 1)
+        prefix = trusted[0][1].split('#')[0]
+        batch.batch_VOEvent([v[0] for v in trusted + other], self.dbName,
+                            self.dbHost, self.dbPort, self.dbUser,
+                            self.dbPassword, self.logfile,
+                            validator=validator('off', [prefix]))
+        self.cursor.execute("select voevent_ivorn, validation from "
+                            "radio_measured_params where voevent_ivorn = "
+                            "ANY(%s)", ([v[1] for v in trusted + other],))
+        tiers = dict(self.cursor.fetchall())
+        self.assertEqual({trusted[0][1]: 'off', trusted[1][1]: 'off',
+                          other[0][1]: 'full'}, tiers)
+
+    def test_03_commit_failure(self):
+        '''
+        Events of a batch that cannot be committed are counted as failed
+        '''
+        variants = write_variants(self.tmpdir, 2)
+
+        def commit_failure(connection, cursor):
+            connection.rollback()
+            return False
+        with mock.patch.object(batch.dbase, 'commitToDB', commit_failure):
+            ingest = batch.batch_VOEvent(
+                [v[0] for v in variants], self.dbName, self.dbHost,
+                self.dbPort, self.dbUser, self.dbPassword, self.logfile)
+        self.assertEqual(0, self.count_frbs([v[2] for v in variants]))
+        self.assertEqual(0, ingest.batch_stats[0]['added'])
+        self.assertEqual(2, ingest.batch_stats[0]['failed'])
+
+    def test_04_precheck(self):
+        '''
+        Events that are already in the database are skipped without a
+        full parse, supersedes events are still applied
+        '''
+        det = write_variants(self.tmpdir, 3)
+        follow = write_variants(self.tmpdir, 1,
+                                template='Subsequent_unitTest1.xml',
+                                cite=det[0][1], name=det[0][2])
+        sup = write_variants(self.tmpdir, 1,
+                             template='Confirmation_unitTest1.xml',
+                             cite=det[1][1], name=det[1][2])
+        files = [v[0] for v in det + follow + sup]
+        batch.batch_VOEvent(files, self.dbName, self.dbHost, self.dbPort,
+                            self.dbUser, self.dbPassword, self.logfile)
+        new = write_variants(self.tmpdir, 1)
+        parse_VOEvent = batch.batch_VOEvent.parse_VOEvent
+        parsed = []
+
+        def parse(ingest, voevent):
+            parsed.append(voevent)
+            return parse_VOEvent(ingest, voevent)
+        with mock.patch.object(batch.batch_VOEvent, 'parse_VOEvent', parse):
+            ingest = batch.batch_VOEvent(
+                files + [new[0][0]], self.dbName, self.dbHost, self.dbPort,
+                self.dbUser, self.dbPassword, self.logfile, batch_size=4)
+        self.assertEqual([sup[0][0], new[0][0]], parsed)
+        self.assertEqual(4, sum(s['skipped'] for s in ingest.batch_stats))
+        self.assertEqual(2, sum(s['added'] for s in ingest.batch_stats))
+        self.assertEqual(0, sum(s['failed'] for s in ingest.batch_stats))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import psycopg2
+from pyfrbcatdb import dbase as dbase
+from pyfrbcatdb import batch_VOEvent as batch
+from pyfrbcatdb.FRBCat import identity_cache
+from pyfrbcatdb.FRBCat import IDENTITY_CACHE
+from tests.ingest_base import ingesttest
+from tests.voevent_variants import write_variants
+
+
+class cachetest(ingesttest):
+    def test_01_lru(self):
+        '''
+        Pending entries are dropped on rollback, committed entries are
+        evicted least recently used first
+        '''
+        cache = identity_cache(maxsize=2)
+        cache.set(('frbs', 'a'), 1)
+        mark = cache.savepoint()
+        cache.set(('frbs', 'b'), 2)
+        cache.rollback(mark)
+        self.assertEqual(1, cache.get(('frbs', 'a')))
+        self.assertIsNone(cache.get(('frbs', 'b')))
+        cache.commit()
+        cache.set(('frbs', 'b'), 2)
+        cache.set(('frbs', 'c'), 3)
+        cache.commit()
+        self.assertIsNone(cache.get(('frbs', 'a')))
+        self.assertEqual(3, cache.get(('frbs', 'c')))
+        cache.rollback()
+        self.assertEqual(2, cache.get(('frbs', 'b')))
+        self.assertEqual({'hits': 3, 'misses': 2, 'size': 2}, cache.stats())
+
+    def test_02_batch(self):
+        '''
+        Events of the same author hit the cache, ids of rolled back
+        events do not stay in the cache
+        '''
+        IDENTITY_CACHE.clear()
+        variants = write_variants(self.tmpdir, 3, prefix='FRBCACHE')
+        files = [v[0] for v in variants] + [variants[0][0]]
+        ingest = batch.batch_VOEvent(files, self.dbName, self.dbHost,
+                                     self.dbPort, self.dbUser,
+                                     self.dbPassword, self.logfile,
+                                     batch_size=10)
+        stats = ingest.batch_stats[0]
+        self.assertEqual(3, stats['added'])
+        self.assertEqual(1, stats['skipped'])
+        self.assertGreater(stats['cache_hits'], 0)
+        self.assertEqual(IDENTITY_CACHE.hits, stats['cache_hits'])
+        connection, cursor = dbase.connectToDB(
+            dbName=self.dbName, dbUser=self.dbUser,
+            dbPassword=self.dbPassword, dbHost=self.dbHost,
+            dbPort=self.dbPort, dbCursor=psycopg2.extensions.cursor)
+        try:
+            for entry, value in IDENTITY_CACHE.entries.items():
+                table, key = entry[0], entry[1:]
+                if table == 'frbs':
+                    cursor.execute("SELECT id FROM frbs WHERE name = %s",
+                                   key)
+                elif table == 'authors':
+                    cursor.execute("SELECT id FROM authors WHERE ivorn = %s",
+                                   key)
+                else:
+                    cursor.execute("SELECT id FROM observations WHERE "
+                                   "frb_id = %s AND telescope = %s AND "
+                                   "utc = %s", key)
+                self.assertEqual(value, cursor.fetchone()[0])
+        finally:
+            connection.close()
+        self.assertFalse(IDENTITY_CACHE.pending)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+from pyfrbcatdb import decode_VOEvent as decode
+from tests.ingest_base import ingesttest
+from tests.voevent_variants import write_variants
+
+
+class ctetest(ingesttest):
+    def ingest(self, cte):
+        '''
+        Ingest a detection, supersedes, followup, retraction and a
+        duplicate of the detection, return the FRB name
+        '''
+        det = write_variants(self.tmpdir, 1)[0]
+        conf = write_variants(self.tmpdir, 1,
+                              template='Confirmation_unitTest1.xml',
+                              cite=det[1], name=det[2])[0]
+        sub = write_variants(self.tmpdir, 1,
+                             template='Subsequent_unitTest1.xml',
+                             cite=det[1], name=det[2])[0]
+        notes = write_variants(self.tmpdir, 1,
+                               template='Notes_unitTest1.xml',
+                               name=det[2])[0]
+        retract = write_variants(self.tmpdir, 1,
+                                 template='Retraction_unitTest1.xml',
+                                 cite=sub[1])[0]
+        for voevent in [det, conf, sub, notes, retract, det]:
+            decode.decode_VOEvent(voevent[0], self.dbName, self.dbHost,
+                                  self.dbPort, self.dbUser, self.dbPassword,
+                                  self.logfile, cte=cte)
+        return det[2]
+
+    def get_rows(self, name):
+        sql = """select a.ivorn, f.utc, o.telescope, o.utc, o.detected,
+                 o.verified, rop.settings_id, rop.raj, rop.decj, rop.beam,
+                 rop.bandwidth, rmp.dm, rmp.snr, rmp.width, rmp.flux,
+                 rmp.dm_index_error, rmp.rank,
+                 (select array_agg(note order by note)
+                  from radio_observations_params_notes where rop_id=rop.id),
+                 (select array_agg(note order by note)
+                  from radio_measured_params_notes where rmp_id=rmp.id)
+                 from frbs f join observations o on o.frb_id=f.id
+                 join radio_observations_params rop on rop.obs_id=o.id
+                 join radio_measured_params rmp on rmp.rop_id=rop.id
+                 join authors a on rmp.author_id=a.id
+                 where f.name = %s order by o.utc, rmp.rank"""
+        self.cursor.execute(sql, (name,))
+        return self.cursor.fetchall()
+
+    def test_01(self):
+        '''
+        Inserting with a single CTE statement should give the same rows
+        as inserting with a statement per table
+        '''
+        classic = self.get_rows(self.ingest(False))
+        cte = self.get_rows(self.ingest(True))
+        self.assertEqual(3, len(classic))
+        self.assertEqual(classic, cte)
+        for row in cte:
+            # settings_id is telescope;utc;raj;decj
+            self.assertTrue(row[6].startswith(row[2] + ';'))
+            self.assertTrue(row[6].endswith(';' + row[7] + ';' + row[8]))
+
+
+if __name__ == '__main__':
+    unittest.main()
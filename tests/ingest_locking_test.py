@@ -0,0 +1,189 @@
+import multiprocessing
+import random
+import threading
+import time
+import unittest
+from pyfrbcatdb import dbase
+from pyfrbcatdb import decode_VOEvent as decode
+from pyfrbcatdb import queue_VOEvent as queue
+from tests.ingest_base import ingesttest
+from tests.voevent_variants import write_variants
+
+
+def queue_worker(settings, batch_size, cte):
+    queue.queue_VOEvent(*settings, batch_size=batch_size, retry_delay=0,
+                        once=True, cte=cte)
+
+
+def event_writer(settings, voevents, cte):
+    for voevent in voevents:
+        decode.decode_VOEvent(voevent, *settings, cte=cte)
+
+
+class lockingtest(ingesttest):
+    '''
+    Stress tests of concurrent writers on the same FRBs. The stress
+    tests run the writers in separate processes, as the identity cache
+    is per process.
+    '''
+    def setUp(self):
+        ingesttest.setUp(self)
+        self.cursor.execute("DELETE FROM ingest_jobs")
+        self.connection.commit()
+
+    def repeaters(self, num, events):
+        '''
+        Write events followups for each of num FRBs, in random order.
+        '''
+        variants = []
+        for idx in range(num):
+            name = 'FRBLOCK{}_{}'.format(random.getrandbits(32), idx)
+            variants += write_variants(self.tmpdir, events, name=name)
+        random.shuffle(variants)
+        return variants
+
+    def assertRanks(self, variants):
+        '''
+        Every FRB is in the frbs table once and its events have the
+        ranks 1..n
+        '''
+        names = sorted(set(v[2] for v in variants))
+        self.cursor.execute("SELECT name, count(*) FROM frbs WHERE name = "
+                            "ANY(%s) GROUP BY name ORDER BY name", (names,))
+        self.assertEqual([(name, 1) for name in names],
+                         [tuple(row) for row in self.cursor.fetchall()])
+        for name in names:
+            self.cursor.execute(
+                "SELECT rmp.rank FROM radio_measured_params rmp "
+                "JOIN radio_observations_params rop ON rmp.rop_id = rop.id "
+                "JOIN observations o ON rop.obs_id = o.id "
+                "JOIN frbs f ON o.frb_id = f.id WHERE f.name = %s "
+                "ORDER BY rmp.rank", (name,))
+            ranks = [row[0] for row in self.cursor.fetchall()]
+            events = len([v for v in variants if v[2] == name])
+            self.assertEqual(list(range(1, events + 1)), ranks)
+        self.connection.rollback()
+
+    def run_workers(self, target, args):
+        context = multiprocessing.get_context('spawn')
+        settings = (self.dbName, self.dbHost, self.dbPort, self.dbUser,
+                    self.dbPassword, self.logfile)
+        processes = [context.Process(target=target, args=(settings,) + arg)
+                     for arg in args]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(120)
+            self.assertEqual(0, process.exitcode)
+
+    def test_01_queue_workers(self):
+        '''
+        Queue workers ingesting followups of the same FRBs allocate
+        every rank once
+        '''
+        variants = self.repeaters(4, 12)
+        queue.enqueue_VOEvents([v[0] for v in variants], self.dbName,
+                               self.dbHost, self.dbPort, self.dbUser,
+                               self.dbPassword)
+        self.run_workers(queue_worker, [(3, bool(idx % 2))
+                                        for idx in range(8)])
+        self.cursor.execute("SELECT status, count(*) FROM ingest_jobs "
+                            "GROUP BY status")
+        self.assertEqual([('done', len(variants))],
+                         [tuple(row) for row in self.cursor.fetchall()])
+        self.connection.rollback()
+        self.assertRanks(variants)
+
+    def test_02_single_events(self):
+        '''
+        Writers of single events, each in its own transaction, allocate
+        every rank once
+        '''
+        variants = self.repeaters(3, 10)
+        self.run_workers(event_writer, [
+            ([v[0] for v in variants[idx::6]], bool(idx % 2))
+            for idx in range(6)])
+        self.assertRanks(variants)
+
+    def test_03_parallel_frbs(self):
+        '''
+        An event waits for a writer holding its FRB, events of other
+        FRBs go ahead
+        '''
+        locked, other = self.repeaters(2, 1)
+        queue.enqueue_VOEvents([locked[0], other[0]], self.dbName,
+                               self.dbHost, self.dbPort, self.dbUser,
+                               self.dbPassword)
+        dbase.advisory_lock(self.cursor, 'frbs', [locked[2]])
+
+        def worker(idx):
+            queue.queue_VOEvent(self.dbName, self.dbHost, self.dbPort,
+                                self.dbUser, self.dbPassword, self.logfile,
+                                batch_size=1, once=True)
+        threads = [threading.Thread(target=worker, args=(idx,))
+                   for idx in range(2)]
+        for thread in threads:
+            thread.start()
+        connection, cursor = self.connect()
+        deadline = time.time() + 20
+        status = {}
+        while time.time() < deadline and status.get(other[2]) != 'done':
+            cursor.execute("SELECT name, status FROM ingest_jobs")
+            status = dict(cursor.fetchall())
+            status = {name: status.get(voevent.split('/')[-1]) for
+                      voevent, ivorn, name in [locked, other]}
+            connection.rollback()
+            time.sleep(0.05)
+        self.assertEqual({locked[2]: 'running', other[2]: 'done'}, status)
+        # release the lock
+        self.connection.rollback()
+        for thread in threads:
+            thread.join(20)
+            self.assertFalse(thread.is_alive())
+        connection.close()
+        self.assertRanks([locked, other])
+
+    def test_04_lock_order(self):
+        '''
+        Writers of a new author on the per-table and the CTE path lock the
+        FRB before the author and do not deadlock
+        '''
+        author = 'ivo://frbcatdb.test/author{}'.format(random.getrandbits(32))
+        variants = self.repeaters(1, 2)
+        for voevent, ivorn, name in variants:
+            with open(voevent) as f:
+                xml = f.read()
+            with open(voevent, 'w') as f:
+                f.write(xml.replace('ivo://au.csiro.parkes.superb', author))
+        # both writers wait for the FRB, the CTE writer first so it gets
+        # the FRB first
+        dbase.advisory_lock(self.cursor, 'frbs', [variants[0][2]])
+        settings = (self.dbName, self.dbHost, self.dbPort, self.dbUser,
+                    self.dbPassword, self.logfile)
+        connection, cursor = self.connect()
+        threads = []
+        for voevent, cte in [(variants[0][0], True),
+                             (variants[1][0], False)]:
+            threads.append(threading.Thread(target=event_writer, args=(
+                settings, [voevent], cte)))
+            threads[-1].start()
+            deadline = time.time() + 20
+            waiting = 0
+            while time.time() < deadline and waiting < len(threads):
+                cursor.execute("SELECT count(*) FROM pg_locks WHERE "
+                               "locktype = 'advisory' AND NOT granted")
+                waiting = cursor.fetchone()[0]
+                connection.rollback()
+                time.sleep(0.05)
+            self.assertEqual(len(threads), waiting)
+        connection.close()
+        # release the lock
+        self.connection.rollback()
+        for thread in threads:
+            thread.join(20)
+            self.assertFalse(thread.is_alive())
+        self.assertRanks(variants)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+import psycopg2
+import psycopg2.extras
+from pyfrbcatdb import decode_VOEvent as decode
+from pyfrbcatdb.FRBCat import FRBCat_add
+from pyfrbcatdb.FRBCat import FRBCat_add_cte
+from tests.ingest_base import ingesttest
+from tests.voevent_variants import write_variants
+
+
+class notestest(ingesttest):
+    def count_notes(self, name):
+        sql = """select (select count(*) from radio_observations_params_notes n
+                         join radio_observations_params rop on n.rop_id=rop.id
+                         join observations o on rop.obs_id=o.id
+                         join frbs f on o.frb_id=f.id where f.name=%s),
+                        (select count(*) from radio_measured_params_notes n
+                         join radio_measured_params rmp on n.rmp_id=rmp.id
+                         join radio_observations_params rop on
+                          rmp.rop_id=rop.id
+                         join observations o on rop.obs_id=o.id
+                         join frbs f on o.frb_id=f.id where f.name=%s)"""
+        self.cursor.execute(sql, (name, name))
+        counts = self.cursor.fetchone()
+        self.connection.rollback()
+        return counts
+
+    def test_01_reingest(self):
+        '''
+        Re-ingesting an event does not add duplicate notes
+        '''
+        voevent, ivorn, name = write_variants(
+            self.tmpdir, 1, template='Notes_unitTest1.xml',
+            prefix='FRBNOTES')[0]
+        parser = decode.decode_VOEvent(voevent, self.dbName, self.dbHost,
+                                       self.dbPort, self.dbUser,
+                                       self.dbPassword, self.logfile)
+        counts = self.count_notes(name)
+        self.assertTrue(counts[0] > 0 and counts[1] > 0)
+        for add in [FRBCat_add, FRBCat_add_cte]:
+            mapping, event_type = parser.parse_VOEvent(voevent)
+            connection, cursor = self.connect(psycopg2.extras.DictCursor)
+            add(connection, cursor, mapping,
+                'supersedes').add_VOEvent_to_FRBCat()
+            self.assertEqual(counts, self.count_notes(name))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+from pyfrbcatdb import parallel_VOEvent as parallel
+from tests.ingest_base import ingesttest
+from tests.voevent_variants import write_variants
+
+
+class paralleltest(ingesttest):
+    def test_01(self):
+        '''
+        Parse events in worker processes, a retraction listed before
+        the event it cites should be written after it
+        '''
+        variants = write_variants(self.tmpdir, 6)
+        retraction = write_variants(self.tmpdir, 1,
+                                    template='Retraction_unitTest1.xml',
+                                    prefix='RETRACT', cite=variants[3][1])
+        files = [retraction[0][0]] + [v[0] for v in variants]
+        ingest = parallel.parallel_VOEvent(files, self.dbName, self.dbHost,
+                                           self.dbPort, self.dbUser,
+                                           self.dbPassword, self.logfile,
+                                           batch_size=4, processes=2)
+        self.assertEqual(7, sum(s['added'] for s in ingest.batch_stats))
+        self.cursor.execute(
+            "select f.name, o.detected from frbs f join observations o "
+            "on o.frb_id = f.id where f.name = ANY(%s) order by f.name",
+            ([v[2] for v in variants],))
+        detected = dict(self.cursor.fetchall())
+        self.assertEqual(6, len(detected))
+        self.assertFalse(detected[variants[3][2]])
+        self.assertTrue(detected[variants[0][2]])
+
+
+if __name__ == '__main__':
+    unittest.main()
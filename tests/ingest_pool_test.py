@@ -0,0 +1,93 @@
+import os
+import unittest
+import psycopg2
+import psycopg2.pool
+from pyfrbcatdb import batch_VOEvent as batch
+from pyfrbcatdb import dbase
+from pyfrbcatdb import decode_VOEvent as decode
+from pyfrbcatdb import writeCSV
+from tests.ingest_base import ingesttest
+from tests.voevent_variants import write_variants
+
+
+class pooltest(ingesttest):
+    def setUp(self):
+        ingesttest.setUp(self)
+        self.pool = dbase.connection_pool(
+            self.dbName, self.dbUser, self.dbPassword, self.dbHost,
+            self.dbPort, minconn=1, maxconn=2, timeout=0.5)
+
+    def tearDown(self):
+        self.pool.close()
+        ingesttest.tearDown(self)
+
+    def backend(self, pool):
+        with dbase.lend(pool) as (connection, cursor):
+            cursor.execute("SELECT pg_backend_pid()")
+            return cursor.fetchone()[0]
+
+    def test_01_reuse(self):
+        '''
+        Ingest and export of one run share a pooled connection
+        '''
+        variants = write_variants(self.tmpdir, 3)
+        pid = self.backend(self.pool)
+        decode.decode_VOEvent(variants[0][0], self.dbName, self.dbHost,
+                              self.dbPort, self.dbUser, self.dbPassword,
+                              self.logfile, pool=self.pool)
+        batch.batch_VOEvent([v[0] for v in variants[1:]], self.dbName,
+                            self.dbHost, self.dbPort, self.dbUser,
+                            self.dbPassword, self.logfile, pool=self.pool)
+        CSV = os.path.join(self.tmpdir, 'frbcat.csv')
+        writeCSV.writeCSV(CSV, self.dbName, self.dbHost, self.dbPort,
+                          self.dbUser, self.dbPassword, self.logfile,
+                          pool=self.pool)
+        self.assertTrue(os.path.exists(CSV))
+        self.assertEqual(pid, self.backend(self.pool))
+        self.assertEqual(1, self.pool.opened)
+        self.cursor.execute("select count(*) from frbs where name = ANY(%s)",
+                            ([v[2] for v in variants],))
+        self.assertEqual(3, self.cursor.fetchone()[0])
+
+    def test_02_connection(self):
+        '''
+        An injected connection is used and left open
+        '''
+        CSV = os.path.join(self.tmpdir, 'frbcat.csv')
+        writeCSV.writeCSV(CSV, None, None, None, None, None, self.logfile,
+                          pool=self.connection)
+        self.assertTrue(os.path.exists(CSV))
+        self.assertFalse(self.connection.closed)
+        self.assertEqual(psycopg2.extensions.TRANSACTION_STATUS_IDLE,
+                         self.connection.get_transaction_status())
+
+    def test_03_health_check(self):
+        '''
+        A broken idle connection is replaced before it is lent
+        '''
+        self.pool.check_interval = 0
+        pid = self.backend(self.pool)
+        self.cursor.execute("SELECT pg_terminate_backend(%s)", (pid,))
+        self.connection.commit()
+        self.assertNotEqual(pid, self.backend(self.pool))
+        self.assertEqual(1, self.pool.replaced)
+
+    def test_04_size(self):
+        '''
+        The pool opens at most maxconn connections and rolls back the
+        transaction of a returned connection
+        '''
+        with self.pool.connection() as (first, cursor):
+            cursor.execute("SELECT 1")
+            with self.pool.connection() as (second, cursor):
+                self.assertIsNot(first, second)
+                with self.assertRaises(psycopg2.pool.PoolError):
+                    with self.pool.connection():
+                        pass
+        self.assertEqual(2, self.pool.size)
+        self.assertEqual(psycopg2.extensions.TRANSACTION_STATUS_IDLE,
+                         first.get_transaction_status())
+
+
+if __name__ == '__main__':
+    unittest.main()
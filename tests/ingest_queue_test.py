@@ -0,0 +1,130 @@
+import threading
+import unittest
+from unittest import mock
+from pyfrbcatdb import queue_VOEvent as queue
+from tests.ingest_base import ingesttest
+from tests.voevent_variants import write_variants
+
+
+class queuetest(ingesttest):
+    def setUp(self):
+        ingesttest.setUp(self)
+        self.cursor.execute("DELETE FROM ingest_jobs")
+        self.connection.commit()
+
+    def count_frbs(self, names):
+        self.cursor.execute("select count(*) from frbs where name = ANY(%s)",
+                            (names,))
+        count = self.cursor.fetchone()[0]
+        self.connection.rollback()
+        return count
+
+    def jobs(self):
+        self.cursor.execute("SELECT name, status, attempts FROM ingest_jobs "
+                            "ORDER BY id")
+        jobs = self.cursor.fetchall()
+        self.connection.rollback()
+        return jobs
+
+    def enqueue(self, voevents):
+        return queue.enqueue_VOEvents(voevents, self.dbName, self.dbHost,
+                                      self.dbPort, self.dbUser,
+                                      self.dbPassword)
+
+    def run_worker(self, **kwargs):
+        return queue.queue_VOEvent(self.dbName, self.dbHost, self.dbPort,
+                                   self.dbUser, self.dbPassword,
+                                   self.logfile, once=True, **kwargs)
+
+    def test_01_workers(self):
+        '''
+        Concurrent workers ingest every queued VOEvent exactly once,
+        VOEvents that fail on their last attempt are marked failed
+        '''
+        variants = write_variants(self.tmpdir, 8)
+        broken = write_variants(self.tmpdir, 1, prefix='BROKEN')[0][0]
+        with open(broken) as f:
+            xml = f.read()
+        with open(broken, 'w') as f:
+            f.write(xml.replace('<Who>', '<Who><Unknown/>'))
+        self.enqueue([v[0] for v in variants[:4]] + [broken] +
+                     [v[0] for v in variants[4:]])
+        workers = [threading.Thread(target=self.run_worker, kwargs={
+            'batch_size': 2, 'max_attempts': 1}) for idx in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(60)
+        self.assertEqual(8, self.count_frbs([v[2] for v in variants]))
+        jobs = self.jobs()
+        self.assertEqual(['done'] * 4 + ['failed'] + ['done'] * 4,
+                         [job[1] for job in jobs])
+        self.assertEqual([1] * 9, [job[2] for job in jobs])
+
+    def test_02_visibility_timeout(self):
+        '''
+        Jobs of a stopped worker are claimed again after their visibility
+        timeout, unless they have no attempts left
+        '''
+        variants = write_variants(self.tmpdir, 2)
+        ids = self.enqueue([v[0] for v in variants])
+        # both jobs were claimed by a worker that stopped, the second on
+        # its last attempt
+        self.cursor.execute("UPDATE ingest_jobs SET status = 'running', "
+                            "attempts = CASE WHEN id = %s THEN 1 ELSE 2 END, "
+                            "visible_at = now() - interval '1 second'",
+                            (ids[0],))
+        self.connection.commit()
+        self.run_worker(max_attempts=2)
+        self.assertEqual([(variants[0][0].split('/')[-1], 'done', 2),
+                          (variants[1][0].split('/')[-1], 'failed', 2)],
+                         [tuple(job) for job in self.jobs()])
+        self.assertEqual(1, self.count_frbs([v[2] for v in variants]))
+
+    def test_03_retry(self):
+        '''
+        Jobs of a batch that can not be committed are retried without
+        using up an attempt
+        '''
+        variants = write_variants(self.tmpdir, 2)
+        self.enqueue([v[0] for v in variants])
+        commits = []
+
+        def commit_once(connection, cursor):
+            commits.append(1)
+            if len(commits) == 1:
+                connection.rollback()
+                return False
+            connection.commit()
+            return True
+        with mock.patch.object(queue.dbase, 'commitToDB', commit_once):
+            worker = self.run_worker()
+        self.assertEqual(2, self.count_frbs([v[2] for v in variants]))
+        self.assertEqual([('done', 1)] * 2,
+                         [tuple(job[1:]) for job in self.jobs()])
+        self.assertEqual({'done': 2, 'failed': 0, 'retried': 2},
+                         worker.status)
+
+    def test_04_failed(self):
+        '''
+        VOEvents that can not be parsed are failed without a retry, pending
+        jobs without attempts left are failed
+        '''
+        variants = write_variants(self.tmpdir, 2, prefix='FAILED')
+        with open(variants[0][0]) as f:
+            xml = f.read()
+        with open(variants[0][0], 'w') as f:
+            f.write(xml.replace('<Who>', '<Who><Unknown/>'))
+        ids = self.enqueue([v[0] for v in variants])
+        self.cursor.execute("UPDATE ingest_jobs SET attempts = 3 WHERE "
+                            "id = %s", (ids[1],))
+        self.connection.commit()
+        worker = self.run_worker(max_attempts=3)
+        self.assertEqual([('failed', 1), ('failed', 3)],
+                         [tuple(job[1:]) for job in self.jobs()])
+        self.assertEqual({'done': 0, 'failed': 1, 'retried': 0},
+                         worker.status)
+
+
+if __name__ == '__main__':
+    unittest.main()
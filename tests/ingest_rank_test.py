@@ -0,0 +1,81 @@
+import os
+import threading
+import time
+import unittest
+from os.path import dirname, abspath
+from pyfrbcatdb.FRBCat import FRBCat_add
+from tests.ingest_base import ingesttest
+
+
+class ranktest(ingesttest):
+    def setUp(self):
+        ingesttest.setUp(self)
+        self.cursor.execute("SELECT o.frb_id, max(rmp.rank) FROM "
+                            "radio_measured_params rmp JOIN "
+                            "radio_observations_params rop ON "
+                            "rmp.rop_id=rop.id JOIN observations o ON "
+                            "rop.obs_id=o.id GROUP BY o.frb_id "
+                            "ORDER BY o.frb_id LIMIT 1")
+        self.frb_id, self.max_rank = self.cursor.fetchone()
+        self.connection.rollback()
+
+    def tearDown(self):
+        self.cursor.execute("DELETE FROM frb_ranks WHERE frb_id = %s",
+                            (self.frb_id,))
+        self.connection.commit()
+        ingesttest.tearDown(self)
+
+    def allocate(self, connection, cursor):
+        FRBCat = FRBCat_add(connection, cursor, {}, 'new', batch=True)
+        FRBCat.frb_id = self.frb_id
+        return FRBCat.set_rank()
+
+    def test_01_concurrent(self):
+        '''
+        A second ingestor of the same FRB waits for the first one and
+        gets the next rank
+        '''
+        ranks = {}
+        connection, cursor = self.connect()
+
+        def second():
+            ranks['second'] = self.allocate(connection, cursor)
+            connection.commit()
+        try:
+            ranks['first'] = self.allocate(self.connection, self.cursor)
+            thread = threading.Thread(target=second)
+            thread.start()
+            time.sleep(0.2)
+            self.assertNotIn('second', ranks)
+            self.connection.commit()
+            thread.join(10)
+        finally:
+            connection.close()
+        self.assertEqual(self.max_rank + 1, ranks['first'])
+        self.assertEqual(self.max_rank + 2, ranks['second'])
+
+    def test_02_recompute(self):
+        '''
+        Recompute ranks of all events in one pass
+        '''
+        sql = os.path.join(dirname(abspath(__file__)), '..', 'db',
+                           'recompute_ranks.sql')
+        self.cursor.execute("UPDATE radio_measured_params SET rank = 1")
+        with open(sql) as f:
+            self.cursor.execute(f.read())
+        self.cursor.execute(
+            "SELECT o.frb_id, array_agg(rmp.rank ORDER BY rmp.rank), "
+            "max(fr.last_rank) FROM radio_measured_params rmp "
+            "JOIN radio_observations_params rop ON rmp.rop_id=rop.id "
+            "JOIN observations o ON rop.obs_id=o.id "
+            "JOIN frb_ranks fr ON fr.frb_id=o.frb_id GROUP BY o.frb_id")
+        rows = self.cursor.fetchall()
+        self.assertTrue(rows)
+        for frb_id, ranks, last_rank in rows:
+            self.assertEqual(list(range(1, len(ranks) + 1)), ranks)
+            self.assertEqual(len(ranks), last_rank)
+        self.connection.rollback()
+
+
+if __name__ == '__main__':
+    unittest.main()
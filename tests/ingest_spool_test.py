@@ -0,0 +1,132 @@
+import json
+import os
+import shutil
+import socket
+import subprocess
+import threading
+import time
+import unittest
+from unittest import mock
+from pyfrbcatdb import spool_VOEvent as spool
+from tests.ingest_base import ingesttest
+from tests.voevent_variants import write_variants
+
+
+class spooltest(ingesttest):
+    def setUp(self):
+        ingesttest.setUp(self)
+        self.spool = os.path.join(self.tmpdir, 'spool')
+        os.makedirs(self.spool)
+
+    def count_frbs(self, names):
+        self.cursor.execute("select count(*) from frbs where name = ANY(%s)",
+                            (names,))
+        count = self.cursor.fetchone()[0]
+        self.connection.rollback()
+        return count
+
+    def spool_variants(self, num):
+        '''
+        Write VOEvents to the spool directory as a writer should, under a
+        hidden name and renamed when complete.
+        '''
+        variants = write_variants(self.tmpdir, num)
+        for filename, ivorn, name in variants:
+            hidden = os.path.join(self.spool, '.' + os.path.basename(filename))
+            shutil.copy(filename, hidden)
+            os.rename(hidden, os.path.join(self.spool,
+                                           os.path.basename(filename)))
+        return variants
+
+    def run_spool(self, **kwargs):
+        return spool.spool_VOEvent(self.spool, self.dbName, self.dbHost,
+                                   self.dbPort, self.dbUser, self.dbPassword,
+                                   self.logfile, **kwargs)
+
+    def test_01_once(self):
+        '''
+        Waiting VOEvents are ingested in micro-batches and moved to done/
+        or failed/, other files are left alone
+        '''
+        variants = self.spool_variants(3)
+        with open(os.path.join(self.spool, 'broken.xml'), 'w') as f:
+            f.write('<VOEvent')
+        for name in ['.partial.xml', 'notes.txt']:
+            open(os.path.join(self.spool, name), 'w').close()
+        daemon = self.run_spool(batch_size=2, once=True)
+        self.assertEqual(3, self.count_frbs([v[2] for v in variants]))
+        self.assertEqual(sorted(os.path.basename(v[0]) for v in variants),
+                         sorted(os.listdir(daemon.done)))
+        self.assertEqual(['broken.xml'], os.listdir(daemon.failed))
+        self.assertEqual(['.partial.xml', 'done', 'failed', 'notes.txt',
+                          'status.json', 'work'],
+                         sorted(os.listdir(self.spool)))
+        self.assertEqual([], os.listdir(os.path.join(self.spool, 'work')))
+        self.assertEqual(2, len(daemon.batch_stats))
+        with open(os.path.join(self.spool, 'status.json')) as f:
+            status = json.load(f)
+        self.assertEqual((0, 3, 1), (status['depth'], status['done'],
+                                     status['failed']))
+
+    def test_02_watch(self):
+        '''
+        The daemon ingests VOEvents as they arrive until it is stopped
+        '''
+        daemons = []
+
+        class daemon(spool.spool_VOEvent):
+            def run(self):
+                daemons.append(self)
+                spool.spool_VOEvent.run(self)
+        thread = threading.Thread(target=daemon, args=(
+            self.spool, self.dbName, self.dbHost, self.dbPort, self.dbUser,
+            self.dbPassword, self.logfile), kwargs={'poll_interval': 0.2})
+        thread.start()
+        try:
+            variants = self.spool_variants(2)
+            done = os.path.join(self.spool, 'done')
+            deadline = time.time() + 20
+            while time.time() < deadline and (
+                    not os.path.isdir(done) or len(os.listdir(done)) < 2):
+                time.sleep(0.05)
+        finally:
+            while not daemons:
+                time.sleep(0.05)
+            daemons[0].stop()
+            thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(2, self.count_frbs([v[2] for v in variants]))
+
+    def test_03_recover(self):
+        '''
+        Files claimed by a daemon that is no longer running are ingested
+        '''
+        process = subprocess.Popen(['true'])
+        process.wait()
+        work = os.path.join(self.spool, 'work', '{}.{}'.format(
+            socket.gethostname(), process.pid))
+        os.makedirs(work)
+        variants = write_variants(work, 1)
+        self.run_spool(once=True)
+        self.assertEqual(1, self.count_frbs([variants[0][2]]))
+        self.assertFalse(os.path.exists(work))
+
+    def test_04_commit_failure(self):
+        '''
+        The files of a batch that can not be committed are returned to
+        the spool directory
+        '''
+        variants = self.spool_variants(2)
+
+        def commit_failure(connection, cursor):
+            connection.rollback()
+            return False
+        with mock.patch.object(spool.dbase, 'commitToDB', commit_failure):
+            daemon = self.run_spool(once=True)
+        self.assertEqual(0, self.count_frbs([v[2] for v in variants]))
+        self.assertEqual(2, daemon.status['retried'])
+        self.assertEqual(2, len(daemon.pending()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+import psycopg2.extras
+from pyfrbcatdb import dbase
+from pyfrbcatdb import decode_VOEvent as decode
+from pyfrbcatdb.FRBCat import FRBCat_add
+from pyfrbcatdb.FRBCat import FRBCat_add_cte
+from tests.ingest_base import ingesttest
+from tests.voevent_variants import write_variants
+
+
+class statementstest(ingesttest):
+    def prepared(self, connection):
+        cursor = connection.cursor()
+        cursor.execute("SELECT name FROM pg_prepared_statements")
+        return set(row[0] for row in cursor.fetchall())
+
+    def test_01_prepared(self):
+        '''
+        A registered statement is prepared once per connection and its
+        calls are counted
+        '''
+        stmt = dbase.STATEMENTS['event_id']
+        calls = stmt.calls
+        for idx in range(2):
+            dbase.execute(self.cursor, 'event_id',
+                          ('ivo://frbcatdb.test/none#{}'.format(idx),))
+            self.assertIsNone(self.cursor.fetchone())
+        self.assertIn('event_id', self.prepared(self.connection))
+        self.assertEqual(calls + 2, stmt.calls)
+        self.assertIn(('event_id', stmt.calls, stmt.seconds),
+                      dbase.statement_stats())
+
+    def test_02_fallback(self):
+        '''
+        A statement that can not be prepared is executed unprepared,
+        without aborting the transaction
+        '''
+        dbase.register('test_fallback', "SELECT %s::integer + 1",
+                       ('no_such_type',))
+        dbase.execute(self.cursor, 'test_fallback', (1,))
+        self.assertEqual(2, self.cursor.fetchone()[0])
+        self.assertIsNone(dbase.PREPARED[self.connection])
+        dbase.execute(self.cursor, 'event_id', ('ivo://frbcatdb.test/none',))
+        self.assertIsNone(self.cursor.fetchone())
+        self.assertNotIn('event_id', self.prepared(self.connection))
+        del dbase.STATEMENTS['test_fallback']
+
+    def test_03_quotes(self):
+        '''
+        Ivorns with quotes are inserted, found and retracted
+        '''
+        for add in [FRBCat_add, FRBCat_add_cte]:
+            voevent, ivorn, name = write_variants(self.tmpdir, 1)[0]
+            quoted = ivorn + "'s"
+            with open(voevent) as f:
+                xml = f.read()
+            with open(voevent, 'w') as f:
+                f.write(xml.replace(ivorn, quoted))
+            parser = decode.decode_VOEvent(voevent, self.dbName, self.dbHost,
+                                           self.dbPort, self.dbUser,
+                                           self.dbPassword, self.logfile)
+            mapping, event_type = parser.parse_VOEvent(voevent)
+            connection, cursor = self.connect(psycopg2.extras.DictCursor)
+            self.assertFalse(add(connection, cursor, mapping,
+                                 'new').add_VOEvent_to_FRBCat())
+            connection, cursor = self.connect(psycopg2.extras.DictCursor)
+            self.assertTrue(add(connection, cursor, mapping,
+                                'retraction').retract(quoted))
+            self.cursor.execute(
+                "SELECT o.detected FROM observations o JOIN frbs f ON "
+                "o.frb_id = f.id WHERE f.name = %s", (name,))
+            self.assertEqual([(False,)], self.cursor.fetchall())
+            self.connection.rollback()
+
+
+if __name__ == '__main__':
+    unittest.main()
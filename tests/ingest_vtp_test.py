@@ -0,0 +1,170 @@
+import socket
+import struct
+import threading
+import time
+import unittest
+from lxml import etree
+from pyfrbcatdb import vtp_VOEvent as vtp
+from tests.ingest_base import ingesttest
+from tests.voevent_variants import write_variants
+
+
+def send(sock, message):
+    sock.sendall(struct.pack('!I', len(message)) + message)
+
+
+def receive(sock):
+    '''
+    Read a length-prefixed message and return its root element.
+    '''
+    def read(size):
+        data = b''
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('connection closed')
+            data += chunk
+        return data
+    size = struct.unpack('!I', read(4))[0]
+    return etree.fromstring(read(size))
+
+
+class vtptest(ingesttest):
+    def count_frbs(self, names):
+        self.cursor.execute("select count(*) from frbs where name = ANY(%s)",
+                            (names,))
+        count = self.cursor.fetchone()[0]
+        self.connection.rollback()
+        return count
+
+    def voevents(self, num):
+        variants = write_variants(self.tmpdir, num)
+        messages = []
+        for filename, ivorn, name in variants:
+            with open(filename, 'rb') as f:
+                messages.append(f.read())
+        return variants, messages
+
+    def start(self, receiver=vtp.vtp_VOEvent, **kwargs):
+        '''
+        Run a receiver in a thread and return it once it is receiving.
+        '''
+        receivers = []
+
+        class capture(receiver):
+            def run(self):
+                receivers.append(self)
+                receiver.run(self)
+        kwargs.setdefault('port', 0)
+        self.thread = threading.Thread(target=capture, args=(
+            self.dbName, self.dbHost, self.dbPort, self.dbUser,
+            self.dbPassword, self.logfile), kwargs=kwargs)
+        self.thread.start()
+        deadline = time.time() + 10
+        while time.time() < deadline and not (
+                receivers and receivers[0].loop and
+                (receivers[0].port or receivers[0].broker)):
+            time.sleep(0.05)
+        return receivers[0]
+
+    def stop(self, receiver):
+        receiver.stop()
+        self.thread.join(20)
+        self.assertFalse(self.thread.is_alive())
+
+    def test_01_receive(self):
+        '''
+        VOEvents sent to the receiver are acknowledged and ingested,
+        invalid messages are rejected and iamalive messages answered
+        '''
+        variants, messages = self.voevents(2)
+        receiver = self.start(host='127.0.0.1')
+        try:
+            with socket.create_connection(('127.0.0.1', receiver.port),
+                                          timeout=10) as sock:
+                for (filename, ivorn, name), message in zip(variants,
+                                                            messages):
+                    send(sock, message)
+                    ack = receive(sock)
+                    self.assertEqual('ack', ack.get('role'))
+                    self.assertEqual(ivorn, ack.findtext('Origin'))
+                    self.assertEqual('ivo://frbcatdb/vtp',
+                                     ack.findtext('Response'))
+                send(sock, b'<VOEvent')
+                self.assertEqual('nak', receive(sock).get('role'))
+                send(sock, vtp.transport('iamalive', 'ivo://broker', None))
+                alive = receive(sock)
+                self.assertEqual('iamalive', alive.get('role'))
+                self.assertEqual('ivo://broker', alive.findtext('Origin'))
+        finally:
+            self.stop(receiver)
+        self.assertEqual(2, self.count_frbs([v[2] for v in variants]))
+        self.assertEqual(1, receiver.status['rejected'])
+
+    def test_02_subscribe(self):
+        '''
+        The receiver subscribes to a broker and acknowledges the
+        VOEvents the broker sends
+        '''
+        variants, messages = self.voevents(3)
+        broker = socket.socket()
+        broker.bind(('127.0.0.1', 0))
+        broker.listen(1)
+        broker.settimeout(10)
+        receiver = self.start(broker=broker.getsockname())
+        try:
+            sock, address = broker.accept()
+            with sock:
+                sock.settimeout(10)
+                for message in messages:
+                    send(sock, message)
+                acks = [receive(sock) for message in messages]
+        finally:
+            broker.close()
+            self.stop(receiver)
+        self.assertEqual([v[1] for v in variants],
+                         [ack.findtext('Origin') for ack in acks])
+        self.assertEqual(3, self.count_frbs([v[2] for v in variants]))
+
+    def test_03_backpressure(self):
+        '''
+        A full queue holds back the acks until the writer catches up,
+        a batch that can not be committed is retried
+        '''
+        variants, messages = self.voevents(3)
+        release = threading.Event()
+        attempts = []
+
+        class slow(vtp.vtp_VOEvent):
+            def ingest(self, voevents):
+                attempts.append(len(voevents))
+                release.wait(20)
+                if len(attempts) == 1:
+                    # first commit fails
+                    return False
+                return vtp.vtp_VOEvent.ingest(self, voevents)
+        receiver = self.start(slow, host='127.0.0.1', queue_size=1,
+                              retry_interval=0.1)
+        try:
+            with socket.create_connection(('127.0.0.1', receiver.port),
+                                          timeout=10) as sock:
+                for message in messages:
+                    send(sock, message)
+                # the first VOEvent is written, the second queued
+                acks = [receive(sock) for message in messages[:2]]
+                sock.settimeout(0.5)
+                with self.assertRaises(socket.timeout):
+                    receive(sock)
+                release.set()
+                sock.settimeout(10)
+                acks.append(receive(sock))
+        finally:
+            self.stop(receiver)
+        self.assertEqual([v[1] for v in variants],
+                         [ack.findtext('Origin') for ack in acks])
+        self.assertEqual(3, self.count_frbs([v[2] for v in variants]))
+        self.assertEqual(1, receiver.status['retried'])
+
+
+if __name__ == '__main__':
+    unittest.main()
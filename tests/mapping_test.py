@@ -0,0 +1,91 @@
+import os
+import glob
+import logging
+import unittest
+import voeventparse as vp
+from os.path import dirname, abspath
+from pyfrbcatdb.FRBCat import load_mapping
+from pyfrbcatdb.FRBCat import parse_mapping
+from pyfrbcatdb.decode_VOEvent import decode_VOEvent
+from pyfrbcatdb.decode_VOEvent import compile_mapping
+from pyfrbcatdb.decode_VOEvent import index_params
+
+
+class parser(decode_VOEvent):
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+
+
+class mappingtest(unittest.TestCase):
+    def setUp(self):
+        self.test_data = os.path.join(dirname(abspath(__file__)), '..',
+                                      'test_data')
+        self.parser = parser()
+
+    def test_01_frozen(self):
+        '''
+        mapping.json is loaded and compiled once and cannot be modified
+        '''
+        self.assertIs(load_mapping(), load_mapping())
+        self.assertIs(compile_mapping(), compile_mapping())
+        with self.assertRaises(TypeError):
+            load_mapping()['authors'][0]['value'] = 'x'
+        self.assertEqual(parse_mapping().keys(), compile_mapping().keys())
+
+    def test_02_fresh_result(self):
+        '''
+        Each parsed VOEvent gets its own result, equal to parsing with
+        the uncompiled mapping dictionary
+        '''
+        files = ['Detection_unitTest1.xml', 'Notes_unitTest1.xml',
+                 'Confirmation_unitTest1.xml', 'Retraction_unitTest1.xml']
+        for xml in files:
+            xml = os.path.join(self.test_data, xml)
+            first, event_type = self.parser.parse_VOEvent(xml)
+            second, _ = self.parser.parse_VOEvent(xml, parse_mapping())
+            self.assertIsNot(first, second)
+            self.assertEqual(first, second)
+        detection, _ = self.parser.parse_VOEvent(
+            os.path.join(self.test_data, 'Detection_unitTest1.xml'))
+        notes, _ = self.parser.parse_VOEvent(
+            os.path.join(self.test_data, 'Notes_unitTest1.xml'))
+        self.assertNotEqual(detection['radio_measured_params'],
+                            notes['radio_measured_params'])
+
+    def test_03_param_index(self):
+        '''
+        Params and descriptions from the param index equal the ones
+        from vp.get_grouped_params and a search of the VOEvent tree
+        '''
+        items = [item for table in load_mapping().values()
+                 for item in table if item.get('type') == 'Param']
+        for xml in glob.glob(os.path.join(self.test_data, '*.xml')):
+            with open(xml, 'rb') as f:
+                v = vp.load(f)
+            index = index_params(v)
+            try:
+                grouped = vp.get_grouped_params(v)
+            except AttributeError:
+                self.assertEqual({}, index)
+                continue
+            for item in items:
+                group = item.get('param_group')
+                name = item.get('param_name')
+                try:
+                    expected = grouped.get(group).get(name).get('value')
+                except AttributeError:
+                    expected = None
+                self.assertEqual(expected, self.parser.get_param(
+                    index, group, name))
+                try:
+                    note = v.find(".//Group[@name='{}']".format(group)).find(
+                        ".//Param[@name='{}']".format(name)).Description
+                    expected = "[{}] {}".format(name, note) if note else None
+                except AttributeError:
+                    expected = None
+                self.assertEqual(expected, self.parser.get_description(
+                    index, item))
+
+
+if __name__ == '__main__':
+    unittest.main()
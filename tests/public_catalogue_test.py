@@ -0,0 +1,142 @@
+import io
+import unittest
+from pyfrbcatdb import backfill_VOEvent as backfill
+from pyfrbcatdb import batch_VOEvent as batch
+from pyfrbcatdb import decode_VOEvent as decode
+from pyfrbcatdb import public_catalogue
+from pyfrbcatdb import writeCSV
+from tests.ingest_base import ingesttest
+from tests.voevent_variants import write_variants
+
+
+class cataloguetest(ingesttest):
+    def scenario(self, prefix):
+        '''
+        Write detections, a followup, a supersedes, a retraction of the
+        followup and a later event of the superseded FRB. Return the
+        files, the ivorn of the public event and the ivorns of the
+        events that are not public: the supersedes is not verified and
+        the followup is retracted.
+        '''
+        det = write_variants(self.tmpdir, 2, prefix=prefix)
+        follow = write_variants(self.tmpdir, 1,
+                                template='Subsequent_unitTest1.xml',
+                                cite=det[0][1], name=det[0][2])
+        sup = write_variants(self.tmpdir, 1,
+                             template='Confirmation_unitTest1.xml',
+                             cite=det[1][1], name=det[1][2])
+        retract = write_variants(self.tmpdir, 1,
+                                 template='Retraction_unitTest1.xml',
+                                 cite=follow[0][1])
+        later = write_variants(self.tmpdir, 1, name=det[1][2])
+        files = [v[0] for v in det + follow + sup + retract + later]
+        return files, [det[0][1]], [det[1][1], follow[0][1], later[0][1]]
+
+    def check(self):
+        return public_catalogue.check_public_catalogue(
+            self.dbName, self.dbHost, self.dbPort, self.dbUser,
+            self.dbPassword)
+
+    def assertConsistent(self):
+        self.assertEqual({'missing': [], 'extra': [], 'different': []},
+                         self.check())
+
+    def stored(self, ivorns):
+        self.cursor.execute("SELECT voevent_ivorn FROM public_catalogue "
+                            "WHERE voevent_ivorn = ANY(%s)", (ivorns,))
+        stored = sorted(row[0] for row in self.cursor.fetchall())
+        self.connection.rollback()
+        return stored
+
+    def test_01_ingest(self):
+        '''
+        Inserts, supersedes and retractions of all ingest modes keep
+        the public_catalogue table up to date
+        '''
+        ingests = [
+            lambda files: [decode.decode_VOEvent(
+                f, self.dbName, self.dbHost, self.dbPort, self.dbUser,
+                self.dbPassword, self.logfile) for f in files],
+            lambda files: [decode.decode_VOEvent(
+                f, self.dbName, self.dbHost, self.dbPort, self.dbUser,
+                self.dbPassword, self.logfile, cte=True) for f in files],
+            lambda files: batch.batch_VOEvent(
+                files, self.dbName, self.dbHost, self.dbPort, self.dbUser,
+                self.dbPassword, self.logfile, batch_size=len(files)),
+            lambda files: backfill.backfill_VOEvent(
+                files, self.dbName, self.dbHost, self.dbPort, self.dbUser,
+                self.dbPassword, self.logfile)]
+        for idx, ingest in enumerate(ingests):
+            files, public, hidden = self.scenario('FRBPUB{}_'.format(idx))
+            ingest(files)
+            self.assertEqual(public, self.stored(public + hidden))
+            self.assertConsistent()
+
+    def test_02_private(self):
+        '''
+        Rows of an FRB are removed and added when it is made private or
+        public
+        '''
+        voevent, ivorn, name = write_variants(self.tmpdir, 1)[0]
+        decode.decode_VOEvent(voevent, self.dbName, self.dbHost,
+                              self.dbPort, self.dbUser, self.dbPassword,
+                              self.logfile)
+        self.assertEqual([ivorn], self.stored([ivorn]))
+        for private, stored in [(True, []), (False, [ivorn])]:
+            self.cursor.execute("UPDATE frbs SET private = %s WHERE "
+                                "name = %s", (private, name))
+            self.connection.commit()
+            self.assertEqual(stored, self.stored([ivorn]))
+        self.assertConsistent()
+
+    def test_03_refresh(self):
+        '''
+        The checker finds the differences of changes made without the
+        triggers, a full refresh removes them
+        '''
+        variants = write_variants(self.tmpdir, 3)
+        for voevent, ivorn, name in variants:
+            decode.decode_VOEvent(voevent, self.dbName, self.dbHost,
+                                  self.dbPort, self.dbUser,
+                                  self.dbPassword, self.logfile)
+        self.cursor.execute("SELECT voevent_ivorn, rmp_id FROM "
+                            "public_catalogue WHERE voevent_ivorn = ANY(%s)",
+                            ([v[1] for v in variants],))
+        ids = dict(self.cursor.fetchall())
+        ids = [ids[v[1]] for v in variants]
+        self.cursor.execute("SET session_replication_role = replica")
+        self.cursor.execute("DELETE FROM public_catalogue WHERE rmp_id = %s",
+                            (ids[0],))
+        self.cursor.execute("UPDATE radio_measured_params SET dm = dm + 1 "
+                            "WHERE id = %s", (ids[1],))
+        self.cursor.execute("UPDATE observations SET verified = FALSE "
+                            "WHERE frb_id = (SELECT id FROM frbs WHERE "
+                            "name = %s)", (variants[2][2],))
+        self.connection.commit()
+        self.assertEqual({'missing': [ids[0]], 'extra': [ids[2]],
+                          'different': [ids[1]]}, self.check())
+        public_catalogue.refresh_public_catalogue(
+            self.dbName, self.dbHost, self.dbPort, self.dbUser,
+            self.dbPassword)
+        self.assertConsistent()
+        self.assertEqual(sorted(v[1] for v in variants[:2]),
+                         self.stored([v[1] for v in variants]))
+
+    def test_04_export(self):
+        '''
+        The export from the public_catalogue table is the export of the
+        joined tables
+        '''
+        exports = []
+        for table in [False, True]:
+            csvfile = io.BytesIO()
+            self.cursor.copy_expert(writeCSV.writeCSV.defineSQLStatement(
+                None, table), csvfile)
+            exports.append(csvfile.getvalue())
+        self.connection.rollback()
+        self.assertEqual(exports[0], exports[1])
+        self.assertGreater(exports[1].count(b'\n'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import unittest
+import voeventparse as vp
+from lxml import etree
+from os.path import dirname, abspath
+from pyfrbcatdb.validation import validator
+
+
+class validationtest(unittest.TestCase):
+    def setUp(self):
+        xml = os.path.join(dirname(abspath(__file__)), '..', 'test_data',
+                           'Detection_unitTest1.xml')
+        with open(xml, 'rb') as f:
+            self.xml = f.read()
+        self.ivorn = vp.loads(self.xml).attrib['ivorn']
+
+    def load(self, old=None, new=None):
+        xml = self.xml
+        if old:
+            xml = xml.replace(old, new)
+        return vp.loads(xml)
+
+    def test_01_tiers(self):
+        '''
+        A valid VOEvent passes all tiers
+        '''
+        for tier in ['full', 'structural', 'off']:
+            self.assertEqual(tier, validator(tier, [self.ivorn]).validate(
+                self.load()))
+        with self.assertRaises(ValueError):
+            validator('partial')
+
+    def test_02_structural(self):
+        '''
+        Structural validation only checks what pyfrbcatdb relies on
+        '''
+        # unknown element, not valid according to the schema
+        v = self.load(b'<Who>', b'<Who><Unknown/>')
+        with self.assertRaises(etree.DocumentInvalid):
+            validator('full').validate(v)
+        v = self.load(b'<Who>', b'<Who><Unknown/>')
+        self.assertEqual('structural', validator('structural').validate(v))
+        for old, new in [(b'role="observation"', b'role="unknown"'),
+                         (b'Who>', b'Whom>')]:
+            v = self.load(old, new)
+            with self.assertRaises(etree.DocumentInvalid):
+                validator('structural').validate(v)
+
+    def test_03_trusted(self):
+        '''
+        Validation is only skipped for trusted sources
+        '''
+        v = self.load(b'<Who>', b'<Who><Unknown/>')
+        prefix = self.ivorn.split('#')[0]
+        self.assertEqual('off', validator('off', [prefix]).validate(v))
+        v = self.load(b'<Who>', b'<Who><Unknown/>')
+        with self.assertRaises(etree.DocumentInvalid):
+            validator('off', ['ivo://trusted.org']).validate(v)
+
+
+if __name__ == '__main__':
+    unittest.main()
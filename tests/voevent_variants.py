@@ -0,0 +1,43 @@
+'''
+Helpers to write uniquely named copies of the VOEvent test data,
+so tests can insert new events independent of earlier tests.
+'''
+import os
+import re
+import uuid
+from os.path import dirname, abspath
+
+test_data = os.path.join(dirname(abspath(__file__)), '..', 'test_data')
+
+
+def write_variants(directory, num, template='Detection_unitTest1.xml',
+                   prefix='FRBTEST', cite=None, name=None):
+    '''
+    Write num copies of template into directory, each with a unique
+    event ivorn and FRB name. If cite is given, the cited event ivorn
+    of the template is replaced by cite. If name is given, all copies
+    use that FRB name.
+
+    :returns: list of (filename, event ivorn, FRB name)
+    :rtype: list
+    '''
+    with open(os.path.join(test_data, template)) as f:
+        xml = f.read()
+    tag = uuid.uuid4().hex[:8]
+    variants = []
+    for idx in range(num):
+        frb = name or '{}{}_{}'.format(prefix, tag, idx)
+        ivorn = 'ivo://frbcatdb.test/{}#{}'.format(tag, idx)
+        text = re.sub(r' ivorn="[^"]*"', ' ivorn="{}"'.format(ivorn), xml,
+                      count=1)
+        text = re.sub(r'<Name>[^<]*</Name>', '<Name>{}</Name>'.format(frb),
+                      text, count=1)
+        if cite:
+            text = re.sub(r'(<EventIVORN[^>]*>)[^<]*', r'\g<1>' + cite,
+                          text, count=1)
+        filename = os.path.join(directory, '{}{}_{}.xml'.format(prefix, tag,
+                                                                idx))
+        with open(filename, 'w') as f:
+            f.write(text)
+        variants.append((filename, ivorn, frb))
+    return variants